@@ -1,7 +1,44 @@
-import uuid, time
-from .utils import read_json, write_json
-from .config import API_KEYS_FILE, API_IMAGE_QUOTA, API_VIDEO_QUOTA
+import uuid, time, hashlib, threading, bisect
+from .utils import read_json, write_json, file_stamp, page_range
+from .config import API_KEYS_FILE, API_IMAGE_QUOTA, API_VIDEO_QUOTA, QUOTA_SHM_FILE, QUOTA_FLUSH_INTERVAL, SHARED_TABLE_SLOTS
 from .logger import app_logger, audit_logger
+from .quota import QuotaEngine, FIELDS as QUOTA_FIELDS
+
+# In-memory index over api_keys.json: sha256(api_key) -> client and email -> clients.
+# Every lookup compares the file's (inode, mtime, size) stamp, so writes from other
+# workers are picked up on the next call without re-parsing the file each time.
+# "sorted" holds (email, kid) for paginated admin listings; "by_kid" resolves it.
+_index = {"stamp": None, "doc": {"clients": []}, "by_key": {}, "by_email": {}, "by_kid": {}, "sorted": []}
+_index_lock = threading.RLock()
+
+def key_digest(key):
+    return hashlib.sha256(str(key).encode("utf-8")).hexdigest()
+
+def _add_to_index(client):
+    if client.get("api_key"):
+        _index["by_key"][key_digest(client["api_key"])] = client
+    _index["by_email"].setdefault(client.get("email"), []).append(client)
+    kid = client.get("kid") or client.get("api_key") or ""
+    _index["by_kid"][kid] = client
+    bisect.insort(_index["sorted"], (client.get("email") or "", kid))
+
+def _rebuild(doc, stamp):
+    if "clients" not in doc:
+        doc = {"clients": doc if isinstance(doc, list) else []}
+    _index.update({"stamp": stamp, "doc": doc, "by_key": {}, "by_email": {}, "by_kid": {}, "sorted": []})
+    for c in doc.get("clients", []):
+        _add_to_index(c)
+
+def _current():
+    stamp = file_stamp(API_KEYS_FILE)
+    with _index_lock:
+        if stamp != _index["stamp"]:
+            _rebuild(read_json(API_KEYS_FILE, {"clients": []}), stamp)
+        return _index
+
+def _save():
+    # caller holds _index_lock
+    _index["stamp"] = write_json(API_KEYS_FILE, _index["doc"])
 
 def ensure_api_file():
     d = read_json(API_KEYS_FILE, {"clients":[]})
@@ -11,7 +48,6 @@ def ensure_api_file():
     return d
 
 def create_api_key_for_user(email):
-    d = read_json(API_KEYS_FILE, {"clients":[]})
     key = uuid.uuid4().hex
     client = {
         "kid": uuid.uuid4().hex[:8],
@@ -21,52 +57,110 @@ def create_api_key_for_user(email):
         "quota": {"image_limit": API_IMAGE_QUOTA, "video_limit": API_VIDEO_QUOTA, "image_used": 0, "video_used": 0, "reset_ts": None},
         "created": int(time.time())
     }
-    d.setdefault("clients", []).append(client)
-    write_json(API_KEYS_FILE, d)
+    with _index_lock:
+        idx = _current()
+        idx["doc"].setdefault("clients", []).append(client)
+        _add_to_index(client)
+        _save()
     app_logger.info("API key created for %s", email)
     return client
 
 def find_client_by_key(key):
-    d = read_json(API_KEYS_FILE, {"clients":[]})
-    for c in d.get("clients", []):
-        if c.get("api_key") == key:
-            return c
-    return None
+    return _current()["by_key"].get(key_digest(key))
 
-def consume_quota(client, media_type):
-    import time
-    d = read_json(API_KEYS_FILE, {"clients":[]})
-    quota = client.setdefault("quota", {})
-    now = int(time.time())
-    reset = quota.get("reset_ts") or now + 86400
-    if now >= reset:
-        quota["image_used"] = 0
-        quota["video_used"] = 0
-        quota["reset_ts"] = now + 86400
-    if media_type == "image":
-        if quota.get("image_used", 0) + 1 > quota.get("image_limit", API_IMAGE_QUOTA):
-            return False
-        quota["image_used"] = quota.get("image_used", 0) + 1
-    else:
-        if quota.get("video_used", 0) + 1 > quota.get("video_limit", API_VIDEO_QUOTA):
+def find_clients_by_email(email):
+    return list(_current()["by_email"].get(email, []))
+
+def clients_page(cursor=None, limit=50, email=None, status=None):
+    """API clients ordered by email; returns (clients, next_cursor)."""
+    with _index_lock:
+        idx = _current()
+        lo, hi = (email, email) if email is not None else (None, None)
+        match = (lambda kid: idx["by_kid"][kid].get("status") == status) if status is not None else None
+        keys, next_cursor = page_range(idx["sorted"], cursor, limit, lo=lo, hi=hi, match=match)
+        return [dict(idx["by_kid"][kid]) for _, kid in keys], next_cursor
+
+def client_counts():
+    with _index_lock:
+        clients = _current()["by_kid"].values()
+        return {"total": len(clients), "blocked": sum(1 for c in clients if c.get("status") == "blocked")}
+
+def is_client_blocked(key):
+    client = find_client_by_key(key)
+    return client is not None and client.get("status") == "blocked"
+
+def _persist_quota(snapshot):
+    """Write flushed counters {api_key: {image_used, video_used, reset_ts, epoch}} back in one save."""
+    with _index_lock:
+        idx = _current()
+        for key, counters in snapshot.items():
+            client = idx["by_key"].get(key_digest(key))
+            if client is None:
+                continue
+            quota = client.setdefault("quota", {})
+            if counters["epoch"] != int(quota.get("epoch", 0)):
+                continue  # counted before an admin reset; the record wins
+            quota.update(counters)
+        _save()
+
+def _consume_durable(key, step):
+    """Count directly in api_keys.json (used when the shared table is full)."""
+    with _index_lock:
+        client = _current()["by_key"].get(key_digest(key))
+        if client is None:
             return False
-        quota["video_used"] = quota.get("video_used", 0) + 1
-    # persist
-    for i, c in enumerate(d.get("clients", [])):
-        if c.get("api_key") == client.get("api_key"):
-            d["clients"][i] = client
-            break
-    write_json(API_KEYS_FILE, d)
-    return True
+        quota = client.setdefault("quota", {})
+        values, ok = step([int(quota.get(f) or 0) for f in QUOTA_FIELDS])
+        quota.update(zip(QUOTA_FIELDS, values))
+        _save()
+        return ok
+
+quota_engine = QuotaEngine(QUOTA_SHM_FILE, _persist_quota, _consume_durable,
+                           flush_interval=QUOTA_FLUSH_INTERVAL, slots=SHARED_TABLE_SLOTS)
+
+def consume_quota(client, media_type):
+    quota = client.get("quota", {})
+    limits = {"image_limit": quota.get("image_limit", API_IMAGE_QUOTA), "video_limit": quota.get("video_limit", API_VIDEO_QUOTA)}
+    return quota_engine.consume(client.get("api_key"), quota, media_type, limits)
+
+def live_quota(client):
+    """Client quota with counters not yet flushed to api_keys.json applied."""
+    quota = dict(client.get("quota", {}))
+    current = quota_engine.current(client.get("api_key")) if client.get("api_key") else None
+    if current and current["epoch"] >= int(quota.get("epoch", 0)):
+        quota.update(current)
+    return quota
+
+def set_client_quota(kid, image_limit=None, video_limit=None, reset=False):
+    """
+    Admin quota write. Bumps the record's epoch so every worker reseeds its shared
+    counters from api_keys.json instead of keeping counts from before the change.
+    Returns the updated client, or None if kid is unknown.
+    """
+    with _index_lock:
+        client = _current()["by_kid"].get(kid)
+        if client is None:
+            return None
+        quota = dict(live_quota(client))
+        if image_limit is not None:
+            quota["image_limit"] = int(image_limit)
+        if video_limit is not None:
+            quota["video_limit"] = int(video_limit)
+        if reset:
+            quota.update(image_used=0, video_used=0, reset_ts=None)
+        quota["epoch"] = int(quota.get("epoch", 0)) + 1
+        client["quota"] = quota
+        _save()
+    audit_logger.info("Quota for API client %s set to %s", kid, quota)
+    return dict(client)
 
 def block_client(email):
-    d = read_json(API_KEYS_FILE, {"clients":[]})
-    changed = False
-    for c in d.get("clients", []):
-        if c.get("email") == email:
+    with _index_lock:
+        clients = _current()["by_email"].get(email, [])
+        for c in clients:
             c["status"] = "blocked"
-            changed = True
-    if changed:
-        write_json(API_KEYS_FILE, d)
-        audit_logger = audit_logger if 'audit_logger' in globals() else None
+        changed = bool(clients)
+        if changed:
+            _save()
+            audit_logger.info("Blocked API clients for %s", email)
     return changed
@@ -1,11 +1,17 @@
 from fastapi import HTTPException, Request
 from fastapi.security import HTTPBearer
 from jose import jwt, JWTError
-import bcrypt
-from .config import JWT_SECRET, ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS, ADMIN_EMAIL, USERS_FILE
-from .utils import read_json, write_json, ensure_json, now_iso
+import hashlib, threading, time
+from collections import OrderedDict
+from .config import (
+    JWT_SECRET, ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS, ADMIN_EMAIL,
+    AUTH_CACHE_SIZE, AUTH_CACHE_TTL, AUTH_LOG_SAMPLE_RATE
+)
+from .utils import now_iso
+from . import user_directory
 from datetime import datetime, timedelta
 from .logger import app_logger, audit_logger
+from .passwords import hash_password, check_password
 
 security = HTTPBearer()
 
@@ -19,7 +25,78 @@ def create_refresh_token(sub: str, days=REFRESH_TOKEN_EXPIRE_DAYS):
     payload = {"sub": sub, "type": "refresh", "exp": int(exp.timestamp())}
     return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
 
+# Verified-token cache: sha256(token) -> (payload, expires_at). Per process, bounded LRU.
+_token_cache = OrderedDict()
+_tokens_by_sub = {}
+_token_lock = threading.Lock()
+_auth_stats = {"hits": 0, "misses": 0, "failures": 0, "hit_ns": 0, "miss_ns": 0}
+
+def _cache_get(digest, now):
+    with _token_lock:
+        item = _token_cache.get(digest)
+        if item is None:
+            return None
+        payload, expires_at = item
+        if now >= expires_at:
+            _cache_drop(digest)
+            return None
+        _token_cache.move_to_end(digest)
+        return payload
+
+def _cache_put(digest, payload, now):
+    exp = payload.get("exp")
+    expires_at = now + AUTH_CACHE_TTL
+    if isinstance(exp, (int, float)):
+        expires_at = min(expires_at, exp)
+    with _token_lock:
+        _token_cache[digest] = (payload, expires_at)
+        _tokens_by_sub.setdefault(payload.get("sub"), set()).add(digest)
+        while len(_token_cache) > AUTH_CACHE_SIZE:
+            _cache_drop(next(iter(_token_cache)))
+
+def _count(event, ns=0):
+    """Bump a verification counter; returns its new value."""
+    with _token_lock:
+        _auth_stats[event + "s"] += 1
+        if ns:
+            _auth_stats[event + "_ns"] += ns
+        return _auth_stats[event + "s"]
+
+def _cache_drop(digest):
+    # caller holds _token_lock
+    item = _token_cache.pop(digest, None)
+    if item is not None:
+        digests = _tokens_by_sub.get(item[0].get("sub"))
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                _tokens_by_sub.pop(item[0].get("sub"), None)
+
+def revoke_cached_tokens(sub):
+    """
+    Drop every cached verification for `sub` (logout, block, revoke) so the next request re-verifies.
+    Other workers converge within AUTH_CACHE_TTL seconds.
+    """
+    with _token_lock:
+        for digest in list(_tokens_by_sub.get(sub, ())):
+            _cache_drop(digest)
+
+def auth_stats():
+    """Verification counters and mean cost per request in microseconds."""
+    with _token_lock:
+        s = dict(_auth_stats)
+        size = len(_token_cache)
+    return {
+        "cache_size": size,
+        "hits": s["hits"],
+        "misses": s["misses"],
+        "failures": s["failures"],
+        "avg_hit_us": round(s["hit_ns"] / s["hits"] / 1000, 2) if s["hits"] else None,
+        "avg_miss_us": round(s["miss_ns"] / s["misses"] / 1000, 2) if s["misses"] else None,
+    }
+
 def verify_token(request: Request):
+    start = time.perf_counter_ns()
     token = None
     auth = request.headers.get("Authorization")
     if auth and auth.startswith("Bearer "):
@@ -29,30 +106,34 @@ def verify_token(request: Request):
         token = request.cookies.get("access_token")
     if not token:
         raise HTTPException(status_code=401, detail="Missing token")
+    digest = hashlib.sha256(token.encode("utf-8")).digest()
+    now = time.time()
+    payload = _cache_get(digest, now)
+    if payload is not None:
+        _count("hit", time.perf_counter_ns() - start)
+        return dict(payload)  # callers may modify theirs; the cached one is shared
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        app_logger.info("Token verified for user %s", payload.get("sub"))
-        return payload
     except JWTError as e:
+        _count("failure")
         app_logger.error("Token verify failed: %s", e)
         raise HTTPException(status_code=401, detail="Invalid token")
+    _cache_put(digest, dict(payload), now)
+    misses = _count("miss", time.perf_counter_ns() - start)
+    if AUTH_LOG_SAMPLE_RATE > 0 and (misses - 1) % AUTH_LOG_SAMPLE_RATE == 0:
+        app_logger.info("Token verified for user %s (sampled 1/%d)", payload.get("sub"), AUTH_LOG_SAMPLE_RATE)
+    return payload
 
 def get_user(email):
-    users = read_json(USERS_FILE, [])
-    for u in users:
-        if u.get("user") == email:
-            return u
-    return None
+    return user_directory.get_user(email)
 
 def register_user(email, password, role="client"):
-    ensure_json(USERS_FILE, [])
-    users = read_json(USERS_FILE, [])
-    if any(u.get("user") == email for u in users):
+    if user_directory.get_user(email) is not None:
+        raise HTTPException(status_code=400, detail="Already exists")
+    hashed = hash_password(password)
+    new = {"user": email, "password": hashed, "role": role, "status": "active", "api_key": "", "usage": {"images":0,"videos":0}, "created_at": now_iso(), "last_login": None}
+    if user_directory.create_user(new) is None:
         raise HTTPException(status_code=400, detail="Already exists")
-    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-    new = {"user": email, "password": hashed, "role": role, "status": "active", "api_key": "", "usage": {"images":0,"videos":0}, "refresh_tokens": [], "created_at": now_iso(), "last_login": None}
-    users.append(new)
-    write_json(USERS_FILE, users)
     app_logger.info("Registered user %s", email)
     return new
 
@@ -64,9 +145,10 @@ def authenticate_user(email, password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     if user.get("status") == "blocked":
         raise HTTPException(status_code=403, detail="Blocked")
-    if not bcrypt.checkpw(password.encode('utf-8'), user.get("password").encode('utf-8')):
+    if not check_password(password, user.get("password")):
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    # Set role based on email
+    # Set role based on email (on a copy; directory records are read-only)
+    user = dict(user)
     if email == ADMIN_EMAIL:
         user["role"] = "admin"
     else:
@@ -74,15 +156,11 @@ def authenticate_user(email, password):
     return user
 
 def revoke_refresh_token(email, token):
-    users = read_json(USERS_FILE, [])
-    for u in users:
-        if u.get("user") == email:
-            tokens = u.setdefault("refresh_tokens", [])
-            if token in tokens:
-                tokens.remove(token)
-                write_json(USERS_FILE, users)
-                return True
-    return False
+    if user_directory.refresh_token_owner(token) != email:
+        return False
+    user_directory.revoke_refresh_token(token)
+    revoke_cached_tokens(email)
+    return True
 
 def ensure_admin(email):
     return email == ADMIN_EMAIL
@@ -6,16 +6,20 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 DATA_DIR = BASE_DIR / "data"
 UPLOADS_DIR = DATA_DIR / "uploads"
 MODELS_DIR = BASE_DIR / "models"
-PRIORITY_DIR = MODELS_DIR / "priority_feedback"
+PRIORITY_DIR = MODELS_DIR / "priority_feedback"  # legacy per-item files; imported into PRIORITY_QUEUE_FILE
+PRIORITY_QUEUE_FILE = MODELS_DIR / "priority_feedback.jsonl"
 
-USERS_FILE = DATA_DIR / "users.json"
+USERS_FILE = DATA_DIR / "users.json"  # legacy; imported into USERS_STORE_FILE on first start
+USERS_STORE_FILE = DATA_DIR / "users.jsonl"
 API_KEYS_FILE = DATA_DIR / "api_keys.json"
-FEEDBACK_FILE = DATA_DIR / "feedback.json"
-MODEL_COMPARISON_FILE = DATA_DIR / "model_comparison.json"
-RETRAINING_FILE = DATA_DIR / "retraining.json"
+FEEDBACK_FILE = DATA_DIR / "feedback.json"  # legacy; imported into FEEDBACK_STORE_FILE on first start
+FEEDBACK_STORE_FILE = DATA_DIR / "feedback.jsonl"
+MODEL_COMPARISON_FILE = DATA_DIR / "model_comparison.json"  # legacy; imported into FEEDBACK_STORE_FILE
+RETRAINING_FILE = DATA_DIR / "retraining.json"  # legacy; imported into FEEDBACK_STORE_FILE as id manifests
 API_USAGE_FILE = DATA_DIR / "api_usage.json"
-ADMIN_AUDIT_FILE = DATA_DIR / "admin_audit.json"
-FEEDBACK_SECTORS_FILE = DATA_DIR / "feedback_sectors.json"
+API_USAGE_DAYS_DIR = DATA_DIR / "api_usage_days"  # <day>.json copies of API_USAGE_FILE entries, for paging by day
+ADMIN_AUDIT_FILE = DATA_DIR / "admin_audit.json"  # legacy; imported into FEEDBACK_STORE_FILE
+FEEDBACK_SECTORS_FILE = DATA_DIR / "feedback_sectors.json"  # legacy; imported into FEEDBACK_STORE_FILE
 CACHE_FILE = DATA_DIR / "cache.json"
 REPORTS_DIR = DATA_DIR / "reports"
 SETTINGS_FILE = DATA_DIR / "settings.json"
@@ -32,6 +36,56 @@ SECONDARY_ROTATION_DAYS = int(os.environ.get("SECONDARY_ROTATION_DAYS", 7))
 
 # Rate-limiter (moved up to avoid circular import)
 RATE_LIMIT_REQUESTS_PER_MIN = int(os.environ.get("RATE_LIMIT_REQUESTS_PER_MIN", 30))
+RATE_LIMIT_USER_PER_MIN = int(os.environ.get("RATE_LIMIT_USER_PER_MIN", RATE_LIMIT_REQUESTS_PER_MIN))
+RATE_LIMIT_KEY_PER_MIN = int(os.environ.get("RATE_LIMIT_KEY_PER_MIN", RATE_LIMIT_REQUESTS_PER_MIN))
+RATE_LIMIT_IP_PER_MIN = int(os.environ.get("RATE_LIMIT_IP_PER_MIN", RATE_LIMIT_REQUESTS_PER_MIN * 2))
+RATE_LIMIT_SHM_FILE = DATA_DIR / "ratelimit.shm"
+SHARED_TABLE_SLOTS = int(os.environ.get("SHARED_TABLE_SLOTS", 65536))
+
+# Write-behind usage counters (api_usage.json, upload_count.json)
+UPLOAD_COUNT_FILE = DATA_DIR / "upload_count.json"
+UPLOAD_COUNT_SHM_FILE = DATA_DIR / "upload_count.shm"
+USAGE_FLUSH_INTERVAL = float(os.environ.get("USAGE_FLUSH_INTERVAL", 5))
+USAGE_FLUSH_BATCH = int(os.environ.get("USAGE_FLUSH_BATCH", 500))
+USAGE_MAX_PENDING = int(os.environ.get("USAGE_MAX_PENDING", 100000))
+
+# Preprocessed training set (uint8 .npy shards deduplicated by SHA-256, see shard_dataset.py)
+TRAIN_DATASET_DIR = DATA_DIR / "train_dataset"
+TRAIN_IMG_SIZE = (224, 224)
+DATASET_SHARD_SIZE = int(os.environ.get("DATASET_SHARD_SIZE", 1024))
+DATASET_INGEST_WORKERS = int(os.environ.get("DATASET_INGEST_WORKERS", os.cpu_count() or 1))  # decode processes
+# Admin-uploaded raw datasets: <RAW_DATASET_DIR>/<category> is a symlink to a version under DATASET_VERSIONS_DIR
+RAW_DATASET_DIR = DATA_DIR / "dataset"
+DATASET_VERSIONS_DIR = DATA_DIR / "dataset_versions"
+DATASET_MAX_IMAGE_MB = int(os.environ.get("DATASET_MAX_IMAGE_MB", 25))  # larger zip members are skipped
+
+# Retraining jobs: queued, run one at a time in a separate resource-limited process
+RETRAIN_JOBS_FILE = DATA_DIR / "retrain_jobs.jsonl"
+RETRAIN_LOCK_FILE = DATA_DIR / "retrain.lock"
+RETRAIN_LOG_DIR = DATA_DIR / "retrain_logs"
+RETRAIN_MEMORY_LIMIT_MB = int(os.environ.get("RETRAIN_MEMORY_LIMIT_MB", 8192))  # RLIMIT_DATA; 0 = unlimited
+RETRAIN_CPUS = int(os.environ.get("RETRAIN_CPUS", max(1, (os.cpu_count() or 2) // 2)))  # 0 = all
+RETRAIN_NICE = int(os.environ.get("RETRAIN_NICE", 10))
+RETRAIN_TIMEOUT = int(os.environ.get("RETRAIN_TIMEOUT", 6 * 3600))  # seconds; 0 = none
+RETRAIN_POLL_INTERVAL = float(os.environ.get("RETRAIN_POLL_INTERVAL", 5))
+RETRAIN_JOBS_KEEP = int(os.environ.get("RETRAIN_JOBS_KEEP", 50))
+# Model registry: versions under MODELS_DIR/versions, MODELS_DIR/final_model links the current one
+MODEL_KEEP_VERSIONS = int(os.environ.get("MODEL_KEEP_VERSIONS", 5))  # 0 = keep all
+MODEL_RELOAD_INTERVAL = float(os.environ.get("MODEL_RELOAD_INTERVAL", 5))  # seconds between checks for a new current version; 0 = never
+
+# Shadow evaluation: with a sample rate > 0, retrained models become candidates that see a
+# sample of live /api/predict images off the response path and are promoted through a gate
+SHADOW_DIR = DATA_DIR / "shadow"
+SHADOW_SAMPLE_RATE = float(os.environ.get("SHADOW_SAMPLE_RATE", 0))  # 0 = promote retrained models directly
+SHADOW_QUEUE_SIZE = int(os.environ.get("SHADOW_QUEUE_SIZE", 256))  # pending shadow inputs per worker; extra are dropped
+SHADOW_FLUSH_ROWS = int(os.environ.get("SHADOW_FLUSH_ROWS", 64))
+SHADOW_MIN_SAMPLES = int(os.environ.get("SHADOW_MIN_SAMPLES", 500))
+SHADOW_AGREEMENT_TOLERANCE = float(os.environ.get("SHADOW_AGREEMENT_TOLERANCE", 0.02))  # allowed drop in agreement with the secondary provider
+SHADOW_MIN_AGREEMENT = float(os.environ.get("SHADOW_MIN_AGREEMENT", 0.8))  # least agreement with the current model; 0 = none
+SHADOW_MIN_SECONDARY = int(os.environ.get("SHADOW_MIN_SECONDARY", 100))  # samples with a secondary label needed to pass
+SHADOW_MAX_LATENCY_RATIO = float(os.environ.get("SHADOW_MAX_LATENCY_RATIO", 1.25))  # candidate p95 / current p95
+SHADOW_MAX_P95_MS = float(os.environ.get("SHADOW_MAX_P95_MS", 0))  # absolute budget; 0 = none
+SHADOW_AUTO_PROMOTE = bool(int(os.environ.get("SHADOW_AUTO_PROMOTE", 0)))
 
 # Load settings
 def load_settings():
@@ -51,11 +105,25 @@ API_IMAGE_QUOTA = settings.get("api_image_quota", 5000)
 API_VIDEO_QUOTA = settings.get("api_video_quota", 100)
 API_DAILY_QUOTA = API_IMAGE_QUOTA  # convenience
 
+# Shared per-host counters (mmap'd files under DATA_DIR)
+QUOTA_SHM_FILE = DATA_DIR / "quota.shm"
+QUOTA_FLUSH_INTERVAL = float(os.environ.get("QUOTA_FLUSH_INTERVAL", 5))
+
 # Auth
 JWT_SECRET = os.environ.get("JWT_SECRET")
 if not JWT_SECRET:
     raise ValueError("JWT_SECRET environment variable is required")
 
+# Password hashing pool (bcrypt cost and admission control for login bursts)
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+PASSWORD_POOL_WORKERS = int(os.environ.get("PASSWORD_POOL_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+PASSWORD_QUEUE_LIMIT = int(os.environ.get("PASSWORD_QUEUE_LIMIT", 32))
+
+# Verified-token cache: entries live until the token's exp or AUTH_CACHE_TTL, whichever is first
+AUTH_CACHE_SIZE = int(os.environ.get("AUTH_CACHE_SIZE", 10000))
+AUTH_CACHE_TTL = int(os.environ.get("AUTH_CACHE_TTL", 60))
+AUTH_LOG_SAMPLE_RATE = int(os.environ.get("AUTH_LOG_SAMPLE_RATE", 100))  # log 1 in N token verifications
+
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", 60*24))  # 24h
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get("REFRESH_TOKEN_EXPIRE_DAYS", 30))
 
@@ -72,5 +140,5 @@ if not GMAIL_USER or not GMAIL_APP_PASS:
     raise ValueError("GMAIL_USER and GMAIL_APP_PASS environment variables are required")
 
 # Ensure directories exist
-for d in [DATA_DIR, UPLOADS_DIR, MODELS_DIR, PRIORITY_DIR, REPORTS_DIR]:
+for d in [DATA_DIR, UPLOADS_DIR, MODELS_DIR, REPORTS_DIR, RETRAIN_LOG_DIR, SHADOW_DIR]:
     d.mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,143 @@
+import hashlib, os, shutil, time, uuid, zipfile
+from pathlib import Path
+from .config import (
+    TRAIN_DATASET_DIR, TRAIN_IMG_SIZE, DATASET_SHARD_SIZE, DATASET_INGEST_WORKERS, UPLOADS_DIR,
+    RAW_DATASET_DIR, DATASET_VERSIONS_DIR, DATASET_MAX_IMAGE_MB, MODELS_DIR, MODEL_KEEP_VERSIONS,
+    SHADOW_SAMPLE_RATE,
+)
+from .logger import app_logger
+from .shard_dataset import ShardDataset, entry_label, LABELS
+
+# Labelled uploads are decoded and resized once, when they join the training set, and the
+# trainer reads the shards (train_model.py --shards). Re-adding an image is a hash lookup.
+IMAGE_EXTS = (".png", ".jpg", ".jpeg")
+
+def _dataset():
+    # Re-read the index on every call: other workers and the trainer append to it
+    return ShardDataset(TRAIN_DATASET_DIR, TRAIN_IMG_SIZE, DATASET_SHARD_SIZE)
+
+def _upload_path(entry):
+    file = entry.get("file") or entry.get("filename") or entry.get("upload") or entry.get("path")
+    return os.path.join(UPLOADS_DIR, file) if file else None
+
+def _add(items, source):
+    # Large batches are decoded by a process pool (see ShardDataset._decode); small ones inline
+    result = _dataset().add(items, workers=DATASET_INGEST_WORKERS)
+    app_logger.info("Training set: %d images from %s, %d added, %d relabeled, %d unreadable",
+                    len(result["shas"]), source, result["added"], result["relabeled"], result["failed"])
+    if result["errors"]:
+        app_logger.warning("Unreadable images from %s (%d, showing %d): %s", source, result["failed"],
+                           len(result["errors"]), "; ".join(f"{p}: {e}" for p, e in result["errors"]))
+    return {"images": len(result["shas"]), "added": result["added"], "relabeled": result["relabeled"],
+            "failed": result["failed"], "errors": result["errors"]}
+
+def add_feedback(entries):
+    """Add labelled feedback records to the training set; returns counts of what changed."""
+    items = []
+    for e in entries:
+        label, path = entry_label(e), _upload_path(e)
+        if label and path:
+            items.append((path, label))
+    return _add(items, "feedback")
+
+def add_directory(path):
+    """Add <path>/<category>/* images; high/nsfw folders are nsfw, anything else safe."""
+    items = []
+    for sub in sorted(Path(path).iterdir()):
+        if not sub.is_dir() or sub.name.startswith("."):
+            continue
+        label = entry_label({"label": sub.name})
+        items.extend((str(f), label) for f in sorted(sub.rglob("*"))
+                     if f.is_file() and f.suffix.lower() in IMAGE_EXTS)
+    return _add(items, str(path))
+
+def _swap_in(category, version):
+    """Point RAW_DATASET_DIR/<category> at version with one rename, then drop the old version."""
+    RAW_DATASET_DIR.mkdir(parents=True, exist_ok=True)
+    final = RAW_DATASET_DIR / category
+    previous = None
+    if final.is_symlink():
+        previous = Path(os.readlink(final))
+    elif final.exists():
+        # one-time conversion of a plain directory from before versioned uploads
+        previous = DATASET_VERSIONS_DIR / f"{category}-legacy-{uuid.uuid4().hex[:6]}"
+        os.rename(final, previous)
+    link = RAW_DATASET_DIR / f".{category}.swap"
+    if link.is_symlink() or link.exists():
+        link.unlink()
+    os.symlink(version, link)
+    os.replace(link, final)
+    if previous is not None and previous.resolve() != version.resolve():
+        shutil.rmtree(previous, ignore_errors=True)
+
+def ingest_zip(zip_path, category):
+    """
+    Extract an uploaded zip into a new version of RAW_DATASET_DIR/<category>, one member at a
+    time, and swap it in when complete; the previous version stays visible until then. Members
+    are stored by content hash, so duplicates inside the zip are stored once, and an image the
+    previous version already holds is hard-linked from it instead of written again. The new
+    version holds exactly the images of the archive. Returns counts.
+    """
+    label = LABELS[entry_label({"label": category})]
+    known = _dataset().entries
+    current = RAW_DATASET_DIR / category
+    previous = current.resolve() if current.is_symlink() else None
+    DATASET_VERSIONS_DIR.mkdir(parents=True, exist_ok=True)
+    version = DATASET_VERSIONS_DIR / f"{category}-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    version.mkdir()
+    max_bytes = DATASET_MAX_IMAGE_MB << 20
+    counts = {"stored": 0, "linked": 0, "duplicates": 0, "in_training_set": 0, "skipped": 0}
+    seen = set()
+    try:
+        with zipfile.ZipFile(zip_path) as zf:
+            for info in zf.infolist():
+                ext = os.path.splitext(info.filename)[1].lower()
+                if info.is_dir():
+                    continue
+                if ext not in IMAGE_EXTS or info.file_size > max_bytes:
+                    counts["skipped"] += 1
+                    continue
+                part = version / ".part"
+                h = hashlib.sha256()
+                with zf.open(info) as src, open(part, "wb") as dst:
+                    for chunk in iter(lambda: src.read(1 << 20), b""):
+                        h.update(chunk)
+                        dst.write(chunk)
+                sha = h.hexdigest()
+                if sha in seen:
+                    os.remove(part)
+                    counts["duplicates"] += 1
+                    continue
+                seen.add(sha)
+                existing = known.get(sha)
+                if existing is not None and existing[2] == label:
+                    counts["in_training_set"] += 1
+                name = f"{sha[:24]}{ext}"
+                if previous is not None and (previous / name).exists():
+                    try:
+                        os.link(previous / name, version / name)
+                        os.remove(part)
+                        counts["linked"] += 1
+                        continue
+                    except OSError:
+                        pass  # e.g. the versions directory moved to another filesystem
+                os.replace(part, version / name)
+                counts["stored"] += 1
+    except Exception:
+        shutil.rmtree(version, ignore_errors=True)
+        raise
+    _swap_in(category, version)
+    app_logger.info("Dataset upload %s: %d stored, %d linked from the previous version, %d duplicates, %d skipped",
+                    category, counts["stored"], counts["linked"], counts["duplicates"], counts["skipped"])
+    return counts
+
+def dataset_stats():
+    return _dataset().stats()
+
+def trainer_args():
+    """Arguments that point train_model.py at the training set and the model registry."""
+    args = ["--shards", str(TRAIN_DATASET_DIR), "--img_size", str(TRAIN_IMG_SIZE[0]), str(TRAIN_IMG_SIZE[1]),
+            "--models_dir", str(MODELS_DIR), "--keep_versions", str(MODEL_KEEP_VERSIONS)]
+    if SHADOW_SAMPLE_RATE > 0:
+        args.append("--no_promote")  # the new version becomes the shadow candidate (see shadow_eval.py)
+    return args
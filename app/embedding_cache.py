@@ -0,0 +1,88 @@
+"""
+embedding_cache.py
+
+Memory-mapped cache of pooled backbone features, keyed by image content hash.
+Used by train_model.py (run as a script, so this module has no app imports).
+"""
+
+import fcntl
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+
+
+def content_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    One directory per (backbone version, image size) holding:
+      features.f32  rows of `dim` float32 values, appended in place
+      index.txt     "<sha256> <row>" per line, written after the row it points to
+
+    A crash between the two writes leaves an unreferenced row, never a bad entry.
+    Readers map features.f32 with np.memmap, so only the rows a run touches are paged in.
+    """
+
+    def __init__(self, root, backbone_version, img_size, dim=1280):
+        self.dir = Path(root) / f"{backbone_version}_{img_size[0]}x{img_size[1]}"
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.features_path = self.dir / "features.f32"
+        self.index_path = self.dir / "index.txt"
+        self.rows = {}
+        self._load_index()
+
+    def _load_index(self):
+        self.rows = {}
+        if self.index_path.exists():
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) == 2:
+                        self.rows[parts[0]] = int(parts[1])
+
+    def __len__(self):
+        return len(self.rows)
+
+    def missing(self, hashes):
+        return [h for h in dict.fromkeys(hashes) if h not in self.rows]
+
+    def append(self, hashes, features):
+        """Store features (n x dim) for hashes; rows already cached are skipped."""
+        features = np.asarray(features, dtype=np.float32).reshape(-1, self.dim)
+        with open(self.dir / ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._load_index()  # another run may have appended meanwhile
+            new = [(h, i) for i, h in enumerate(hashes) if h not in self.rows]
+            if not new:
+                return 0
+            with open(self.features_path, "ab") as f:
+                start = f.tell() // (4 * self.dim)
+                f.write(np.ascontiguousarray(features[[i for _, i in new]]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                for offset, (h, _) in enumerate(new):
+                    self.rows[h] = start + offset
+                    f.write(f"{h} {start + offset}\n")
+                f.flush()
+                os.fsync(f.fileno())
+            return len(new)
+
+    def table(self):
+        """Read-only (rows x dim) memmap of every cached feature vector."""
+        return np.memmap(self.features_path, dtype=np.float32, mode="r").reshape(-1, self.dim)
+
+    def get(self, hashes):
+        """Features for hashes as an (n x dim) array; every hash must be cached."""
+        if not hashes:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.asarray(self.table()[[self.rows[h] for h in hashes]])
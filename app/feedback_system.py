@@ -1,10 +1,473 @@
-import uuid, os, json
+import uuid, bisect, os, threading, time
 from datetime import datetime, timedelta
-from .utils import append_json, read_json, write_json, now_iso
-from .config import FEEDBACK_FILE, MODEL_COMPARISON_FILE, RETRAINING_FILE, PRIORITY_DIR, FEEDBACK_SECTORS_FILE, ADMIN_AUDIT_FILE
+from .utils import read_json, now_iso, page_after, page_range, count_range
+from .config import FEEDBACK_FILE, FEEDBACK_STORE_FILE, MODEL_COMPARISON_FILE, FEEDBACK_SECTORS_FILE, ADMIN_AUDIT_FILE, RETRAINING_FILE
 from .logger import feedback_logger, priority_logger, audit_logger
+from .record_store import RecordStore, op_put, op_patch, op_incr, op_del
+from . import priority_queue
 
-def record_prediction(user_id, path, primary, secondary, secondary_model_used="unknown", auto_retrain=False, correct_label=None):
+# Feedback records live in an append-only store keyed by id, so a feedback click
+# appends one small patch line instead of rewriting the whole history.
+# Approvals also live here so an approval is one batch line: the feedback patch, a
+# sector reference (feedback id -> final label) and an append-only audit entry.
+# Sector references carry the sector generation they were approved in; triggering a
+# retraining batch bumps the generation (one META write), which empties the sectors, and
+# the batch manifest in the "retrain_batch" namespace names the generation it consumed.
+# "rollup" holds per-user counters, keyed "<user>|<day>" and "<user>|*" (all time), that are
+# incremented in the same write as the prediction or label change they count.
+# "comparison" keeps the primary/secondary outcome of every prediction for the admin
+# views; unlike feedback it is not deleted after retraining.
+# "meta" holds one marker per one-time migration, written in the same batch as the migration,
+# and the current sector generation under SECTOR_GEN.
+FEEDBACK = "feedback"
+COMPARISONS = "comparison"
+SECTORS = "sector"
+AUDIT = "audit"
+BATCHES = "retrain_batch"
+ROLLUP = "rollup"
+META = "meta"
+SECTOR_GEN = "sector_gen"
+FEEDBACK_TYPES = ("perfect", "okay", "wrong")
+SECTOR_LABELS = ("safe", "moderate", "high")
+
+def _legacy_ops():
+    ops = [op_put(FEEDBACK, e["id"], e) for e in read_json(FEEDBACK_FILE, []) if isinstance(e, dict) and e.get("id")]
+    sectors = read_json(FEEDBACK_SECTORS_FILE, {})
+    for label in SECTOR_LABELS:
+        for e in sectors.get(label, []) if isinstance(sectors, dict) else []:
+            if isinstance(e, dict) and e.get("id"):
+                ops.append(op_put(SECTORS, e["id"], {"label": label, "ts": e.get("admin_approved_ts")}))
+    for a in read_json(ADMIN_AUDIT_FILE, []):
+        if isinstance(a, dict) and a.get("id"):
+            ops.append(op_put(AUDIT, a["id"], a))
+    for c in read_json(MODEL_COMPARISON_FILE, []):
+        if isinstance(c, dict) and c.get("id"):
+            ops.append(op_put(COMPARISONS, c["id"], c))
+    batches = read_json(RETRAINING_FILE, {})
+    for name, records in batches.items() if isinstance(batches, dict) else ():
+        # retraining.json held full record copies per batch; keep them as id manifests
+        records = [e for e in records if isinstance(e, dict) and e.get("id")] if isinstance(records, list) else []
+        ids = {label: [e["id"] for e in records if e.get("chosen") == label] for label in SECTOR_LABELS}
+        ops.append(op_put(BATCHES, name, {"name": name, "ids": ids,
+                                          "counts": {label: len(v) for label, v in ids.items()},
+                                          "ts": max((e.get("admin_approved_ts") or "" for e in records), default=""),
+                                          "imported_from": RETRAINING_FILE.name}))
+    return ops
+
+def _marker(name, ops):
+    return op_put(META, name, {"ts": now_iso(), "records": len(ops)})
+
+def _bootstrap():
+    """Import the legacy feedback, sectors, audit, model comparison and batch JSON files on first start."""
+    ops = _legacy_ops()
+    return ops + [_marker("legacy_import", ops)]
+
+store = RecordStore(FEEDBACK_STORE_FILE, bootstrap=_bootstrap)
+
+def _once(name, build):
+    """
+    Commit build()'s ops together with a META marker under the store's write lock, unless
+    the marker exists. Every worker calls this at import; only the first one writes.
+    Returns the number of ops written, or None if the migration had already run.
+    """
+    def step():
+        if store.peek(META, name) is not None:
+            return [], None
+        ops = build()
+        return ops + [_marker(name, ops)], len(ops)
+    return store.atomic(step)
+
+def _import_legacy_files():
+    # Stores created before sectors/audit/comparisons/batches moved into the log: import the
+    # JSON files once, then rename them out of the way.
+    legacy = [p for p in (FEEDBACK_SECTORS_FILE, ADMIN_AUDIT_FILE, MODEL_COMPARISON_FILE, RETRAINING_FILE) if p.exists()]
+    imported = _once("legacy_import", lambda: [op for op in _legacy_ops() if op["ns"] != FEEDBACK])
+    for p in legacy:
+        try:
+            os.replace(p, str(p) + ".imported")
+        except FileNotFoundError:
+            pass
+    if imported:
+        feedback_logger.info("Imported %d legacy records into %s", imported, FEEDBACK_STORE_FILE)
+
+_import_legacy_files()
+
+# -----------------------------
+# Review queues
+# -----------------------------
+# Every record sits in exactly one review state; auto-retrain membership is tracked
+# separately because it is orthogonal to the user/admin flow. Each queue is a sorted
+# list of (sort_key, id) maintained from the store's change stream, so the deadline is
+# parsed once per change instead of once per record per request.
+PENDING_USER = "pending_user"        # prediction recorded, user hasn't chosen a label
+AWAITING_ADMIN = "awaiting_admin"    # user labeled it; ordered by approval deadline
+APPROVED = "approved"                # admin approved, waiting for weekly retraining
+RETRAINED = "retrained"              # consumed by auto-retraining, not admin-approved
+AUTO_RETRAIN = "auto_retrain"        # flagged for auto-retraining and not yet used
+REVIEW_STATES = (PENDING_USER, AWAITING_ADMIN, APPROVED, RETRAINED)
+
+_queues = {state: [] for state in REVIEW_STATES + (AUTO_RETRAIN,)}
+_pending_by_user = {}
+_positions = {}  # id -> [(queue, sort_key), ...]
+_queue_lock = threading.Lock()
+
+def _deadline_key(e):
+    """Epoch seconds after which an awaiting-admin record is ready for retraining."""
+    if e.get("admin_reviewed"):
+        return float("-inf")
+    deadline_str = e.get("approval_deadline")
+    if not deadline_str:
+        return float("inf")
+    try:
+        return datetime.fromisoformat(deadline_str.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        # Invalid deadline, treat as ready
+        return float("-inf")
+
+def _placements(e):
+    if e.get("admin_approved"):
+        state, key = APPROVED, e.get("admin_approved_ts") or e.get("ts", "")
+    elif e.get("auto_retrained"):
+        state, key = RETRAINED, e.get("ts", "")
+    elif e.get("chosen"):
+        state, key = AWAITING_ADMIN, _deadline_key(e)
+    else:
+        state, key = PENDING_USER, e.get("ts", "")
+    out = [(_queues[state], key)]
+    if state == PENDING_USER:
+        out.append((_pending_by_user.setdefault(e.get("user"), []), key))
+    if e.get("auto_retrain") and not e.get("auto_retrained"):
+        out.append((_queues[AUTO_RETRAIN], e.get("ts", "")))
+    return out
+
+def _reset_queues():
+    with _queue_lock:
+        for q in _queues.values():
+            q.clear()
+        _pending_by_user.clear()
+        _positions.clear()
+
+def _apply_queues(ns, key, old, new):
+    if ns != FEEDBACK:
+        return
+    with _queue_lock:
+        for q, sort_key in _positions.pop(key, ()):
+            i = bisect.bisect_left(q, (sort_key, key))
+            if i < len(q) and q[i] == (sort_key, key):
+                del q[i]
+        if new is not None:
+            placed = _placements(new)
+            for q, sort_key in placed:
+                bisect.insort(q, (sort_key, key))
+            _positions[key] = placed
+
+store.add_listener(_apply_queues, _reset_queues)
+
+def _records(keys):
+    return [r for r in (store.peek(FEEDBACK, k) for _, k in keys) if r is not None]
+
+def feedback_in_state(state):
+    """All records currently in one review queue, in queue order."""
+    def read():
+        with _queue_lock:
+            return _records(_queues[state])
+    return store.read(read)
+
+def feedback_page(state, cursor=None, limit=50, user=None):
+    """
+    One page of a review queue; `user` restricts PENDING_USER to that user's records.
+    Returns (records, next_cursor).
+    """
+    def read():
+        with _queue_lock:
+            q = _pending_by_user.get(user, []) if user is not None and state == PENDING_USER else _queues[state]
+            keys, next_cursor = page_after(q, cursor, limit)
+            return _records(keys), next_cursor
+    return store.read(read)
+
+def queue_sizes():
+    def read():
+        with _queue_lock:
+            return {state: len(q) for state, q in _queues.items()}
+    return store.read(read)
+
+# -----------------------------
+# Admin listings
+# -----------------------------
+# (ts, id) indexes for cursor pagination with date-range, user and disagreement filters
+_feedback_by_ts = []
+_feedback_by_user = {}
+_feedback_disagreements = []
+_comparisons_by_ts = []
+_comparison_disagreements = []
+_audit_by_ts = []
+
+def _disagrees(record):
+    # A degraded secondary (label None) gave no opinion, so it can never disagree
+    secondary = (record.get("secondary") or {}).get("label")
+    return secondary is not None and (record.get("primary") or {}).get("label") != secondary
+
+def _listing_indexes(ns, record):
+    if ns == FEEDBACK:
+        out = [_feedback_by_ts, _feedback_by_user.setdefault(record.get("user"), [])]
+        return out + [_feedback_disagreements] if _disagrees(record) else out
+    if ns == COMPARISONS:
+        return [_comparisons_by_ts, _comparison_disagreements] if _disagrees(record) else [_comparisons_by_ts]
+    if ns == AUDIT:
+        return [_audit_by_ts]
+    return []
+
+def _reset_listings():
+    with _queue_lock:
+        for q in (_feedback_by_ts, _feedback_disagreements, _comparisons_by_ts, _comparison_disagreements, _audit_by_ts):
+            q.clear()
+        _feedback_by_user.clear()
+
+def _apply_listings(ns, key, old, new):
+    if ns not in (FEEDBACK, COMPARISONS, AUDIT):
+        return
+    with _queue_lock:
+        if old is not None:
+            entry = (old.get("ts", ""), key)
+            for q in _listing_indexes(ns, old):
+                i = bisect.bisect_left(q, entry)
+                if i < len(q) and q[i] == entry:
+                    del q[i]
+        if new is not None:
+            entry = (new.get("ts", ""), key)
+            for q in _listing_indexes(ns, new):
+                bisect.insort(q, entry)
+
+store.add_listener(_apply_listings, _reset_listings)
+
+def _matcher(ns, label=None, disagreement=False):
+    checks = []
+    if label:
+        checks.append(lambda r: (r.get("primary") or {}).get("label") == label)
+    if disagreement:
+        checks.append(_disagrees)
+    if not checks:
+        return None
+    def match(key):
+        r = store.peek(ns, key)
+        return r is not None and all(check(r) for check in checks)
+    return match
+
+def _list(ns, index_for, cursor, limit, since, until, match):
+    """Page through index_for(); since/until are ISO dates, both inclusive."""
+    def read():
+        with _queue_lock:
+            keys, next_cursor = page_range(index_for(), cursor, limit, lo=since or None,
+                                           hi=(until + "\uffff") if until else None, match=match)
+        return [r for r in (store.peek(ns, k) for _, k in keys) if r is not None], next_cursor
+    return store.read(read)
+
+def _count(index, since, until):
+    """Size of a listing between since and until (ISO dates, both inclusive) without paging it."""
+    def read():
+        with _queue_lock:
+            return count_range(index, since or None, (until + "\uffff") if until else None)
+    return store.read(read)
+
+def list_feedback(cursor=None, limit=50, since=None, until=None, user=None, label=None, disagreement=False):
+    """Feedback records oldest first; label matches the primary label."""
+    if user is not None:
+        return _list(FEEDBACK, lambda: _feedback_by_user.get(user, []), cursor, limit, since, until,
+                     _matcher(FEEDBACK, label, disagreement))
+    index = _feedback_disagreements if disagreement else _feedback_by_ts
+    return _list(FEEDBACK, lambda: index, cursor, limit, since, until, _matcher(FEEDBACK, label))
+
+def count_feedback(since=None, until=None):
+    return _count(_feedback_by_ts, since, until)
+
+def user_feedback_since(user, since):
+    """
+    The user's labelled records with user_feedback_ts (ts when missing) after `since`,
+    a naive UTC datetime. Scans only the user's own index.
+    """
+    def read():
+        with _queue_lock:
+            keys = list(_feedback_by_user.get(user, []))
+        return [r for r in (store.peek(FEEDBACK, k) for _, k in keys) if r is not None]
+    out = []
+    for f in store.read(read):
+        if f.get("chosen") is None:
+            continue
+        ts_str = f.get("user_feedback_ts") or f.get("ts")
+        try:
+            if isinstance(ts_str, str) and datetime.fromisoformat(ts_str.replace("Z", "")) > since:
+                out.append(f)
+        except ValueError:
+            pass  # skip invalid timestamps
+    return out
+
+def list_comparisons(cursor=None, limit=50, since=None, until=None, label=None, disagreement=False):
+    index = _comparison_disagreements if disagreement else _comparisons_by_ts
+    return _list(COMPARISONS, lambda: index, cursor, limit, since, until, _matcher(COMPARISONS, label))
+
+def count_comparisons(since=None, until=None):
+    return _count(_comparisons_by_ts, since, until)
+
+# -----------------------------
+# Sector readiness
+# -----------------------------
+# Members of each sector per generation, maintained from the store's change stream so
+# the daily readiness check never reads the sectors themselves. Only the current
+# generation is kept; references from older generations stay in the store for the
+# batch manifests but are dropped here. A full reload may replay sector references
+# before the generation record, so they are bucketed by generation until it arrives.
+_sector_ids = {}
+_sector_gen = [0]
+
+def _sector_bucket(gen):
+    return _sector_ids.setdefault(gen, {label: set() for label in SECTOR_LABELS})
+
+def _reset_sectors():
+    with _queue_lock:
+        _sector_ids.clear()
+        _sector_gen[0] = 0
+
+def _apply_sectors(ns, key, old, new):
+    if ns == META and key == SECTOR_GEN:
+        with _queue_lock:
+            _sector_gen[0] = (new or {}).get("gen", 0)
+            for gen in [g for g in _sector_ids if g < _sector_gen[0]]:
+                del _sector_ids[gen]
+        return
+    if ns != SECTORS:
+        return
+    with _queue_lock:
+        if old is not None and old.get("label") in SECTOR_LABELS and old.get("gen", 0) in _sector_ids:
+            _sector_ids[old.get("gen", 0)][old["label"]].discard(key)
+        if new is not None and new.get("label") in SECTOR_LABELS and new.get("gen", 0) >= _sector_gen[0]:
+            _sector_bucket(new.get("gen", 0))[new["label"]].add(key)
+
+store.add_listener(_apply_sectors, _reset_sectors)
+
+def _current_sector_gen():
+    """Current sector generation; call inside store.read()/atomic()."""
+    return (store.peek(META, SECTOR_GEN) or {}).get("gen", 0)
+
+def sector_status():
+    """Per-sector counts and whether every sector has data."""
+    def read():
+        with _queue_lock:
+            ids = _sector_ids.get(_sector_gen[0], {})
+            counts = {label: len(ids.get(label, ())) for label in SECTOR_LABELS}
+        return {"counts": counts, "ready": all(counts.values())}
+    return store.read(read)
+
+def sector_members(gen):
+    """Feedback ids per label approved into sector generation `gen` (e.g. a manifest's "gen")."""
+    members = {label: [] for label in SECTOR_LABELS}
+    for fid, ref in store.items(SECTORS):
+        if ref.get("gen", 0) == gen and ref.get("label") in members:
+            members[ref["label"]].append(fid)
+    return members
+
+def retraining_batches():
+    """Batch manifests, oldest first."""
+    return sorted(store.values(BATCHES), key=lambda b: b.get("ts", ""))
+
+# -----------------------------
+# Daily rollups
+# -----------------------------
+def _rollup_key(user, day):
+    return f"{user}|{day}"
+
+def _rollup_ops(old, new):
+    """op_incr lines moving the rollups of a record from `old` to `new` (None = absent)."""
+    deltas = {}
+    for record, sign in ((old, -1), (new, 1)):
+        if record is None:
+            continue
+        counts = {"predictions": 1, f"label_{(record.get('primary') or {}).get('label')}": 1}
+        if record.get("chosen") in FEEDBACK_TYPES:
+            counts["feedback"] = 1
+            counts[record["chosen"]] = 1
+        day = (record.get("ts") or "")[:10]
+        for key in (_rollup_key(record.get("user"), day), _rollup_key(record.get("user"), "*")):
+            d = deltas.setdefault(key, {})
+            for field, n in counts.items():
+                d[field] = d.get(field, 0) + sign * n
+    ops = []
+    for key, d in deltas.items():
+        d = {f: n for f, n in d.items() if n}
+        if d:
+            ops.append(op_incr(ROLLUP, key, d))
+    return ops
+
+def _patch_ops(feedback_id, fields):
+    """Patch plus rollup adjustment for one record; call inside store.atomic()."""
+    old = store.peek(FEEDBACK, feedback_id)
+    if old is None:
+        return []
+    return [op_patch(FEEDBACK, feedback_id, fields)] + _rollup_ops(old, {**old, **fields})
+
+def _patch(feedback_id, fields):
+    """Apply _patch_ops in one write; returns False if the record doesn't exist."""
+    def step():
+        ops = _patch_ops(feedback_id, fields)
+        return ops, bool(ops)
+    return store.atomic(step)
+
+def _backfill_rollups():
+    # Stores written before rollups existed: count the existing records once
+    def build():
+        if store.count(ROLLUP):
+            return []
+        ops = []
+        for e in store.values(FEEDBACK):
+            ops.extend(_rollup_ops(None, e))
+        return ops
+    if _once("rollups", build):
+        feedback_logger.info("Backfilled feedback rollups from %d records", store.count(FEEDBACK))
+
+_backfill_rollups()
+
+def user_rollups(user, days):
+    """Counters for `user` on each day in `days` (ISO dates), in order; missing days are {}."""
+    return [dict(store.get(ROLLUP, _rollup_key(user, day)) or {}) for day in days]
+
+def user_totals(user):
+    return dict(store.get(ROLLUP, _rollup_key(user, "*")) or {})
+
+def get_feedback(feedback_id):
+    return store.get(FEEDBACK, feedback_id)
+
+def all_feedback():
+    return store.values(FEEDBACK)
+
+def feedback_count():
+    return store.count(FEEDBACK)
+
+def mark_feedback(feedback_ids, **fields):
+    """Patch the same fields onto many records in one write."""
+    store.atomic(lambda: ([op for fid in dict.fromkeys(feedback_ids) for op in _patch_ops(fid, fields)], None))
+
+def remove_feedback(feedback_ids):
+    """Delete records together with any sector reference to them."""
+    def step():
+        ops = []
+        for fid in feedback_ids:
+            ops.append(op_del(FEEDBACK, fid))
+            if store.peek(SECTORS, fid) is not None:
+                ops.append(op_del(SECTORS, fid))
+        return ops, None
+    store.atomic(step)
+
+def _user_feedback_fields(chosen_label, suggested_label):
+    return {
+        "chosen": chosen_label,
+        "feedback_type": chosen_label,
+        "suggested_label": suggested_label,
+        "user_feedback_ts": now_iso(),
+        # Set approval deadline to 7 days from now
+        "approval_deadline": (datetime.utcnow() + timedelta(days=7)).isoformat() + "Z",
+        "admin_reviewed": False,
+    }
+
+def record_prediction(user_id, path, primary, secondary, secondary_model_used="unknown", auto_retrain=False, correct_label=None, disagreement=None):
     if not user_id or not path:
         feedback_logger.error("Invalid user_id or path for prediction recording")
         return None
@@ -28,36 +491,32 @@ def record_prediction(user_id, path, primary, secondary, secondary_model_used="u
         "ts": now_iso()
     }
     try:
-        append_json(FEEDBACK_FILE, entry)
+        compare = {"id": entry["id"], "path": path, "primary": primary,
+                   "secondary": secondary, "secondary_model_used": secondary_model_used,
+                   "ts": entry["ts"]}
+        store.commit([op_put(FEEDBACK, entry["id"], entry), op_put(COMPARISONS, entry["id"], compare)]
+                     + _rollup_ops(None, entry))
         feedback_logger.info("Recorded prediction %s user=%s path=%s secondary=%s auto_retrain=%s",
                              entry["id"], user_id, path, secondary_model_used, auto_retrain)
     except Exception as e:
         feedback_logger.exception(f"Failed to record prediction: {e}")
         return None
 
-    compare = {"id": entry["id"], "path": path, "primary": primary,
-               "secondary": secondary, "secondary_model_used": secondary_model_used,
-               "ts": entry["ts"]}
-    try:
-        append_json(MODEL_COMPARISON_FILE, compare)
-    except Exception as e:
-        feedback_logger.exception(f"Failed to record model comparison: {e}")
-
-    if primary.get("label") != secondary.get("label"):
+    if disagreement is None:
+        disagreement = _disagrees(entry)
+    if disagreement:
         try:
-            os.makedirs(PRIORITY_DIR, exist_ok=True)
-            pr_path = os.path.join(PRIORITY_DIR, f"{entry['id']}.json")
-            with open(pr_path, "w", encoding="utf-8") as f:
-                json.dump({
-                    "id": entry["id"],
-                    "path": path,
-                    "primary": primary,
-                    "secondary": secondary,
-                    "secondary_model_used": secondary_model_used,
-                    "correct_label": correct_label,
-                    "ts": entry["ts"]
-                }, f, indent=2)
-            priority_logger.info("Saved priority feedback %s", pr_path)
+            priority_queue.enqueue({
+                "id": entry["id"],
+                "user": user_id,
+                "path": path,
+                "primary": primary,
+                "secondary": secondary,
+                "secondary_model_used": secondary_model_used,
+                "correct_label": correct_label,
+                "ts": entry["ts"]
+            })
+            priority_logger.info("Queued priority feedback %s", entry["id"])
         except Exception as e:
             priority_logger.exception(f"Failed to save priority feedback: {e}")
 
@@ -79,22 +538,9 @@ def submit_feedback(user_id, feedback_id, chosen_label, suggested_label=None, co
         return False
 
     try:
-        arr = read_json(FEEDBACK_FILE, [])
-        updated = False
-        for e in arr:
-            if e.get("id") == feedback_id:
-                e["chosen"] = chosen_label
-                e["feedback_type"] = chosen_label  # Store in new field too
-                e["suggested_label"] = suggested_label
-                e["correct_label"] = correct_label if chosen_label == "wrong" else None
-                e["user_feedback_ts"] = now_iso()
-                # Set approval deadline to 7 days from now
-                e["approval_deadline"] = (datetime.utcnow() + timedelta(days=7)).isoformat() + "Z"
-                e["admin_reviewed"] = False
-                updated = True
-                break
-        if updated:
-            write_json(FEEDBACK_FILE, arr)
+        fields = _user_feedback_fields(chosen_label, suggested_label)
+        fields["correct_label"] = correct_label if chosen_label == "wrong" else None
+        if _patch(feedback_id, fields):
             feedback_logger.info("User %s submitted feedback %s -> %s", user_id, feedback_id, chosen_label)
             return True
         else:
@@ -103,54 +549,73 @@ def submit_feedback(user_id, feedback_id, chosen_label, suggested_label=None, co
         feedback_logger.exception(f"Failed to submit feedback: {e}")
     return False
 
+def admin_approve_many(feedback_ids, admin_user=None, override_label=None, reason=None):
+    """
+    Approve many feedback items in one atomic write. Each item gets its feedback patch,
+    a sector reference and an audit entry, so the cost per item is constant.
+    Returns the ids that were approved.
+    """
+    ts = now_iso()
+    def step():
+        ops, approved = [], []
+        for feedback_id in dict.fromkeys(feedback_ids):
+            e = store.peek(FEEDBACK, feedback_id)
+            if e is None:
+                audit_logger.warning("Feedback ID %s not found for approval", feedback_id)
+                continue
+            original_label = e.get("chosen")
+            fields = {"admin_approved": True, "admin_reviewed": True, "admin_approved_ts": ts}
+            if override_label:
+                fields["chosen"] = override_label
+                fields["override_reason"] = reason
+            ops.extend(_patch_ops(feedback_id, fields))
+
+            # Store in sectors based on final label
+            final_label = fields.get("chosen", original_label)
+            if final_label in SECTOR_LABELS:
+                ops.append(op_put(SECTORS, feedback_id, {"label": final_label, "ts": ts, "gen": _current_sector_gen()}))
+
+            audit_id = uuid.uuid4().hex[:12]
+            ops.append(op_put(AUDIT, audit_id, {
+                "id": audit_id,
+                "feedback_id": feedback_id,
+                "action": "approve",
+                "admin_user": admin_user,
+                "original_label": original_label,
+                "final_label": final_label,
+                "override": override_label is not None,
+                "reason": reason,
+                "ts": ts
+            }))
+            approved.append((feedback_id, final_label))
+        return ops, approved
+
+    approved = store.atomic(step)
+    if approved:
+        priority_queue.ack(priority_queue.CONSUMER_ADMIN, [fid for fid, _ in approved])
+    for feedback_id, final_label in approved:
+        audit_logger.info("Admin %s approved feedback %s with label %s", admin_user, feedback_id, final_label)
+    return [fid for fid, _ in approved]
+
 def admin_approve(feedback_id, admin_user=None, override_label=None, reason=None):
     if not feedback_id:
         audit_logger.error("Invalid feedback_id for admin approval")
         return False
 
     try:
-        arr = read_json(FEEDBACK_FILE, [])
-        sectors = read_json(FEEDBACK_SECTORS_FILE, {"safe": [], "moderate": [], "high": []})
-        audit_log = read_json(ADMIN_AUDIT_FILE, [])
-        for e in arr:
-            if e.get("id") == feedback_id:
-                original_label = e.get("chosen")
-                e["admin_approved"] = True
-                e["admin_reviewed"] = True
-                if override_label:
-                    e["chosen"] = override_label
-                    e["override_reason"] = reason
-                e["admin_approved_ts"] = now_iso()
-                write_json(FEEDBACK_FILE, arr)
-
-                # Store in sectors based on final label
-                final_label = e.get("chosen")
-                if final_label in sectors:
-                    sectors[final_label].append(e)
-                    write_json(FEEDBACK_SECTORS_FILE, sectors)
-
-                # Log audit
-                audit_entry = {
-                    "id": uuid.uuid4().hex[:12],
-                    "feedback_id": feedback_id,
-                    "action": "approve",
-                    "admin_user": admin_user,
-                    "original_label": original_label,
-                    "final_label": final_label,
-                    "override": override_label is not None,
-                    "reason": reason,
-                    "ts": now_iso()
-                }
-                audit_log.append(audit_entry)
-                write_json(ADMIN_AUDIT_FILE, audit_log)
-
-                audit_logger.info("Admin %s approved feedback %s with label %s", admin_user, feedback_id, final_label)
-                return True
-        audit_logger.warning("Feedback ID %s not found for approval", feedback_id)
+        return bool(admin_approve_many([feedback_id], admin_user, override_label, reason))
     except Exception as e:
         audit_logger.exception(f"Failed to approve feedback: {e}")
     return False
 
+def get_audit_log(limit=100):
+    """Most recent admin audit entries, newest first; reads only the tail of the ts index."""
+    def read():
+        with _queue_lock:
+            keys = _audit_by_ts[-limit:] if limit > 0 else []
+        return [r for r in (store.peek(AUDIT, k) for _, k in reversed(keys)) if r is not None]
+    return store.read(read)
+
 def admin_label_feedback(feedback_id, label, admin_user=None):
     """
     Admin labels unlabeled feedback or overrides existing labels.
@@ -160,18 +625,13 @@ def admin_label_feedback(feedback_id, label, admin_user=None):
         return False
 
     try:
-        arr = read_json(FEEDBACK_FILE, [])
-        for e in arr:
-            if e.get("id") == feedback_id:
-                e["chosen"] = label
-                e["feedback_type"] = label
-                e["admin_labeled"] = True
-                e["admin_labeled_ts"] = now_iso()
-                if admin_user:
-                    e["admin_user"] = admin_user
-                write_json(FEEDBACK_FILE, arr)
-                feedback_logger.info("Admin %s labeled feedback %s as %s", admin_user, feedback_id, label)
-                return True
+        fields = {"chosen": label, "feedback_type": label, "admin_labeled": True, "admin_labeled_ts": now_iso()}
+        if admin_user:
+            fields["admin_user"] = admin_user
+        if _patch(feedback_id, fields):
+            priority_queue.ack(priority_queue.CONSUMER_ADMIN, [feedback_id])
+            feedback_logger.info("Admin %s labeled feedback %s as %s", admin_user, feedback_id, label)
+            return True
         feedback_logger.warning("Feedback ID %s not found for admin labeling", feedback_id)
     except Exception as e:
         feedback_logger.exception(f"Failed to admin label feedback: {e}")
@@ -181,7 +641,7 @@ def get_recent_feedback(limit=50):
     if limit <= 0:
         return []
     try:
-        arr = read_json(FEEDBACK_FILE, [])
+        arr = all_feedback()
         return sorted(arr, key=lambda x: x.get("ts",""), reverse=True)[:limit]
     except Exception as e:
         feedback_logger.exception(f"Failed to get recent feedback: {e}")
@@ -197,36 +657,32 @@ def submit_bulk_feedback(user_id, feedback_list):
         return False
 
     try:
-        arr = read_json(FEEDBACK_FILE, [])
-        updated_count = 0
-        for fb in feedback_list:
-            feedback_id = fb.get("feedback_id")
-            chosen_label = fb.get("chosen")
-            suggested_label = fb.get("suggested_label")
-
-            if not feedback_id or not chosen_label:
-                feedback_logger.warning("Skipping invalid feedback entry: %s", fb)
-                continue
+        # One pass over the request, O(1) lookups, one durable write for the whole batch
+        def step():
+            ops, updated = [], 0
+            # Last entry wins for a repeated id, so each record is patched once per batch
+            for fb in {fb.get("feedback_id"): fb for fb in feedback_list if isinstance(fb, dict)}.values():
+                feedback_id = fb.get("feedback_id")
+                chosen_label = fb.get("chosen")
+                suggested_label = fb.get("suggested_label")
 
-            if chosen_label not in ["perfect", "okay", "wrong"]:
-                feedback_logger.warning("Invalid feedback type: %s for ID %s", chosen_label, feedback_id)
-                continue
+                if not feedback_id or not chosen_label:
+                    feedback_logger.warning("Skipping invalid feedback entry: %s", fb)
+                    continue
+
+                if chosen_label not in ["perfect", "okay", "wrong"]:
+                    feedback_logger.warning("Invalid feedback type: %s for ID %s", chosen_label, feedback_id)
+                    continue
+
+                patch = _patch_ops(feedback_id, _user_feedback_fields(chosen_label, suggested_label))
+                if patch:
+                    ops.extend(patch)
+                    updated += 1
+            return ops, updated
 
-            for e in arr:
-                if e.get("id") == feedback_id:
-                    e["chosen"] = chosen_label
-                    e["feedback_type"] = chosen_label
-                    e["suggested_label"] = suggested_label
-                    e["user_feedback_ts"] = now_iso()
-                    # Set approval deadline to 7 days from now
-                    e["approval_deadline"] = (datetime.utcnow() + timedelta(days=7)).isoformat() + "Z"
-                    e["admin_reviewed"] = False
-                    updated_count += 1
-                    break
-
-        if updated_count > 0:
-            write_json(FEEDBACK_FILE, arr)
-            feedback_logger.info("User %s submitted bulk feedback for %d items", user_id, updated_count)
+        updated = store.atomic(step)
+        if updated:
+            feedback_logger.info("User %s submitted bulk feedback for %d items", user_id, updated)
             return True
         else:
             feedback_logger.warning("No valid feedback items updated in bulk submission")
@@ -239,23 +695,13 @@ def get_approved_feedback_for_retraining():
     Get feedback that is ready for retraining: either admin-reviewed or past 7-day deadline.
     """
     try:
-        arr = read_json(FEEDBACK_FILE, [])
-        now = datetime.utcnow()
-        approved = []
-        for e in arr:
-            if e.get("chosen") and not e.get("admin_approved"):
-                deadline_str = e.get("approval_deadline")
-                if deadline_str:
-                    try:
-                        deadline = datetime.fromisoformat(deadline_str.replace('Z', '+00:00'))
-                        if now >= deadline or e.get("admin_reviewed", False):
-                            approved.append(e)
-                    except ValueError:
-                        # Invalid deadline, treat as ready
-                        approved.append(e)
-                elif e.get("admin_reviewed", False):
-                    approved.append(e)
-        return approved
+        now = time.time()
+        def read():
+            with _queue_lock:
+                q = _queues[AWAITING_ADMIN]
+                # admin-reviewed and invalid deadlines sort at -inf, missing ones at +inf
+                return _records(q[:bisect.bisect_right(q, (now, "\uffff"))])
+        return store.read(read)
     except Exception as e:
         feedback_logger.exception(f"Failed to get approved feedback: {e}")
         return []
@@ -265,24 +711,23 @@ def trigger_retraining_if_ready():
     Check if all sectors have data and trigger retraining.
     """
     try:
-        sectors = read_json(FEEDBACK_SECTORS_FILE, {"safe": [], "moderate": [], "high": []})
-        if all(len(sectors[sector]) > 0 for sector in ["safe", "moderate", "high"]):
-            feedback_logger.info("All sectors have data, triggering retraining")
-            # Combine all sector data
-            retrain_data = []
-            for sector_data in sectors.values():
-                retrain_data.extend(sector_data)
-
-            # Write to retraining file
-            rt = read_json(RETRAINING_FILE, {})
-            batch_name = f"sector_batch_{len(rt)+1}"
-            rt[batch_name] = retrain_data
-            write_json(RETRAINING_FILE, rt)
-
-            # Clear sectors after triggering
-            write_json(FEEDBACK_SECTORS_FILE, {"safe": [], "moderate": [], "high": []})
-
-            feedback_logger.info("Retraining triggered with %d samples from sectors", len(retrain_data))
+        def step():
+            gen = _current_sector_gen()
+            with _queue_lock:
+                ids = _sector_ids.get(gen, {})
+                counts = {label: len(ids.get(label, ())) for label in SECTOR_LABELS}
+            if not all(counts.values()):
+                return [], None
+            # Record a manifest naming this generation and start the next one in the same
+            # write; members are found with sector_members(manifest["gen"])
+            batch_name = f"sector_batch_{store.count(BATCHES) + 1}"
+            manifest = {"name": batch_name, "gen": gen, "counts": counts, "ts": now_iso()}
+            return [op_put(BATCHES, batch_name, manifest), op_put(META, SECTOR_GEN, {"gen": gen + 1})], manifest
+
+        manifest = store.atomic(step)
+        if manifest is not None:
+            feedback_logger.info("Retraining triggered: %s with %d samples from sectors",
+                                 manifest["name"], sum(manifest["counts"].values()))
             return True
         else:
             feedback_logger.info("Not all sectors have data yet")
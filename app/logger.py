@@ -1,8 +1,10 @@
-import logging, os
+import logging, logging.handlers, os, queue, atexit
 BASE = os.path.dirname(os.path.dirname(__file__))
 LOG_DIR = os.path.join(BASE, "logs")
 os.makedirs(LOG_DIR, exist_ok=True)
 
+_listeners = []
+
 def _setup(name, filename):
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
@@ -10,9 +12,20 @@ def _setup(name, filename):
         fh = logging.FileHandler(os.path.join(LOG_DIR, filename))
         fmt = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
         fh.setFormatter(fmt)
-        logger.addHandler(fh)
+        # Request threads only enqueue records; a listener thread does the file I/O
+        q = queue.SimpleQueue()
+        logger.addHandler(logging.handlers.QueueHandler(q))
+        listener = logging.handlers.QueueListener(q, fh)
+        listener.start()
+        _listeners.append(listener)
     return logger
 
+def _stop_listeners():
+    for listener in _listeners:
+        listener.stop()
+
+atexit.register(_stop_listeners)
+
 app_logger = _setup("app", "app.log")
 feedback_logger = _setup("feedback", "feedback.log")
 priority_logger = _setup("priority", "priority.log")
@@ -1,7 +1,7 @@
 import os
 import io
-import shutil
-import subprocess
+import json
+import asyncio
 import zipfile
 import threading
 from datetime import datetime
@@ -9,30 +9,39 @@ from pathlib import Path
 from typing import Optional
 
 from fastapi import FastAPI, Request, UploadFile, File, Form, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.sessions import SessionMiddleware
 from jose import jwt, JWTError
 from app.config import (
-    ADMIN_EMAIL, UPLOADS_DIR, FEEDBACK_FILE, API_KEYS_FILE, API_USAGE_FILE,
-    USERS_FILE, MODEL_COMPARISON_FILE, RETRAINING_FILE, API_IMAGE_QUOTA, API_VIDEO_QUOTA,
-    SETTINGS_FILE, settings, load_settings
+    ADMIN_EMAIL, UPLOADS_DIR, API_KEYS_FILE, API_USAGE_FILE,
+    API_IMAGE_QUOTA, API_VIDEO_QUOTA,
+    SETTINGS_FILE, settings, load_settings, RAW_DATASET_DIR, DATASET_VERSIONS_DIR,
+    MODEL_KEEP_VERSIONS
 )
 from app.auth import (
     create_access_token, create_refresh_token, verify_token,
-    register_user, authenticate_user
+    register_user, authenticate_user, revoke_cached_tokens, auth_stats
 )
+from app import user_directory
 from app.utils import (
     save_upload, read_json, write_json, ensure_json,
-    log_api_usage, rate_allow, now_iso
+    log_api_usage, usage_days, count_upload, usage_stats, flush_usage, rate_check_scopes, retry_after_header, now_iso, project, InvalidCursor
 )
-from app.api_keys import create_api_key_for_user, find_client_by_key, consume_quota
-from app.model_utils import predict_image_bytes, predict_video_aggregated
-from app.secondary_model import predict_secondary_bytes, list_secondary_models
-from app.feedback_system import record_prediction, submit_feedback, admin_approve, submit_bulk_feedback
+from app.api_keys import create_api_key_for_user, find_client_by_key, find_clients_by_email, clients_page, client_counts, consume_quota, live_quota, set_client_quota, quota_engine
+from app.model_utils import predict_image_bytes, predict_video_aggregated, model_registry, start_model_watcher, stop_model_watcher, serving_stats
+from app.secondary_model import predict_secondary_bytes, list_secondary_models, scheduler as secondary_scheduler
+from app.provider_scheduler import PRIORITY_INTERACTIVE, PRIORITY_BULK
+from app.passwords import offload, password_stats
+from app import priority_queue
+from app.feedback_system import record_prediction, submit_feedback, admin_approve, admin_approve_many, submit_bulk_feedback, all_feedback, feedback_page, queue_sizes, sector_status, user_rollups, user_totals, user_feedback_since, feedback_count, count_feedback, count_comparisons, list_feedback, list_comparisons, PENDING_USER, REVIEW_STATES, AUTO_RETRAIN
 from app.scheduler import start_scheduler
+from app import retrain_jobs
+from app import shadow_eval
+from app.dataset_builder import add_feedback, add_directory, ingest_zip, dataset_stats, trainer_args
 from app.logger import app_logger, audit_logger
 
 BASE_DIR = Path(__file__).resolve().parent
@@ -68,21 +77,28 @@ if STATIC_DIR.exists():
     app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
 # Ensure files exist
-ensure_json(USERS_FILE, [])
 ensure_json(API_KEYS_FILE, {"clients": []})
-ensure_json(FEEDBACK_FILE, [])
 ensure_json(API_USAGE_FILE, {})
-ensure_json(MODEL_COMPARISON_FILE, [])
-ensure_json(RETRAINING_FILE, {})
+
+UPLOAD_SPOOL_CHUNK = 1 << 20  # dataset zips are copied to disk 1 MiB at a time
 
 # --- User Preference Tracking Setup ---
 PREFERENCES_FILE = os.path.join("data", "preferences.json")
 ensure_json(PREFERENCES_FILE, [])
-UPLOAD_COUNT_FILE = os.path.join("data", "upload_count.json")
-ensure_json(UPLOAD_COUNT_FILE, {})
 
-# Start scheduler
+# Start scheduler, this worker's retrain job dispatcher and its model hot-reload watcher
 start_scheduler()
+retrain_jobs.start_runner()
+start_model_watcher()
+shadow_eval.start_shadow_runner()
+
+@app.on_event("shutdown")
+def flush_counters():
+    quota_engine.stop()
+    flush_usage()
+    retrain_jobs.stop_runner()
+    stop_model_watcher()
+    shadow_eval.stop_shadow_runner()
 
 @app.get("/", response_class=HTMLResponse)
 def index():
@@ -93,35 +109,26 @@ def index():
 # -----------------------------
 @app.post("/register")
 async def register(email: str = Form(...), password: str = Form(...)):
-    new_user = register_user(email, password)
+    new_user = await offload(register_user, email, password)
     client = create_api_key_for_user(email)
-    users = read_json(USERS_FILE, [])
-    for u in users:
-        if u.get("user") == email:
-            u["api_key"] = client["api_key"]
-    write_json(USERS_FILE, users)
+    user_directory.update_user(email, api_key=client["api_key"])
     return RedirectResponse(url="/login", status_code=303)
 
 @app.post("/signup")
 async def signup_page_post(email: str = Form(...), password: str = Form(...)):
-    users = read_json(USERS_FILE, [])
-    existing = next((u for u in users if u.get("user") == email), None)
+    existing = user_directory.get_user(email)
     if existing:
         # Approve existing user by setting status to active
-        existing["status"] = "active"
+        fields = {"status": "active"}
         if not existing.get("api_key"):
             client = create_api_key_for_user(email)
-            existing["api_key"] = client["api_key"]
-        write_json(USERS_FILE, users)
+            fields["api_key"] = client["api_key"]
+        user_directory.update_user(email, **fields)
     else:
         # Register new user
-        new_user = register_user(email, password)
+        new_user = await offload(register_user, email, password)
         client = create_api_key_for_user(email)
-        users = read_json(USERS_FILE, [])
-        for u in users:
-            if u.get("user") == email:
-                u["api_key"] = client["api_key"]
-        write_json(USERS_FILE, users)
+        user_directory.update_user(email, api_key=client["api_key"])
     # Return JSON response for JS fetch
     return JSONResponse(content={"success": True}, status_code=200)
 
@@ -129,16 +136,11 @@ async def signup_page_post(email: str = Form(...), password: str = Form(...)):
 async def login(email: str = Form(...), password: str = Form(...)):
     app_logger.info(f"Login attempt for user: {email}")
     try:
-        user = authenticate_user(email, password)
+        user = await offload(authenticate_user, email, password)
         role = user.get("role", "client")
         access = create_access_token(user["user"], role)
         refresh = create_refresh_token(user["user"])
-        users = read_json(USERS_FILE, [])
-        for u in users:
-            if u.get("user") == user["user"]:
-                u.setdefault("refresh_tokens", []).append(refresh)
-                u["last_login"] = now_iso()
-        write_json(USERS_FILE, users)
+        user_directory.record_login(user["user"], refresh)
         if role == "admin":
             redirect_url = "/admin_dashboard"
         else:
@@ -163,37 +165,29 @@ async def token_refresh(refresh_token: str = Form(...)):
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    users = read_json(USERS_FILE, [])
-    for u in users:
-        if u.get("user") == sub and refresh_token in u.get("refresh_tokens", []):
-            access = create_access_token(sub, u.get("role","client"))
-            return {"token": access}
+    if user_directory.refresh_token_owner(refresh_token) == sub:
+        u = user_directory.get_user(sub) or {}
+        access = create_access_token(sub, u.get("role","client"))
+        return {"token": access}
     raise HTTPException(status_code=401, detail="Refresh token not recognized")
 
 @app.post("/token/revoke")
 async def token_revoke(refresh_token: str = Form(...)):
-    users = read_json(USERS_FILE, [])
-    for u in users:
-        if refresh_token in u.get("refresh_tokens", []):
-            u["refresh_tokens"].remove(refresh_token)
-            write_json(USERS_FILE, users)
-            return {"ok": True}
+    owner = user_directory.revoke_refresh_token(refresh_token)
+    if owner:
+        revoke_cached_tokens(owner)
+        return {"ok": True}
     return {"ok": False}
 
 @app.post("/admin/login")
 async def admin_login(email: str = Form(...), password: str = Form(...)):
     app_logger.info(f"Admin login attempt for user: {email}")
-    user = authenticate_user(email, password)
+    user = await offload(authenticate_user, email, password)
     if user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Access denied: Admin only")
     access = create_access_token(user["user"], "admin")
     refresh = create_refresh_token(user["user"])
-    users = read_json(USERS_FILE, [])
-    for u in users:
-        if u.get("user") == user["user"]:
-            u.setdefault("refresh_tokens", []).append(refresh)
-            u["last_login"] = now_iso()
-    write_json(USERS_FILE, users)
+    user_directory.record_login(user["user"], refresh)
     response = JSONResponse(content={"success": True, "token": access, "refresh": refresh, "redirect": "/admin_dashboard"}, status_code=200)
     response.set_cookie(key="access_token", value=access, httponly=True, secure=False, samesite="lax")
     return response
@@ -201,6 +195,12 @@ async def admin_login(email: str = Form(...), password: str = Form(...)):
 # -----------------------------
 # PREDICTION ROUTES
 # -----------------------------
+def enforce_rate_limits(**scopes):
+    """Check the given scopes (user=, key=, ip=) together and raise 429 with Retry-After if any is exhausted."""
+    allowed, retry_after = rate_check_scopes(**scopes)
+    if not allowed:
+        raise HTTPException(status_code=429, detail="Too many requests", headers={"Retry-After": retry_after_header(retry_after)})
+
 @app.post("/api/predict")
 async def api_predict(request: Request, file: UploadFile = File(...), user_id: str = Form(...)):
     client_ip = request.client.host if request.client else "unknown"
@@ -211,8 +211,7 @@ async def api_predict(request: Request, file: UploadFile = File(...), user_id: s
     except Exception:
         raise HTTPException(status_code=401, detail="Unauthorized")
     user = token_payload.get("sub")
-    if not rate_allow(user):
-        raise HTTPException(status_code=429, detail="Too many requests")
+    enforce_rate_limits(user=user, ip=client_ip)
 
     content = await file.read()
     if not content:
@@ -225,10 +224,7 @@ async def api_predict(request: Request, file: UploadFile = File(...), user_id: s
         raise HTTPException(status_code=500, detail="Failed to save file")
 
     # --- Track upload count and possibly request preference ---
-    upload_counts = read_json(UPLOAD_COUNT_FILE, {})
-    count = upload_counts.get(user, 0) + 1
-    upload_counts[user] = count
-    write_json(UPLOAD_COUNT_FILE, upload_counts)
+    count = count_upload(user)
 
     ext = file.filename.rsplit(".",1)[-1].lower() if "." in file.filename else ""
     if not ext:
@@ -238,10 +234,13 @@ async def api_predict(request: Request, file: UploadFile = File(...), user_id: s
         primary = predict_image_bytes(content)
         if "status" in primary and primary["status"] == "error":
             raise HTTPException(status_code=400, detail=primary["message"])
-        secondary_result = predict_secondary_bytes(content)
+        # Waiting for a provider token must not block the event loop
+        secondary_result = await run_in_threadpool(predict_secondary_bytes, content, PRIORITY_INTERACTIVE)
+        shadow_eval.submit(content, primary, secondary_result)  # queued for the candidate model, if any
         secondary = {"label": secondary_result["label"], "confidence": secondary_result["confidence"]}
         secondary_model_used = secondary_result.get("model_used", "unknown")
     elif ext in ("mp4","avi","mov","mkv"):
+        secondary_result = {}
         path = Path(UPLOADS_DIR) / saved
         primary = predict_video_aggregated(str(path))
         if "status" in primary and primary["status"] == "error":
@@ -251,12 +250,14 @@ async def api_predict(request: Request, file: UploadFile = File(...), user_id: s
     else:
         raise HTTPException(status_code=400, detail="Unsupported file type")
 
-    if count % 4 == 0:
+    if count and count % 4 == 0:
         # Ask for preference, show both predictions
         return {"ask_preference": True, "options": ["My Model", "Other's Model"], "primary": primary, "secondary": secondary, "file_saved": saved, "feedback_required": True}
 
     # Resolve disagreements: if primary != secondary, use secondary as correct
-    disagreement = primary.get("label") != secondary.get("label")
+    # (a degraded secondary gave no opinion, so it can never disagree)
+    secondary_degraded = secondary_result.get("reason") if secondary_result.get("degraded") else None
+    disagreement = not secondary_degraded and primary.get("label") != secondary.get("label")
     if disagreement:
         app_logger.info(f"Disagreement detected: primary={primary.get('label')}, secondary={secondary.get('label')}. Using secondary as correct.")
         final_label = secondary["label"]
@@ -269,7 +270,7 @@ async def api_predict(request: Request, file: UploadFile = File(...), user_id: s
         auto_retrain = False
 
     try:
-        rec = record_prediction(user, saved, primary, secondary, secondary_model_used=secondary_model_used, auto_retrain=auto_retrain, correct_label=secondary["label"] if disagreement else None)
+        rec = record_prediction(user, saved, primary, secondary, secondary_model_used=secondary_model_used, auto_retrain=auto_retrain, correct_label=secondary["label"] if disagreement else None, disagreement=disagreement)
         if rec is None:
             raise HTTPException(status_code=500, detail="Failed to record prediction")
         log_api_usage(api_calls=1, disagreements=1 if disagreement else 0)
@@ -277,17 +278,16 @@ async def api_predict(request: Request, file: UploadFile = File(...), user_id: s
         app_logger.exception(f"Failed to record prediction: {e}")
         raise HTTPException(status_code=500, detail="Failed to record prediction")
 
-    return {"file": saved, "primary": primary, "secondary": secondary, "id": rec["id"], "secondary_model_used": secondary_model_used, "feedback_required": True, "feedback_id": rec["id"], "prediction": primary}
+    return {"file": saved, "primary": primary, "secondary": secondary, "id": rec["id"], "secondary_model_used": secondary_model_used, "secondary_degraded": secondary_degraded, "feedback_required": True, "feedback_id": rec["id"], "prediction": primary}
 
 @app.post("/api/m2m/predict")
-async def m2m_predict(file: UploadFile = File(...), api_key: str = Form(...), user_email: Optional[str] = Form(None)):
+async def m2m_predict(request: Request, file: UploadFile = File(...), api_key: str = Form(...), user_email: Optional[str] = Form(None)):
     client = find_client_by_key(api_key)
     if not client:
         raise HTTPException(status_code=401, detail="Invalid API key")
     if client.get("status") == "blocked":
         raise HTTPException(status_code=403, detail="Client blocked")
-    if not rate_allow(api_key):
-        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+    enforce_rate_limits(key=api_key, ip=request.client.host if request.client else "unknown")
 
     content = await file.read()
     if not content:
@@ -311,10 +311,11 @@ async def m2m_predict(file: UploadFile = File(...), api_key: str = Form(...), us
         primary = predict_image_bytes(content)
         if "status" in primary and primary["status"] == "error":
             raise HTTPException(status_code=400, detail=primary["message"])
-        secondary_result = predict_secondary_bytes(content)
+        secondary_result = await run_in_threadpool(predict_secondary_bytes, content, PRIORITY_BULK)
         secondary = {"label": secondary_result["label"], "confidence": secondary_result["confidence"]}
         secondary_model_used = secondary_result.get("model_used", "unknown")
     else:
+        secondary_result = {}
         primary = predict_video_aggregated(str(Path(UPLOADS_DIR) / saved))
         if "status" in primary and primary["status"] == "error":
             raise HTTPException(status_code=400, detail=primary["message"])
@@ -322,7 +323,9 @@ async def m2m_predict(file: UploadFile = File(...), api_key: str = Form(...), us
         secondary_model_used = "placeholder_video"
 
     # Resolve disagreements: if primary != secondary, use secondary as correct
-    disagreement = primary.get("label") != secondary.get("label")
+    # (a degraded secondary gave no opinion, so it can never disagree)
+    secondary_degraded = secondary_result.get("reason") if secondary_result.get("degraded") else None
+    disagreement = not secondary_degraded and primary.get("label") != secondary.get("label")
     if disagreement:
         app_logger.info(f"Disagreement detected: primary={primary.get('label')}, secondary={secondary.get('label')}. Using secondary as correct.")
         final_label = secondary["label"]
@@ -335,7 +338,7 @@ async def m2m_predict(file: UploadFile = File(...), api_key: str = Form(...), us
         auto_retrain = False
 
     try:
-        rec = record_prediction(user_email or client.get("email","m2m"), saved, primary, secondary, secondary_model_used=secondary_model_used, auto_retrain=auto_retrain, correct_label=secondary["label"] if disagreement else None)
+        rec = record_prediction(user_email or client.get("email","m2m"), saved, primary, secondary, secondary_model_used=secondary_model_used, auto_retrain=auto_retrain, correct_label=secondary["label"] if disagreement else None, disagreement=disagreement)
         if rec is None:
             raise HTTPException(status_code=500, detail="Failed to record prediction")
         log_api_usage(api_calls=1, disagreements=1 if disagreement else 0, api_key=api_key)
@@ -344,16 +347,12 @@ async def m2m_predict(file: UploadFile = File(...), api_key: str = Form(...), us
         raise HTTPException(status_code=500, detail="Failed to record prediction")
 
     # --- Track upload count and possibly request preference ---
-    upload_counts = read_json(UPLOAD_COUNT_FILE, {})
-    key = user_email or client.get("email", "m2m")
-    count = upload_counts.get(key, 0) + 1
-    upload_counts[key] = count
-    write_json(UPLOAD_COUNT_FILE, upload_counts)
+    count = count_upload(user_email or client.get("email", "m2m"))
 
-    if count % 4 == 0:
+    if count and count % 4 == 0:
         return {"ask_preference": True, "options": ["My Model", "Other's Model"], "feedback_required": True, "feedback_id": rec["id"]}
 
-    return {"file": saved, "primary": primary, "secondary": secondary, "id": rec["id"], "secondary_model_used": secondary_model_used, "feedback_required": True, "feedback_id": rec["id"]}
+    return {"file": saved, "primary": primary, "secondary": secondary, "id": rec["id"], "secondary_model_used": secondary_model_used, "secondary_degraded": secondary_degraded, "feedback_required": True, "feedback_id": rec["id"]}
 
 @app.post("/api/preference")
 async def api_preference(request: Request, preferred: str = Form(...), file_name: Optional[str] = Form(None)):
@@ -408,7 +407,7 @@ async def api_preference(request: Request, preferred: str = Form(...), file_name
             raise HTTPException(status_code=400, detail="Unsupported file type")
     elif preferred == "Other's Model":
         if ext in ("png","jpg","jpeg","bmp","gif"):
-            secondary_result = predict_secondary_bytes(content)
+            secondary_result = await run_in_threadpool(predict_secondary_bytes, content, PRIORITY_INTERACTIVE)
             primary = {"label":"safe","confidence":0.5}  # Placeholder
             secondary = {"label": secondary_result["label"], "confidence": secondary_result["confidence"]}
             secondary_model_used = secondary_result.get("model_used", "unknown")
@@ -473,15 +472,17 @@ async def api_bulk_feedback(request: Request):
     return {"ok": True}
 
 @app.get("/api/pending_feedback")
-async def api_pending_feedback(request: Request):
+async def api_pending_feedback(request: Request, cursor: str = None, limit: int = 50):
     try:
         payload = verify_token(request)
     except Exception:
         raise HTTPException(status_code=401, detail="Unauthorized")
     user = payload.get("sub")
-    feedback_data = read_json(FEEDBACK_FILE, [])
-    pending = [f for f in feedback_data if f.get("user") == user and not f.get("chosen")]
-    return {"pending_feedback": pending}
+    try:
+        pending, next_cursor = feedback_page(PENDING_USER, cursor, max(1, min(limit, 200)), user=user)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"pending_feedback": pending, "next_cursor": next_cursor}
 
 @app.get("/api/feedback/stats")
 async def feedback_stats(request: Request):
@@ -490,22 +491,12 @@ async def feedback_stats(request: Request):
     except Exception:
         raise HTTPException(status_code=401, detail="Unauthorized")
     user = payload.get("sub")
-    feedback_data = read_json(FEEDBACK_FILE, [])
-    user_feedback = [f for f in feedback_data if f.get("user") == user and f.get("chosen")]
-    perfect = sum(1 for f in user_feedback if f.get("chosen") == "perfect")
-    okay = sum(1 for f in user_feedback if f.get("chosen") == "okay")
-    wrong = sum(1 for f in user_feedback if f.get("chosen") == "wrong")
-    return {"perfect": perfect, "okay": okay, "wrong": wrong}
+    totals = user_totals(user)
+    return {"perfect": totals.get("perfect", 0), "okay": totals.get("okay", 0), "wrong": totals.get("wrong", 0)}
 
 # -----------------------------
 # ADMIN ROUTES
 # -----------------------------
-def delete_old_final_model():
-    final_dir = Path("models/final_model")
-    if final_dir.exists():
-        shutil.rmtree(final_dir)
-        app_logger.info("Deleted old final_model directory")
-
 @app.post("/admin/retrain_simulate")
 async def admin_retrain_simulate(request: Request):
     payload = verify_token(request)
@@ -513,7 +504,7 @@ async def admin_retrain_simulate(request: Request):
         raise HTTPException(status_code=403, detail="Admin only")
 
     # Collect retraining data
-    feedback_data = read_json(FEEDBACK_FILE, [])
+    feedback_data = all_feedback()
     retrain_data = [item for item in feedback_data if item.get("disputed")]
     prefs = read_json(PREFERENCES_FILE, [])
     retrain_data.extend(prefs)
@@ -522,84 +513,203 @@ async def admin_retrain_simulate(request: Request):
     write_json(retrain_path, retrain_data)
     app_logger.info(f"Retraining dataset prepared with {len(retrain_data)} entries")
 
-    # Backup old model
-  
-
+    # Register a placeholder version; the previous one stays in the registry for rollback
     try:
-        new_model_dir = Path("models/temp_model")
-        new_model_dir.mkdir(parents=True, exist_ok=True)
-        fake_model = new_model_dir / "model.h5"
-        fake_model.write_text("Simulated retrained model")
-        final_dir = Path("models/final_model")
-        if final_dir.exists():
-            shutil.rmtree(final_dir)
-        shutil.copytree(new_model_dir, final_dir)
-        app_logger.info("Simulated retraining complete, replaced final_model")
+        staging = model_registry.stage()
+        (staging / "model.h5").write_text("Simulated retrained model")
+        (staging / "metadata.json").write_text(json.dumps({"saved_at": now_iso(), "simulated": True, "samples": len(retrain_data)}))
+        version = model_registry.commit(staging)
+        previous = model_registry.promote(version, by=payload.get("sub"), reason="simulated retrain")
+        model_registry.prune(MODEL_KEEP_VERSIONS)
+        app_logger.info(f"Simulated retraining complete, promoted {version}")
     except Exception as e:
         app_logger.error(f"Retraining simulation failed: {e}")
         raise HTTPException(status_code=500, detail=f"Retraining failed: {e}")
 
-    return {"ok": True, "message": "Retraining simulated, old model archived, final_model replaced."}
+    return {"ok": True, "message": f"Retraining simulated, {version} promoted to final_model.",
+            "version": version, "previous": previous}
 
 @app.get("/admin/list_models")
 async def admin_list_models(request: Request):
-    """List available model backups (admin only)."""
+    """List registered model versions, newest first, and the promotion history (admin only)."""
     payload = verify_token(request)
     if payload.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Admin only")
 
-    model_root = Path("models")
-    versions = sorted([d.name for d in model_root.glob("final_model_v*") if d.is_dir()])
-    return {"available_versions": versions}
+    versions = model_registry.versions()
+    return {"current": model_registry.current(), "available_versions": [v["version"] for v in versions],
+            "versions": versions, "history": model_registry.history(20)}
 
 
 @app.post("/admin/rollback")
-async def admin_rollback(request: Request, version: str = Form(...)):
-    """Rollback to a previous final_model version."""
+async def admin_rollback(request: Request, version: Optional[str] = Form(None)):
+    """Point final_model at a registered version; without one, undo the last promotion."""
     payload = verify_token(request)
     if payload.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Admin only")
 
-    target_dir = Path("models") / version
-    if not target_dir.exists():
-        raise HTTPException(status_code=404, detail=f"Version {version} not found")
+    if version:
+        if not model_registry.valid_id(version):
+            raise HTTPException(status_code=400, detail="Invalid version id")
+        if version not in {v["version"] for v in model_registry.versions()}:
+            raise HTTPException(status_code=404, detail=f"Version {version} not found")
+        damaged = model_registry.verify(version)
+        if damaged:
+            raise HTTPException(status_code=409, detail=f"Version {version} failed its checksum: {', '.join(damaged)}")
+    try:
+        version = await run_in_threadpool(model_registry.rollback, version, payload.get("sub"))
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e).strip("'"))
 
-    final_dir = Path("models/final_model")
-    if final_dir.exists():
-        shutil.rmtree(final_dir)
-    shutil.copytree(target_dir, final_dir)
+    audit_logger.info("Admin %s rolled back model to %s", payload.get("sub"), version)
+    return {"ok": True, "message": f"Successfully rolled back to {version}", "current": version}
 
-    app_logger.info(f"Rolled back model to {version}")
-    return {"ok": True, "message": f"Successfully rolled back to {version}"}
+@app.get("/admin/shadow")
+async def admin_shadow(request: Request):
+    """Shadow evaluation of the candidate model: agreement, latency and the promotion gate."""
+    payload = verify_token(request)
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    report = await run_in_threadpool(shadow_eval.evaluate)
+    return {"report": report, "runner": shadow_eval.stats()}
+
+@app.post("/admin/shadow/promote")
+async def admin_shadow_promote(request: Request, force: bool = Form(False)):
+    """Promote the candidate if it passes the gate; force promotes it regardless."""
+    payload = verify_token(request)
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    try:
+        promoted, report = await run_in_threadpool(shadow_eval.promote_candidate, payload.get("sub"), force)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="No candidate under shadow evaluation")
+    if not promoted:
+        raise HTTPException(status_code=409, detail={"message": "Candidate did not pass the shadow gate", "report": report})
+    audit_logger.info("Admin %s promoted candidate %s%s", payload.get("sub"), report["candidate"], " (forced)" if not report["passed"] else "")
+    return {"ok": True, "current": report["candidate"], "report": report}
+
+@app.post("/admin/shadow/reject")
+async def admin_shadow_reject(request: Request):
+    """Stop evaluating the candidate; it stays in the registry."""
+    payload = verify_token(request)
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    version = await run_in_threadpool(shadow_eval.reject_candidate, payload.get("sub"))
+    if version is None:
+        raise HTTPException(status_code=404, detail="No candidate under shadow evaluation")
+    audit_logger.info("Admin %s rejected candidate %s", payload.get("sub"), version)
+    return {"ok": True, "rejected": version}
+
+ADMIN_SECTIONS = ("users", "feedback", "api_keys", "comparisons", "usage")
+
+def _admin_listing(section, cursor=None, limit=50, since=None, until=None, user=None, label=None,
+                   disagreement=False, status=None, role=None):
+    if section == "users":
+        return user_directory.users_page(cursor, limit, status=status, role=role)
+    if section == "feedback":
+        return list_feedback(cursor, limit, since=since, until=until, user=user, label=label, disagreement=disagreement)
+    if section == "api_keys":
+        return clients_page(cursor, limit, email=user, status=status)
+    if section == "usage":
+        return usage_days(cursor, limit, since=since, until=until)
+    return list_comparisons(cursor, limit, since=since, until=until, label=label, disagreement=disagreement)
 
 @app.get("/admin/data")
-async def admin_data(request: Request):
+async def admin_data(request: Request, section: Optional[str] = None, cursor: Optional[str] = None, limit: int = 50,
+                     fields: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                     user: Optional[str] = None, label: Optional[str] = None, disagreement: bool = False,
+                     status: Optional[str] = None, role: Optional[str] = None):
+    """
+    Without `section`: an overview with the first page of every listing (feedback,
+    comparisons and usage default to today) and the total size of each in `totals`; follow
+    next_cursor with `section` for the rest. With `section`: one page of that listing.
+    `fields` is a comma-separated projection; since/until are ISO dates and select
+    feedback and comparisons by prediction time (`ts`), not by user_feedback_ts, and
+    usage by day.
+    """
     try:
         payload = verify_token(request)
     except Exception:
         raise HTTPException(status_code=401, detail="Unauthorized")
     if payload.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Admin only")
+    limit = max(1, min(limit, 500))
+    projection = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    filters = {"since": since, "until": until, "user": user, "label": label,
+               "disagreement": disagreement, "status": status, "role": role}
+
+    if section is not None:
+        if section not in ADMIN_SECTIONS:
+            raise HTTPException(status_code=400, detail="Unknown section")
+        try:
+            items, next_cursor = _admin_listing(section, cursor, limit, **filters)
+        except InvalidCursor:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        return {"section": section, "items": [project(i, projection) for i in items], "next_cursor": next_cursor}
+
     today = datetime.utcnow().date().isoformat()
-    users = read_json(USERS_FILE, [])
-    usage = read_json(API_USAGE_FILE, {})
-    # Filter usage to today only
-    today_usage = {k: v for k, v in usage.items() if k == today}
-    feedback = read_json(FEEDBACK_FILE, [])
-    # Filter feedback to today
-    today_feedback = []
-    for f in feedback:
-        ts_str = f.get("user_feedback_ts") or f.get("ts", "")
-        if ts_str:
-            try:
-                ts = datetime.fromisoformat(ts_str.replace('Z', '+00:00'))
-                if ts.date().isoformat() == today:
-                    today_feedback.append(f)
-            except:
-                pass
-    api_keys = read_json(API_KEYS_FILE, {"clients":[]})
-    comparisons = read_json(MODEL_COMPARISON_FILE, [])
-    return {"users": users, "usage": today_usage, "feedback": today_feedback, "api_keys": api_keys.get("clients",[]), "comparisons": comparisons}
+    out = {"next_cursor": {}}
+    for name in ADMIN_SECTIONS:
+        section_filters = dict(filters)
+        if name in ("feedback", "comparisons", "usage"):
+            section_filters["since"] = since or today
+            section_filters["until"] = until or today
+        items, next_cursor = _admin_listing(name, None, limit, **section_filters)
+        out[name] = [project(i, projection) for i in items]
+        out["next_cursor"][name] = next_cursor
+    out["totals"] = {
+        "users": user_directory.user_counts(),
+        "api_keys": client_counts(),
+        "feedback": count_feedback(since or today, until or today),
+        "comparisons": count_comparisons(since or today, until or today),
+    }
+    return out
+
+@app.get("/admin/review_queue")
+async def admin_review_queue(request: Request, state: str = "awaiting_admin", cursor: str = None, limit: int = 50, fields: Optional[str] = None):
+    try:
+        payload = verify_token(request)
+    except Exception:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    if state not in REVIEW_STATES + (AUTO_RETRAIN,):
+        raise HTTPException(status_code=400, detail="Unknown state")
+    try:
+        items, next_cursor = feedback_page(state, cursor, max(1, min(limit, 200)))
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    projection = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    return {"state": state, "feedback": [project(i, projection) for i in items], "next_cursor": next_cursor, "sizes": queue_sizes()}
+
+@app.get("/admin/priority_queue")
+async def admin_priority_queue(request: Request, cursor: str = None, limit: int = 50, fields: Optional[str] = None):
+    try:
+        payload = verify_token(request)
+    except Exception:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    try:
+        items, next_cursor = priority_queue.pending(priority_queue.CONSUMER_ADMIN, cursor, max(1, min(limit, 200)))
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    projection = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    return {"priority_feedback": [project(i, projection) for i in items], "next_cursor": next_cursor}
+
+@app.post("/admin/priority_queue/ack")
+async def admin_priority_ack(request: Request):
+    try:
+        payload = verify_token(request)
+    except Exception:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    body = await request.json()
+    ids = body.get("ids")
+    if not isinstance(ids, list):
+        raise HTTPException(status_code=400, detail="ids must be a list")
+    return {"acknowledged": priority_queue.ack(priority_queue.CONSUMER_ADMIN, ids)}
 
 @app.post("/admin/toggle")
 async def admin_toggle(request: Request):
@@ -614,14 +724,9 @@ async def admin_toggle(request: Request):
     action = body.get("action")
     if not email or action not in ["block", "unblock"]:
         raise HTTPException(status_code=400, detail="Invalid email or action")
-    users = read_json(USERS_FILE, [])
-    changed = False
-    for u in users:
-        if u.get("user") == email:
-            u["status"] = "blocked" if action == "block" else "active"
-            changed = True
+    changed = user_directory.update_user(email, status="blocked" if action == "block" else "active") is not None
     if changed:
-        write_json(USERS_FILE, users)
+        revoke_cached_tokens(email)
         audit_logger.info("Admin %s toggled %s -> %s", payload.get("sub"), email, action)
     return {"ok": changed}
 
@@ -635,18 +740,25 @@ async def api_admin_block_user(request: Request, username: str, block: str):
         raise HTTPException(status_code=403, detail="Admin only")
     if not username or block not in ["true", "false"]:
         raise HTTPException(status_code=400, detail="Invalid username or block parameter")
-    users = read_json(USERS_FILE, [])
-    changed = False
-    for u in users:
-        if u.get("user") == username:
-            u["status"] = "blocked" if block == "true" else "active"
-            changed = True
-            break
+    changed = user_directory.update_user(username, status="blocked" if block == "true" else "active") is not None
     if changed:
-        write_json(USERS_FILE, users)
+        revoke_cached_tokens(username)
         audit_logger.info("Admin %s toggled %s -> %s", payload.get("sub"), username, "blocked" if block == "true" else "active")
     return {"ok": changed}
 
+@app.post("/admin/api_keys/{kid}/quota")
+async def admin_set_quota(request: Request, kid: str, image_limit: Optional[int] = Form(None),
+                          video_limit: Optional[int] = Form(None), reset: bool = Form(False)):
+    """Change an API client's daily limits and/or reset its usage; takes effect on every worker."""
+    payload = verify_token(request)
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    client = set_client_quota(kid, image_limit=image_limit, video_limit=video_limit, reset=reset)
+    if client is None:
+        raise HTTPException(status_code=404, detail="API client not found")
+    audit_logger.info("Admin %s set quota for API client %s", payload.get("sub"), kid)
+    return {"ok": True, "quota": client["quota"]}
+
 @app.post("/admin/approve")
 async def admin_approve_endpoint(request: Request, feedback_id: str = Form(...), override_label: Optional[str] = Form(None), correct_label: Optional[str] = Form(None)):
     try:
@@ -662,6 +774,21 @@ async def admin_approve_endpoint(request: Request, feedback_id: str = Form(...),
     ok = admin_approve(feedback_id, admin_user=payload.get("sub"), override_label=final_override_label)
     return {"ok": ok}
 
+@app.post("/admin/approve_bulk")
+async def admin_approve_bulk_endpoint(request: Request):
+    try:
+        payload = verify_token(request)
+    except Exception:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if payload.get("sub") != ADMIN_EMAIL:
+        raise HTTPException(status_code=403, detail="Admin only")
+    body = await request.json()
+    feedback_ids = body.get("feedback_ids")
+    if not isinstance(feedback_ids, list) or not feedback_ids:
+        raise HTTPException(status_code=400, detail="feedback_ids must be a non-empty list")
+    approved = admin_approve_many(feedback_ids, admin_user=payload.get("sub"), override_label=body.get("override_label"), reason=body.get("reason"))
+    return {"ok": bool(approved), "approved": approved}
+
 @app.post("/admin/label_feedback")
 async def admin_label_feedback_endpoint(request: Request, feedback_id: str = Form(...), label: str = Form(...)):
     try:
@@ -681,10 +808,9 @@ async def admin_label_feedback_endpoint(request: Request, feedback_id: str = For
 async def manual_retrain(request: Request):
     """
     Admin-only endpoint that:
-     - collects disputed feedback -> data/retrain_data.json
-     - runs train_model.py (TensorFlow) synchronously
-     - ensures models/final_model/model.h5 is written by the trainer
-     - returns training stdout/stderr and new model path
+     - queues a retraining job; the job runner adds feedback with chosen labels to the
+       preprocessed training set, then runs train_model.py
+     - returns the job, whose progress is at /admin/retrain/jobs/{id}
     """
     try:
         payload = verify_token(request)
@@ -693,53 +819,27 @@ async def manual_retrain(request: Request):
     if payload.get("sub") != ADMIN_EMAIL:
         raise HTTPException(status_code=403, detail="Admin only")
 
-    # Create retraining dataset from all feedback with chosen labels
-    feedback_data = read_json(FEEDBACK_FILE, [])
-    retrain_data = [item for item in feedback_data if item.get("chosen")]
-    os.makedirs("data", exist_ok=True)
-    retrain_path = os.path.join("data", "retrain_data.json")
-    write_json(retrain_path, retrain_data)
-    app_logger.info("Manual retraining dataset prepared with %d samples", len(retrain_data))
-
-    # Run the training script synchronously
-    trainer_script = os.path.join(os.path.dirname(__file__), "..", "train_model.py")
-    trainer_script = os.path.normpath(trainer_script)
-    if not os.path.exists(trainer_script):
-        # also fallback to project root train_model.py
-        trainer_script = os.path.join(os.getcwd(), "train_model.py")
-
-    if not os.path.exists(trainer_script):
-        msg = "train_model.py not found; cannot start retraining."
-        app_logger.error(msg)
-        return JSONResponse({"status": "error", "message": msg}, status_code=500)
-
-    cmd = ["python", trainer_script, "--data", retrain_path]
-    app_logger.info("Starting retraining subprocess: %s", " ".join(cmd))
-    try:
-        # Run synchronously; capture output (may be long)
-        proc = subprocess.run(cmd, capture_output=True, text=True, check=False)
-        stdout = proc.stdout
-        stderr = proc.stderr
-        exitcode = proc.returncode
-        app_logger.info("Retraining finished with exit code %s", exitcode)
-    except Exception as e:
-        app_logger.exception("Retraining subprocess failed: %s", e)
-        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
-
-    # check for saved model path
-    model_path = os.path.join("models", "final_model", "model.h5")
-    model_exists = os.path.exists(model_path)
-
-    resp = {
-        "status": "ok" if exitcode == 0 else "error",
-        "exitcode": exitcode,
-        "model_saved": model_exists,
-        "model_path": model_path if model_exists else None,
-        "stdout": stdout,
-        "stderr": stderr,
-        "samples_used": len(retrain_data)
-    }
-    return JSONResponse(resp)
+    job = await run_in_threadpool(retrain_jobs.enqueue, "feedback", trainer_args(),
+                                  requested_by=payload.get("sub"), prepare="feedback")
+    return JSONResponse({
+        "status": "queued",
+        "message": f"Retraining queued as job {job['id']}",
+        "job": job,
+    }, status_code=202)
+
+def _prepare_feedback_job(job):
+    # Add all feedback with chosen labels to the training set (already-present images are skipped)
+    added = add_feedback([item for item in all_feedback() if item.get("chosen")])
+    app_logger.info("Manual retraining dataset prepared with %d samples (%d new)", added["images"], added["added"])
+    return added
+
+def _prepare_dataset_job(job):
+    added = add_directory(RAW_DATASET_DIR)
+    app_logger.info("Uploaded dataset: %d images, %d new", added["images"], added["added"])
+    return added
+
+retrain_jobs.register_prepare("feedback", _prepare_feedback_job)
+retrain_jobs.register_prepare("dataset", _prepare_dataset_job)
 
 def trigger_model_retraining():
     """
@@ -762,39 +862,28 @@ async def admin_upload_dataset(request: Request, safe: UploadFile = File(None),
     if payload.get("sub") != ADMIN_EMAIL:
         raise HTTPException(status_code=403, detail="Admin only")
 
-    dataset_path = Path("data/dataset")
-    dataset_path.mkdir(parents=True, exist_ok=True)
-
-    uploaded = []
+    uploaded = {}
     for category, file in [("safe", safe), ("moderate", moderate), ("high", high)]:
-        if file and file.filename.endswith('.zip'):
-            target_dir = dataset_path / category
-            target_dir.mkdir(parents=True, exist_ok=True)
-
-            # Clear existing files in category dir
-            for f in target_dir.glob("*"):
-                if f.is_file():
-                    f.unlink()
-
-            temp_zip_path = dataset_path / f"temp_{category}.zip"
-            with open(temp_zip_path, 'wb') as f:
-                content = await file.read()
-                f.write(content)
-
-            with zipfile.ZipFile(temp_zip_path, 'r') as zip_ref:
-                for member in zip_ref.namelist():
-                    if not member.lower().endswith(('.png', '.jpg', '.jpeg')):
-                        app_logger.warning(f"Skipping non-image file: {member}")
-                        continue
-                    zip_ref.extract(member, target_dir)
-
-            os.remove(temp_zip_path)
-            uploaded.append(category)
+        if not (file and file.filename.endswith('.zip')):
+            continue
+        # Spool to disk in chunks (zip needs random access), then extract member by member into a
+        # new version of the category that is swapped in only when complete
+        DATASET_VERSIONS_DIR.mkdir(parents=True, exist_ok=True)
+        spool = DATASET_VERSIONS_DIR / f"upload-{category}-{os.getpid()}-{id(file)}.zip"
+        try:
+            with open(spool, "wb") as f:
+                while chunk := await file.read(UPLOAD_SPOOL_CHUNK):
+                    f.write(chunk)
+            uploaded[category] = await run_in_threadpool(ingest_zip, spool, category)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail=f"{category}: not a valid zip file")
+        finally:
+            spool.unlink(missing_ok=True)
 
     if not uploaded:
         raise HTTPException(status_code=400, detail="No valid zip files uploaded")
 
-    return {"message": f"Datasets uploaded for categories: {', '.join(uploaded)}"}
+    return {"message": f"Datasets uploaded for categories: {', '.join(uploaded)}", "categories": uploaded}
 
 @app.post("/admin/manual_retrain")
 async def admin_manual_retrain(request: Request):
@@ -802,40 +891,93 @@ async def admin_manual_retrain(request: Request):
     if payload.get("sub") != ADMIN_EMAIL:
         raise HTTPException(status_code=403, detail="Admin only")
 
-    dataset_path = Path("data/dataset")
+    dataset_path = RAW_DATASET_DIR
     if not dataset_path.exists() or not any((dataset_path / cat).exists() for cat in ["safe", "moderate", "high"]):
         raise HTTPException(status_code=400, detail="No dataset uploaded. Upload datasets first.")
 
 
-    try:
-        trainer_script = os.path.join(os.path.dirname(__file__), "train_model.py")
-        cmd = ["python", trainer_script, "--dataset", str(dataset_path)]
-        app_logger.info("Starting manual retraining: %s", " ".join(cmd))
-        proc = subprocess.run(cmd, capture_output=True, text=True, check=False)
-        stdout = proc.stdout
-        stderr = proc.stderr
-        exitcode = proc.returncode
-        app_logger.info("Manual retraining finished with exit code %s", exitcode)
-
-        if exitcode != 0:
-            app_logger.error("Retraining stderr: %s", stderr)
-            raise HTTPException(status_code=500, detail=f"Retraining failed: {stderr}")
-
-        # Check if model was saved
-        model_path = Path("models/final_model/model.h5")
-        if not model_path.exists():
-            raise HTTPException(status_code=500, detail="Model not saved after retraining")
-
-        return {"message": "Manual retraining completed successfully", "stdout": stdout, "stderr": stderr}
+    # The runner adds the images to the training set before training; counts and unreadable
+    # files end up in the job's "prepared"
+    job = await run_in_threadpool(retrain_jobs.enqueue, "dataset", trainer_args(),
+                                  requested_by=payload.get("sub"), prepare="dataset")
+    return JSONResponse({"message": f"Retraining queued as job {job['id']}", "job": job}, status_code=202)
 
-    except Exception as e:
-        app_logger.exception("Manual retraining failed: %s", e)
-        raise HTTPException(status_code=500, detail=f"Retraining failed: {str(e)}")
+@app.get("/admin/retrain/jobs")
+async def admin_retrain_jobs(request: Request, limit: int = 20):
+    payload = verify_token(request)
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    return {"jobs": retrain_jobs.list_jobs(max(1, min(limit, 100))), "active": retrain_jobs.active_job()}
+
+@app.get("/admin/retrain/jobs/{job_id}")
+async def admin_retrain_job(request: Request, job_id: str, log_offset: int = 0):
+    """Polling view of one job: the record (status, progress) plus log output from log_offset."""
+    payload = verify_token(request)
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    job = retrain_jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    log, next_offset = retrain_jobs.read_log(job_id, log_offset)
+    return {"job": job, "log": log, "log_offset": next_offset}
+
+@app.get("/admin/retrain/jobs/{job_id}/events")
+async def admin_retrain_job_events(request: Request, job_id: str):
+    """Server-sent events: "job" whenever the record changes, "log" for new output, then "done"."""
+    payload = verify_token(request)
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    if retrain_jobs.get_job(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        offset, last = 0, None
+        while not await request.is_disconnected():
+            job = retrain_jobs.get_job(job_id)
+            if job is None:
+                break
+            if job != last:
+                last = job
+                yield f"event: job\ndata: {json.dumps(job)}\n\n"
+            log, offset = retrain_jobs.read_log(job_id, offset)
+            if log:
+                yield f"event: log\ndata: {json.dumps(log)}\n\n"
+            if job["status"] in retrain_jobs.FINISHED and not log:
+                yield f"event: done\ndata: {json.dumps(job['status'])}\n\n"
+                break
+            await asyncio.sleep(1)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/admin/retrain/jobs/{job_id}/cancel")
+async def admin_retrain_job_cancel(request: Request, job_id: str):
+    payload = verify_token(request)
+    if payload.get("sub") != ADMIN_EMAIL:
+        raise HTTPException(status_code=403, detail="Admin only")
+    job = retrain_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    audit_logger.info("Retrain job %s cancel requested by %s", job_id, payload.get("sub"))
+    return {"job": job}
 
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
+@app.get("/admin/metrics")
+async def admin_metrics(request: Request):
+    try:
+        payload = verify_token(request)
+    except Exception:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    return {"auth": auth_stats(), "passwords": password_stats(), "secondary_providers": secondary_scheduler.stats(),
+            "priority_queue": priority_queue.stats(), "sectors": sector_status(),
+            "training_set": dataset_stats(), "retrain_jobs": retrain_jobs.stats(), "model_version": model_registry.current(), "serving_model": serving_stats(), "shadow": shadow_eval.stats(),
+            "usage": usage_stats()}
+
 @app.get("/api/welcome")
 async def welcome(request: Request):
     client_ip = request.client.host if request.client else "unknown"
@@ -864,7 +1006,7 @@ async def client_dashboard_page(request: Request):
         else:
             user = payload.get("sub")
             # Fetch recent feedback for the user (last 10 feedback entries)
-            feedback_data = read_json(FEEDBACK_FILE, [])
+            feedback_data = all_feedback()
             user_feedback = [f for f in feedback_data if f.get("user") == user]
             # Sort by timestamp descending
             user_feedback.sort(key=lambda x: x.get("user_feedback_ts") or x.get("ts", ""), reverse=True)
@@ -1027,22 +1169,6 @@ async def reports_page(request: Request):
     now = datetime.utcnow()
     past_24h = now - timedelta(hours=24)
 
-    # Fetch feedback data
-    feedback_data = read_json(FEEDBACK_FILE, [])
-    recent_feedback = []
-    for f in feedback_data:
-        if f.get("chosen") is not None and f.get("user") == user:
-            try:
-                ts_str = f.get("user_feedback_ts") or f.get("ts", "2000-01-01T00:00:00")
-                if not isinstance(ts_str, str):
-                    continue
-                ts = datetime.fromisoformat(ts_str.replace('Z', '+00:00'))
-                if ts > past_24h:
-                    recent_feedback.append(f)
-            except Exception:
-                # Skip invalid timestamps
-                pass
-
     # Fetch uploads (assuming filenames have timestamps or use file mtime)
     uploads_dir = Path(UPLOADS_DIR)
     recent_uploads = []
@@ -1058,6 +1184,9 @@ async def reports_page(request: Request):
                         "url": f"/uploads/{file_path.name}"
                     })
 
+    # Feedback the user gave in the last 24h (by user_feedback_ts)
+    recent_feedback = user_feedback_since(user, past_24h)
+
     # Compute summary stats
     total_uploads = len(recent_uploads)
     total_predictions = len(recent_feedback)
@@ -1065,24 +1194,10 @@ async def reports_page(request: Request):
     nsfw_predictions = sum(1 for f in recent_feedback if f.get("primary", {}).get("label") == "nsfw")
     safe_predictions = total_predictions - nsfw_predictions
 
-    # Get upload counts for the last 7 days
+    # Predictions per day for the last 7 days, oldest first, from the daily rollups
     today = datetime.utcnow().date()
-    dates = [(today - timedelta(days=i)).isoformat() for i in range(6, -1, -1)]  # Last 7 days, oldest first
-
-    upload_counts = read_json(UPLOAD_COUNT_FILE, {})
-    user_uploads = upload_counts.get(user, 0)  # Total uploads, but we need daily
-
-    # For simplicity, since we don't have daily breakdown, we'll simulate based on total
-    # In a real app, you'd store daily upload counts
-    # For now, distribute the total uploads across the week
-    total_uploads_week = user_uploads
-    if total_uploads_week > 0:
-        # Simple distribution: more recent days have more uploads
-        base = total_uploads_week // 7
-        remainder = total_uploads_week % 7
-        data = [base + (1 if i < remainder else 0) for i in range(7)]
-    else:
-        data = [0] * 7
+    dates = [(today - timedelta(days=i)).isoformat() for i in range(6, -1, -1)]
+    data = [r.get("predictions", 0) for r in user_rollups(user, dates)]
 
     # Prepare data for template
     reports_data = {
@@ -1118,25 +1233,8 @@ async def client_stats(request: Request):
     today = datetime.utcnow().date()
     dates = [(today - timedelta(days=i)).isoformat() for i in range(6, -1, -1)]  # Last 7 days, oldest first
 
-    # Read daily upload logs or aggregate from feedback data
-    # Assuming we log daily uploads in a file or calculate from feedback
-    feedback_data = read_json(FEEDBACK_FILE, [])
-    user_feedback = [f for f in feedback_data if f.get("user") == user]
-
-    # Aggregate uploads per day
-    daily_uploads = {}
-    for f in user_feedback:
-        ts_str = f.get("ts", "")
-        if ts_str:
-            try:
-                ts = datetime.fromisoformat(ts_str.replace('Z', '+00:00'))
-                day = ts.date().isoformat()
-                daily_uploads[day] = daily_uploads.get(day, 0) + 1
-            except:
-                pass
-
-    # Fill data for last 7 days
-    data = [daily_uploads.get(date, 0) for date in dates]
+    # Uploads per day from the feedback rollups
+    data = [r.get("predictions", 0) for r in user_rollups(user, dates)]
 
     return {"labels": dates, "data": data}
 
@@ -1149,16 +1247,15 @@ async def api_profile(request: Request):
     user = payload.get("sub")
 
     # Get user data
-    users = read_json(USERS_FILE, [])
-    user_data = next((u for u in users if u.get("user") == user), None)
+    user_data = user_directory.get_user(user)
     if not user_data:
         raise HTTPException(status_code=404, detail="User not found")
 
     # Get API key usage
-    api_keys = read_json(API_KEYS_FILE, {"clients": []})
-    client = next((c for c in api_keys.get("clients", []) if c.get("email") == user), None)
-    image_usage = client.get("quota", {}).get("image_used", 0) if client else 0
-    video_usage = client.get("quota", {}).get("video_used", 0) if client else 0
+    client = next(iter(find_clients_by_email(user)), None)
+    quota = live_quota(client) if client else {}
+    image_usage = quota.get("image_used", 0)
+    video_usage = quota.get("video_used", 0)
 
     return {
         "email": user,
@@ -1198,21 +1295,7 @@ async def chart_prediction_stats(request: Request):
     today = datetime.utcnow().date()
     dates = [(today - timedelta(days=i)).isoformat() for i in range(6, -1, -1)]
 
-    feedback_data = read_json(FEEDBACK_FILE, [])
-    user_feedback = [f for f in feedback_data if f.get("user") == user]
-
-    daily_uploads = {}
-    for f in user_feedback:
-        ts_str = f.get("ts", "")
-        if ts_str:
-            try:
-                ts = datetime.fromisoformat(ts_str.replace('Z', '+00:00'))
-                day = ts.date().isoformat()
-                daily_uploads[day] = daily_uploads.get(day, 0) + 1
-            except:
-                pass
-
-    data = [daily_uploads.get(date, 0) for date in dates]
+    data = [r.get("predictions", 0) for r in user_rollups(user, dates)]
 
     return {"labels": dates, "data": data}
 
@@ -1224,10 +1307,10 @@ async def chart_profile_usage(request: Request):
         raise HTTPException(status_code=401, detail="Unauthorized")
     user = payload.get("sub")
 
-    api_keys = read_json(API_KEYS_FILE, {"clients": []})
-    client = next((c for c in api_keys.get("clients", []) if c.get("email") == user), None)
-    image_used = client.get("quota", {}).get("image_used", 0) if client else 0
-    video_used = client.get("quota", {}).get("video_used", 0) if client else 0
+    client = next(iter(find_clients_by_email(user)), None)
+    quota = live_quota(client) if client else {}
+    image_used = quota.get("image_used", 0)
+    video_used = quota.get("video_used", 0)
     image_remaining = 50 - image_used
     video_remaining = 10 - video_used
 
@@ -1249,15 +1332,7 @@ async def chart_reports_usage(request: Request):
     today = datetime.utcnow().date()
     dates = [(today - timedelta(days=i)).isoformat() for i in range(6, -1, -1)]
 
-    upload_counts = read_json(UPLOAD_COUNT_FILE, {})
-    user_uploads = upload_counts.get(user, 0)
-
-    if user_uploads > 0:
-        base = user_uploads // 7
-        remainder = user_uploads % 7
-        data = [base + (1 if i < remainder else 0) for i in range(7)]
-    else:
-        data = [0] * 7
+    data = [r.get("predictions", 0) for r in user_rollups(user, dates)]
 
     return {"labels": dates, "data": data}
 
@@ -1269,13 +1344,9 @@ async def chart_feedback_distribution(request: Request):
         raise HTTPException(status_code=401, detail="Unauthorized")
     user = payload.get("sub")
 
-    feedback_data = read_json(FEEDBACK_FILE, [])
-    user_feedback = [f for f in feedback_data if f.get("user") == user and f.get("chosen")]
-    perfect = sum(1 for f in user_feedback if f.get("chosen") == "perfect")
-    okay = sum(1 for f in user_feedback if f.get("chosen") == "okay")
-    wrong = sum(1 for f in user_feedback if f.get("chosen") == "wrong")
+    totals = user_totals(user)
 
-    return {"labels": ['Perfect', 'Okay', 'Wrong'], "data": [perfect, okay, wrong]}
+    return {"labels": ['Perfect', 'Okay', 'Wrong'], "data": [totals.get("perfect", 0), totals.get("okay", 0), totals.get("wrong", 0)]}
 
 @app.get("/api/chart/disagreement_trends")
 async def chart_disagreement_trends(request: Request):
@@ -1317,13 +1388,12 @@ async def chart_admin_dashboard_summary(request: Request):
     if payload.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Admin only")
 
-    users = read_json(USERS_FILE, [])
-    feedback_data = read_json(FEEDBACK_FILE, [])
+    counts = user_directory.user_counts()
     usage_data = read_json(API_USAGE_FILE, {})
 
-    total_users = len(users)
-    blocked = sum(1 for u in users if u.get("status") == "blocked")
-    total_feedback = len(feedback_data)
+    total_users = counts["total"]
+    blocked = counts["blocked"]
+    total_feedback = feedback_count()
     total_api_calls = sum(day.get("api_calls", 0) for day in usage_data.values() if isinstance(day, dict))
 
     return {
@@ -0,0 +1,256 @@
+"""
+model_registry.py
+
+Versioned model store. Each trained model is an immutable directory under
+<models>/versions/<version> with a manifest of SHA-256 checksums; <models>/final_model is a
+symlink to the current version, swapped with a single rename, so promotion and rollback
+are O(1) and there is never a moment without a model. A second link, <models>/candidate,
+marks a registered version under shadow evaluation. Used by train_model.py (run as a
+script, so this module has no app imports) and by the admin endpoints.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+CURRENT = "final_model"
+CANDIDATE = "candidate"
+MANIFEST = "manifest.json"
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ModelRegistry:
+    def __init__(self, root):
+        self.root = Path(root)
+        self.versions_dir = self.root / "versions"
+        self.current_link = self.root / CURRENT
+        self.log_path = self.root / "registry_log.jsonl"
+
+    @contextmanager
+    def _locked(self):
+        self.versions_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.root / ".registry.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._migrate()
+            yield
+
+    # ---------------------------------------------------------------- legacy layout
+    def migrate(self):
+        """Convert a pre-registry models directory in place; a no-op once converted."""
+        with self._locked():
+            pass
+
+    def _migrate(self):
+        """Adopt a plain final_model/ and final_model_v* backups as versions (renames, no copies)."""
+        for legacy in sorted(self.root.glob(CURRENT + "_v*")):
+            if legacy.is_dir() and not legacy.is_symlink():
+                self._adopt(legacy, legacy.name)
+        if self.current_link.is_dir() and not self.current_link.is_symlink():
+            version = self._adopt(self.current_link, "legacy")
+            self._point_at(version)
+            self._log("migrate", version, None, "registry", "adopted existing final_model")
+
+    def _adopt(self, directory, label):
+        version = self._new_id(label)
+        created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(directory.stat().st_mtime))
+        self._write_manifest(directory, version, {"imported_from": directory.name, "created": created})
+        os.rename(directory, self.versions_dir / version)
+        return version
+
+    # ---------------------------------------------------------------- versions
+    @staticmethod
+    def valid_id(version):
+        """A version id names one directory under versions/: no separators, no dot-files."""
+        return (isinstance(version, str) and bool(version) and not version.startswith(".")
+                and not any(sep in version for sep in ("/", os.sep, os.altsep) if sep))
+
+    def _new_id(self, tag):
+        base = f"v{time.strftime('%Y%m%d-%H%M%S')}-{tag}"
+        version, n = base, 1
+        while (self.versions_dir / version).exists():
+            n += 1
+            version = f"{base}-{n}"
+        return version
+
+    def _write_manifest(self, directory, version, extra=None):
+        files = {}
+        for p in sorted(directory.rglob("*")):
+            if p.is_file() and p.name != MANIFEST:
+                files[str(p.relative_to(directory))] = {"sha256": file_sha256(p), "bytes": p.stat().st_size}
+        meta = {}
+        if (directory / "metadata.json").exists():
+            try:
+                with open(directory / "metadata.json", "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+            except ValueError:
+                pass
+        manifest = {"version": version, "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "files": files, "metadata": meta, **(extra or {})}
+        with open(directory / MANIFEST, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+    def stage(self):
+        """A fresh directory to write a new model into; register it with commit()."""
+        self.versions_dir.mkdir(parents=True, exist_ok=True)
+        staging = self.versions_dir / f".staging-{uuid.uuid4().hex[:12]}"
+        staging.mkdir()
+        return staging
+
+    def commit(self, staging, tag=None):
+        """Checksum a staged directory and publish it as an immutable version; returns its id."""
+        staging = Path(staging)
+        if tag is None:
+            model = staging / "model.h5"
+            tag = file_sha256(model)[:8] if model.exists() else "model"
+        with self._locked():
+            version = self._new_id(tag)
+            self._write_manifest(staging, version)
+            for p in staging.rglob("*"):
+                if p.is_file():
+                    os.chmod(p, 0o444)
+            os.rename(staging, self.versions_dir / version)
+        return version
+
+    def manifest(self, version):
+        if not self.valid_id(version):
+            return None
+        try:
+            with open(self.versions_dir / version / MANIFEST, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def path(self, version):
+        return self.versions_dir / version
+
+    def _target(self, name):
+        try:
+            return Path(os.readlink(self.root / name)).name
+        except OSError:
+            return None
+
+    def current(self):
+        """Id of the version final_model points at, or None."""
+        return self._target(CURRENT)
+
+    def candidate(self):
+        """Id of the version under shadow evaluation, or None."""
+        return self._target(CANDIDATE)
+
+    def versions(self):
+        """Manifests (without the file list) of every version, newest first."""
+        current, candidate = self.current(), self.candidate()
+        out = []
+        for d in self.versions_dir.glob("*") if self.versions_dir.exists() else []:
+            if d.name.startswith(".") or not d.is_dir():
+                continue
+            m = self.manifest(d.name) or {"version": d.name}
+            out.append({k: v for k, v in m.items() if k != "files"}
+                       | {"current": d.name == current, "candidate": d.name == candidate})
+        return sorted(out, key=lambda m: (m.get("created", ""), m["version"]), reverse=True)
+
+    def verify(self, version):
+        """Names of files whose checksum no longer matches the manifest ([] when intact)."""
+        m = self.manifest(version)
+        if m is None:
+            return ["manifest.json"]
+        bad = []
+        for name, info in m["files"].items():
+            p = self.versions_dir / version / name
+            if not p.exists() or file_sha256(p) != info["sha256"]:
+                bad.append(name)
+        return bad
+
+    # ---------------------------------------------------------------- pointer
+    def _point_at(self, version, name=CURRENT):
+        link = self.root / f".{name}.swap"
+        if link.is_symlink() or link.exists():
+            link.unlink()
+        os.symlink(Path("versions") / version, link)
+        os.replace(link, self.root / name)
+
+    def _log(self, action, version, previous, by, reason):
+        entry = {"ts": time.strftime("%Y-%m-%d %H:%M:%S"), "action": action, "version": version,
+                 "previous": previous, "by": by, "reason": reason}
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def history(self, limit=50):
+        if not self.log_path.exists():
+            return []
+        with open(self.log_path, "r", encoding="utf-8") as f:
+            lines = f.readlines()[-limit:]
+        return [json.loads(line) for line in reversed(lines) if line.strip()]
+
+    def promote(self, version, by=None, reason=None, action="promote"):
+        """Make version current by swapping the final_model link; returns the previous version."""
+        with self._locked():
+            if not self.valid_id(version) or not (self.versions_dir / version / MANIFEST).exists():
+                raise KeyError(version)
+            previous = self.current()
+            if previous != version:
+                self._point_at(version)
+                self._log(action, version, previous, by, reason)
+            if self.candidate() == version:
+                os.unlink(self.root / CANDIDATE)
+            return previous
+
+    def set_candidate(self, version, by=None, reason=None):
+        """Mark a registered version for shadow evaluation, replacing any earlier candidate."""
+        with self._locked():
+            if not self.valid_id(version) or not (self.versions_dir / version / MANIFEST).exists():
+                raise KeyError(version)
+            previous = self.candidate()
+            self._point_at(version, CANDIDATE)
+            self._log("candidate", version, previous, by, reason)
+            return previous
+
+    def clear_candidate(self, by=None, reason=None):
+        """Stop evaluating the candidate (it stays registered); returns its id or None."""
+        with self._locked():
+            version = self.candidate()
+            if version is not None:
+                os.unlink(self.root / CANDIDATE)
+                self._log("reject", version, None, by, reason)
+            return version
+
+    def rollback(self, version=None, by=None):
+        """Switch back to version, or undo the last switch when version is None."""
+        if version is None:
+            switches = ("migrate", "promote", "rollback")
+            last = next((h for h in self.history() if h["action"] in switches and h.get("previous")), None)
+            if last is None or last["version"] != self.current():
+                raise KeyError("no previous version to roll back to")
+            version = last["previous"]
+        self.promote(version, by=by, reason="rollback", action="rollback")
+        return version
+
+    def prune(self, keep):
+        """Delete all but the newest `keep` versions; the current one and the candidate are always kept."""
+        if keep <= 0:
+            return []
+        with self._locked():
+            removed = []
+            for m in self.versions()[keep:]:
+                if m["current"] or m["candidate"]:
+                    continue
+                shutil.rmtree(self.versions_dir / m["version"], ignore_errors=True)
+                removed.append(m["version"])
+            for staging in self.versions_dir.glob(".staging-*"):
+                if time.time() - staging.stat().st_mtime > 86400:  # abandoned by a crashed trainer
+                    shutil.rmtree(staging, ignore_errors=True)
+            return removed
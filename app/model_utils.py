@@ -1,11 +1,14 @@
-import os, cv2, torch, json, random
+import os, cv2, torch, json, random, threading, time
+import numpy as np
+from contextlib import contextmanager
 from pathlib import Path
-from .config import MODELS_DIR, CACHE_FILE
+from .config import MODELS_DIR, CACHE_FILE, MODEL_RELOAD_INTERVAL
 from .logger import app_logger
+from .model_registry import ModelRegistry
 
 # Load model (placeholder for actual model loading)
-def load_model():
-    model_path = os.path.join(MODELS_DIR, "final_model", "model.h5")
+def load_model(model_dir=None):
+    model_path = os.path.join(model_dir or os.path.join(MODELS_DIR, "final_model"), "model.h5")
     if os.path.exists(model_path):
         # Placeholder: In real implementation, load TensorFlow/Keras model
         app_logger.info(f"Model loaded from {model_path}")
@@ -14,15 +17,152 @@ def load_model():
         app_logger.warning(f"Model not found at {model_path}")
         return {"loaded": False}
 
+def infer(model, content_bytes):
+    # Placeholder prediction logic
+    # In real implementation, preprocess image and run model inference
+    labels = ["safe", "moderate", "high"]
+    label = random.choices(labels, weights=[0.7, 0.2, 0.1])[0]
+    confidence = round(random.uniform(0.5, 0.95), 3)
+    return {"label": label, "confidence": confidence}
+
+# -----------------------------
+# Hot reload
+# -----------------------------
+# Each worker serves one loaded model version. A watcher thread polls the registry's
+# final_model link; when it moves, the new version is loaded and warmed up off the request
+# path, then swapped in under a lock. A request holds the version it started with until it
+# finishes (all frames of a video see the same model), so the old version is released
+# only once its in-flight requests have drained.
+model_registry = ModelRegistry(MODELS_DIR)
+model_registry.migrate()  # a plain models/final_model directory becomes the first version
+
+class ServedModel:
+    def __init__(self, version, model, load_ms=0.0):
+        self.version = version
+        self.model = model
+        self.load_ms = load_ms
+        self.loaded_at = time.time()
+        self.inflight = 0
+        self.retired = False
+
+_lock = threading.Lock()
+_serving = {"current": None, "draining": [], "swap_ms": 0.0, "swaps": 0, "failed": None,
+            "thread": None, "pid": None}
+_stop = threading.Event()
+
+def _warm_up(model):
+    # One throwaway inference so the first real request does not pay for graph setup
+    ok, blank = cv2.imencode(".jpg", np.zeros((224, 224, 3), dtype=np.uint8))
+    infer(model, blank.tobytes())
+
+def load_version(version):
+    """Load and warm up a registered version (None: whatever final_model holds)."""
+    start = time.perf_counter()
+    model_dir = model_registry.path(version) if version else None
+    model = load_model(str(model_dir) if model_dir else None)
+    _warm_up(model)
+    return ServedModel(version, model, (time.perf_counter() - start) * 1000)
+
+def _release(served):
+    served.model = None
+    app_logger.info("Model %s released after draining", served.version)
+
+def _swap(served):
+    start = time.perf_counter()
+    with _lock:
+        old = _serving["current"]
+        _serving["current"] = served
+        _serving["swap_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        _serving["swaps"] += 1
+        release_now = old is not None and not old.inflight
+        if old is not None:
+            old.retired = True
+            if old.inflight:
+                _serving["draining"].append(old)
+    if release_now:
+        _release(old)
+    app_logger.info("Serving model %s (loaded and warmed in %.0f ms, swapped in %.3f ms)",
+                    served.version, served.load_ms, _serving["swap_ms"])
+
+@contextmanager
+def serving():
+    """The model version to use for one request; swaps never change it mid-request."""
+    with _lock:
+        served = _serving["current"]
+        served.inflight += 1
+    try:
+        yield served
+    finally:
+        with _lock:
+            served.inflight -= 1
+            drained = served.retired and served.inflight == 0
+            if drained:
+                _serving["draining"].remove(served)
+        if drained:
+            _release(served)
+
+def _model_info(served):
+    return {"model_version": served.version, "model_swap_ms": _serving["swap_ms"]}
+
+def check_for_new_model():
+    """Load and swap in the registry's current version if it differs from the served one."""
+    version = model_registry.current()
+    if version is None or version == _serving["current"].version or version == _serving["failed"]:
+        return False
+    damaged = model_registry.verify(version)
+    if damaged:
+        app_logger.error("Not serving model %s: checksum mismatch in %s", version, ", ".join(damaged))
+        _serving["failed"] = version
+        return False
+    try:
+        served = load_version(version)
+    except Exception as e:
+        app_logger.exception("Loading model %s failed; still serving %s: %s", version, _serving["current"].version, e)
+        _serving["failed"] = version
+        return False
+    _serving["failed"] = None
+    _swap(served)
+    return True
+
+def _watch():
+    while not _stop.wait(MODEL_RELOAD_INTERVAL):
+        try:
+            check_for_new_model()
+        except Exception as e:
+            app_logger.exception("Model watcher error: %s", e)
+
+def start_model_watcher():
+    """Start this process's watcher thread (once per pid, so it survives a pre-fork)."""
+    if MODEL_RELOAD_INTERVAL <= 0:
+        return
+    if _serving["thread"] is not None and _serving["pid"] == os.getpid():
+        return
+    _stop.clear()
+    _serving["pid"] = os.getpid()
+    _serving["thread"] = threading.Thread(target=_watch, name="model-watcher", daemon=True)
+    _serving["thread"].start()
+
+def stop_model_watcher():
+    _stop.set()
+    _serving["thread"] = None
+
+def serving_stats():
+    with _lock:
+        current = _serving["current"]
+        return {"version": current.version, "loaded": bool(current.model and current.model.get("loaded")),
+                "loaded_at": current.loaded_at, "load_ms": round(current.load_ms, 1),
+                "inflight": current.inflight, "swap_ms": _serving["swap_ms"], "swaps": _serving["swaps"],
+                "draining": [{"version": s.version, "inflight": s.inflight} for s in _serving["draining"]],
+                "failed_version": _serving["failed"]}
+
 # Predict image bytes
 def predict_image_bytes(content_bytes):
     try:
-        # Placeholder prediction logic
-        # In real implementation, preprocess image and run model inference
-        labels = ["safe", "moderate", "high"]
-        label = random.choices(labels, weights=[0.7, 0.2, 0.1])[0]
-        confidence = round(random.uniform(0.5, 0.95), 3)
-        return {"label": label, "confidence": confidence}
+        with serving() as served:
+            start = time.perf_counter()
+            result = infer(served.model, content_bytes)
+            elapsed = (time.perf_counter() - start) * 1000
+        return {**result, **_model_info(served), "inference_ms": round(elapsed, 2)}
     except Exception as e:
         app_logger.exception(f"Error predicting image: {e}")
         return {"status": "error", "message": "Prediction failed"}
@@ -46,25 +186,26 @@ def predict_video_aggregated(video_path):
         frame_results = []
         frame_number = 0
 
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            if frame_number % sample_interval == 0:
-                # Convert frame to bytes
-                success, buffer = cv2.imencode('.jpg', frame)
-                if success:
-                    frame_bytes = buffer.tobytes()
-                    result = predict_image_bytes(frame_bytes)
-                    frame_results.append({
-                        "frame": frame_number,
-                        "timestamp": frame_number / fps if fps > 0 else 0,
-                        "label": result.get("label", "unknown"),
-                        "confidence": result.get("confidence", 0.0)
-                    })
-
-            frame_number += 1
+        with serving() as served:
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+
+                if frame_number % sample_interval == 0:
+                    # Convert frame to bytes
+                    success, buffer = cv2.imencode('.jpg', frame)
+                    if success:
+                        frame_bytes = buffer.tobytes()
+                        result = infer(served.model, frame_bytes)
+                        frame_results.append({
+                            "frame": frame_number,
+                            "timestamp": frame_number / fps if fps > 0 else 0,
+                            "label": result.get("label", "unknown"),
+                            "confidence": result.get("confidence", 0.0)
+                        })
+
+                frame_number += 1
 
         cap.release()
 
@@ -88,7 +229,8 @@ def predict_video_aggregated(video_path):
             "frames_analyzed": len(frame_results),
             "total_frames": frame_count,
             "duration": round(duration, 2),
-            "frame_details": frame_results
+            "frame_details": frame_results,
+            **_model_info(served)
         }
 
     except Exception as e:
@@ -114,4 +256,4 @@ def set_cache(data):
         app_logger.exception(f"Error writing cache: {e}")
 
 # Initialize model on import
-MODEL = load_model()
+_serving["current"] = load_version(model_registry.current())
@@ -0,0 +1,42 @@
+import asyncio, functools, threading
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+from fastapi import HTTPException
+from .config import BCRYPT_ROUNDS, PASSWORD_POOL_WORKERS, PASSWORD_QUEUE_LIMIT
+from .logger import app_logger
+
+# bcrypt releases the GIL while hashing, so a small dedicated pool gives real
+# parallelism without letting a login storm take every core from inference.
+_pool = ThreadPoolExecutor(max_workers=PASSWORD_POOL_WORKERS, thread_name_prefix="bcrypt")
+_admitted = threading.BoundedSemaphore(PASSWORD_QUEUE_LIMIT)
+_stats = {"admitted": 0, "rejected": 0}
+
+def hash_password(password):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(BCRYPT_ROUNDS)).decode('utf-8')
+
+def check_password(password, hashed):
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+async def offload(fn, *args, **kwargs):
+    """
+    Run a password-hashing call (or a function that makes one) on the bcrypt pool.
+    At most PASSWORD_QUEUE_LIMIT calls may be running or queued; past that the
+    request is refused with 503 instead of queueing behind the storm.
+    """
+    if not _admitted.acquire(blocking=False):
+        _stats["rejected"] += 1
+        app_logger.warning("Password hashing queue full; rejecting request")
+        raise HTTPException(status_code=503, detail="Too many login attempts in progress", headers={"Retry-After": "1"})
+    _stats["admitted"] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_pool, functools.partial(fn, *args, **kwargs))
+    finally:
+        _admitted.release()
+
+def password_stats():
+    return {
+        "workers": PASSWORD_POOL_WORKERS,
+        "queue_limit": PASSWORD_QUEUE_LIMIT,
+        "bcrypt_rounds": BCRYPT_ROUNDS,
+        **_stats,
+    }
@@ -0,0 +1,109 @@
+import bisect, json, os, threading
+from .config import PRIORITY_DIR, PRIORITY_QUEUE_FILE
+from .logger import priority_logger
+from .record_store import RecordStore, op_put, op_patch, op_del
+from .utils import now_iso, page_after
+
+# Primary/secondary disagreements, one record per feedback id in a single append-only
+# log. Each consumer acknowledges items independently; an item is dropped once every
+# consumer has acked it, and the store's compaction reclaims the space.
+PRIORITY = "priority"
+CONSUMER_ADMIN = "admin"      # admin review UI
+CONSUMER_RETRAIN = "retrain"  # retraining jobs
+CONSUMERS = (CONSUMER_ADMIN, CONSUMER_RETRAIN)
+
+def _bootstrap():
+    """Import the legacy models/priority_feedback/<id>.json files on first start."""
+    ops = []
+    if not PRIORITY_DIR.exists():
+        return ops
+    for name in sorted(os.listdir(PRIORITY_DIR)):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(PRIORITY_DIR / name, "r", encoding="utf-8") as f:
+                item = json.load(f)
+        except Exception:
+            priority_logger.warning("Skipping unreadable priority file %s", name)
+            continue
+        if isinstance(item, dict) and item.get("id"):
+            ops.append(op_put(PRIORITY, item["id"], {**item, "acks": {}}))
+    return ops
+
+store = RecordStore(PRIORITY_QUEUE_FILE, bootstrap=_bootstrap)
+
+# Per-consumer queue of unacknowledged items, ordered by (ts, id)
+_pending = {c: [] for c in CONSUMERS}
+_index_lock = threading.Lock()
+
+def _reset():
+    with _index_lock:
+        for q in _pending.values():
+            q.clear()
+
+def _apply(ns, key, old, new):
+    if ns != PRIORITY:
+        return
+    with _index_lock:
+        for record, insert in ((old, False), (new, True)):
+            if record is None:
+                continue
+            entry = (record.get("ts", ""), key)
+            for consumer in CONSUMERS:
+                if consumer in (record.get("acks") or {}):
+                    continue
+                q = _pending[consumer]
+                i = bisect.bisect_left(q, entry)
+                if insert:
+                    q.insert(i, entry)
+                elif i < len(q) and q[i] == entry:
+                    del q[i]
+
+store.add_listener(_apply, _reset)
+
+def enqueue(item):
+    """Add one disagreement; `item` must carry the feedback id and ts."""
+    store.put(PRIORITY, item["id"], {**item, "acks": {}})
+
+def get_item(item_id):
+    return store.get(PRIORITY, item_id)
+
+def pending(consumer, cursor=None, limit=50):
+    """Oldest-first page of items `consumer` hasn't acked yet; returns (items, next_cursor)."""
+    def read():
+        with _index_lock:
+            keys, next_cursor = page_after(_pending[consumer], cursor, limit)
+        items = [store.peek(PRIORITY, k) for _, k in keys]
+        return [i for i in items if i is not None], next_cursor
+    return store.read(read)
+
+def pending_ids(consumer):
+    def read():
+        with _index_lock:
+            return {k for _, k in _pending[consumer]}
+    return store.read(read)
+
+def ack(consumer, item_ids):
+    """Acknowledge items for one consumer in a single write; returns how many changed."""
+    def step():
+        ops = []
+        for item_id in item_ids:
+            item = store.peek(PRIORITY, item_id)
+            if item is None or consumer in (item.get("acks") or {}):
+                continue
+            acks = {**(item.get("acks") or {}), consumer: now_iso()}
+            if all(c in acks for c in CONSUMERS):
+                ops.append(op_del(PRIORITY, item_id))
+            else:
+                ops.append(op_patch(PRIORITY, item_id, {"acks": acks}))
+        return ops, len(ops)
+    changed = store.atomic(step)
+    if changed:
+        priority_logger.info("%s acknowledged %d priority items", consumer, changed)
+    return changed
+
+def stats():
+    def read():
+        with _index_lock:
+            return {c: len(q) for c, q in _pending.items()}
+    return {"pending": store.read(read), "total": store.count(PRIORITY)}
@@ -0,0 +1,146 @@
+import heapq, itertools, threading, time
+from .logger import app_logger
+
+# Priority lanes: interactive (/api/predict) is always served before m2m bulk.
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BULK = "bulk"
+_PRIORITY_RANK = {PRIORITY_INTERACTIVE: 0, PRIORITY_BULK: 1}
+
+
+def _month_key():
+    return time.strftime("%Y-%m", time.gmtime())
+
+
+class ProviderBucket:
+    """
+    Token bucket for one secondary provider with a bounded, prioritised wait queue.
+    rate <= 0 means the provider has no per-second limit (e.g. the local fallback).
+    """
+
+    def __init__(self, name, rate, burst=1, monthly_cap=0, max_waiters=64):
+        self.name = name
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.monthly_cap = int(monthly_cap)
+        self.month = _month_key()
+        self.month_used = 0
+        self.max_waiters = int(max_waiters)
+        self._waiters = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.stats = {"granted": 0, "deadline": 0, "queue_full": 0, "monthly_cap": 0, "provider_throttled": 0}
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _month_exhausted(self):
+        month = _month_key()
+        if month != self.month:
+            self.month = month
+            self.month_used = 0
+        return self.monthly_cap > 0 and self.month_used >= self.monthly_cap
+
+    def _grant(self):
+        self.month_used += 1
+        self.stats["granted"] += 1
+        return True, None
+
+    def _reject(self, reason):
+        self.stats[reason] += 1
+        return False, reason
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE, timeout=2.0):
+        """
+        Wait up to `timeout` seconds for a token.
+        Returns (True, None) when the call may proceed, otherwise (False, reason).
+        """
+        rank = _PRIORITY_RANK.get(priority, 1)
+        with self._cond:
+            if self._month_exhausted():
+                return self._reject("monthly_cap")
+            if self.rate <= 0 and time.monotonic() >= self.blocked_until:
+                return self._grant()
+            if len(self._waiters) >= self.max_waiters:
+                return self._reject("queue_full")
+
+            ticket = (rank, next(self._seq))
+            heapq.heappush(self._waiters, ticket)
+            deadline = time.monotonic() + max(0.0, timeout)
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                head = self._waiters[0] == ticket
+                ready = now >= self.blocked_until and (self.rate <= 0 or self.tokens >= 1)
+                if head and ready:
+                    heapq.heappop(self._waiters)
+                    if self.rate > 0:
+                        self.tokens -= 1
+                    self._cond.notify_all()
+                    return self._grant()
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._waiters.remove(ticket)
+                    heapq.heapify(self._waiters)
+                    self._cond.notify_all()
+                    return self._reject("deadline")
+                wait = remaining
+                if head:
+                    # Only the head of the queue sleeps on the refill clock; the rest wait to be notified.
+                    until_token = (1 - self.tokens) / self.rate if self.rate > 0 else 0.0
+                    wait = min(wait, max(self.blocked_until - now, until_token, 0.001))
+                self._cond.wait(wait)
+
+    def penalize(self, retry_after=1.0):
+        """Provider answered 429: drain the bucket and hold new calls for `retry_after` seconds."""
+        with self._cond:
+            self.tokens = 0.0
+            self.blocked_until = max(self.blocked_until, time.monotonic() + max(0.0, retry_after))
+            self.stats["provider_throttled"] += 1
+            self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            self._refill(time.monotonic())
+            return {
+                "rate": self.rate,
+                "burst": self.capacity,
+                "tokens": round(self.tokens, 3),
+                "waiting": len(self._waiters),
+                "monthly_cap": self.monthly_cap,
+                "month_used": self.month_used,
+                "blocked_for": round(max(0.0, self.blocked_until - time.monotonic()), 3),
+                **self.stats,
+            }
+
+
+class ProviderScheduler:
+    """One ProviderBucket per secondary provider entry (keyed like secondary_model.API_KEYS)."""
+
+    def __init__(self, limits, max_waiters=64):
+        self.buckets = {
+            name: ProviderBucket(name, l.get("rps", 0), l.get("burst", 1), l.get("monthly_cap", 0), max_waiters)
+            for name, l in limits.items()
+        }
+
+    def acquire(self, name, priority=PRIORITY_INTERACTIVE, timeout=2.0):
+        bucket = self.buckets.get(name)
+        if bucket is None:
+            return True, None
+        ok, reason = bucket.acquire(priority, timeout)
+        if not ok:
+            app_logger.warning("Secondary provider %s unavailable for %s request: %s", name, priority, reason)
+        return ok, reason
+
+    def report_throttled(self, name, retry_after=1.0):
+        bucket = self.buckets.get(name)
+        if bucket is not None:
+            bucket.penalize(retry_after)
+            app_logger.warning("Secondary provider %s returned 429; backing off %.1fs", name, retry_after)
+
+    def stats(self):
+        return {name: b.snapshot() for name, b in self.buckets.items()}
@@ -0,0 +1,66 @@
+import time
+from .shared_counters import TableFull
+from .usage_counters import SharedTableWriteBehind
+from .logger import app_logger
+
+DAY_SECONDS = 86400
+FIELDS = ("image_used", "video_used", "reset_ts", "epoch")
+
+
+class QuotaEngine(SharedTableWriteBehind):
+    """
+    Per-client image/video counters kept in a host-wide shared table.
+
+    consume() only touches the shared table; the durable record (api_keys.json) is
+    updated by `persist(snapshot)` every `flush_interval` seconds and at shutdown,
+    with one write per batch. Counters survive a worker crash (the table is a
+    file-backed mapping); a host crash loses at most one flush interval of usage.
+
+    The durable record carries an "epoch"; an admin write bumps it, and a slot
+    holding an older epoch is reseeded from the record on its next use. When the
+    table is full, `fallback(api_key, step)` counts against the durable record.
+    """
+
+    def __init__(self, path, persist, fallback, flush_interval=5.0, max_batch=500, slots=65536):
+        super().__init__("quota", path, FIELDS, persist, flush_interval, max_batch, slots)
+        self.fallback = fallback
+
+    def consume(self, api_key, quota, media_type, limits):
+        """
+        Count one image or video against api_key. `quota` is the durable record used to
+        seed the shared counters the first time this host sees the key.
+        Returns False when the daily limit is reached.
+        """
+        used_field = "image_used" if media_type == "image" else "video_used"
+        limit = limits.get("image_limit" if media_type == "image" else "video_limit")
+
+        epoch = int(quota.get("epoch", 0))
+
+        def step(values):
+            now = int(time.time())
+            if values is None or values[3] < epoch:
+                values = [int(quota.get("image_used", 0)), int(quota.get("video_used", 0)), int(quota.get("reset_ts") or 0), epoch]
+            counters = dict(zip(FIELDS, values))
+            if not counters["reset_ts"]:
+                counters["reset_ts"] = now + DAY_SECONDS
+            if now >= counters["reset_ts"]:
+                counters.update(image_used=0, video_used=0, reset_ts=now + DAY_SECONDS)
+            ok = counters[used_field] + 1 <= limit
+            if ok:
+                counters[used_field] += 1
+            return [counters[f] for f in FIELDS], ok
+
+        try:
+            ok = self._shared().update(api_key, step)
+        except TableFull:
+            app_logger.warning("Quota table full; counting %s against api_keys.json", api_key[:8])
+            return self.fallback(api_key, step)
+        self._mark(api_key)
+        return ok
+
+    def current(self, api_key):
+        """Live counters for api_key, or None if this host has not counted it yet."""
+        try:
+            return self._shared().get(api_key)
+        except TableFull:
+            return None
@@ -0,0 +1,278 @@
+import json, os, threading, uuid
+from filelock import FileLock
+from .logger import app_logger
+
+
+def op_put(ns, key, record):
+    return {"op": "put", "ns": ns, "k": key, "v": record}
+
+def op_patch(ns, key, fields):
+    return {"op": "patch", "ns": ns, "k": key, "v": fields}
+
+def op_incr(ns, key, deltas):
+    return {"op": "incr", "ns": ns, "k": key, "v": deltas}
+
+def op_del(ns, key):
+    return {"op": "del", "ns": ns, "k": key}
+
+
+class RecordStore:
+    """
+    Append-only JSON-lines store of namespaced records with an in-memory index.
+
+    Each change is one line ({"op": put|patch|incr|del, "ns", "k", "v"}), and
+    commit() writes several changes as a single batch line, so a batch is applied
+    all-or-nothing. Writers append under a FileLock. Every call first replays
+    whatever other processes appended since the last call (one open that reads the
+    header line, plus a tail read when the file grew), so all workers converge on
+    the same state without re-parsing the whole file. compact() rewrites the log as one put per live record
+    behind a {"op": "gen"} header line with a fresh id; a reader that sees a different
+    id reloads (inode numbers alone are not enough: they are reused after unlink).
+
+    Records returned by get()/values() are shared with the index: treat them as
+    read-only and change them through patch()/put().
+    """
+
+    def __init__(self, path, bootstrap=None, compact_min=10000, compact_ratio=4):
+        self.path = str(path)
+        self._bootstrap = bootstrap
+        self.compact_min = compact_min
+        self.compact_ratio = compact_ratio
+        self._lock = threading.RLock()
+        self._file_lock_pid = None
+        self._data = {}
+        self._listeners = []
+        self._ino = None
+        self._gen = None
+        self._offset = 0
+        self._lines = 0
+
+    @property
+    def _file_lock(self):
+        # FileLock instances must not be shared across fork (gunicorn --preload)
+        if self._file_lock_pid != os.getpid():
+            self._file_lock_obj = FileLock(self.path + ".lock")
+            self._file_lock_pid = os.getpid()
+        return self._file_lock_obj
+
+    # ---------------------------------------------------------------- listeners
+    def add_listener(self, apply, reset=None):
+        """
+        apply(ns, key, old, new) is called for every change, including replays from
+        other workers; reset() is called before a full reload. Existing records are
+        replayed into a listener added after the first load.
+        """
+        with self._lock:
+            self._listeners.append((apply, reset))
+            for ns, table in self._data.items():
+                for key, record in table.items():
+                    apply(ns, key, None, record)
+
+    # ---------------------------------------------------------------- replay
+    def _apply(self, entry):
+        if entry.get("op") == "batch":
+            for e in entry.get("ops", []):
+                self._apply(e)
+            return
+        ns, key, op = entry.get("ns"), entry.get("k"), entry.get("op")
+        if op == "gen":
+            return
+        table = self._data.setdefault(ns, {})
+        old = table.get(key)
+        if op == "put":
+            new = entry.get("v")
+        elif op == "patch":
+            if old is None:
+                return
+            new = {**old, **entry.get("v", {})}
+        elif op == "incr":
+            new = dict(old or {})
+            for field, delta in entry.get("v", {}).items():
+                new[field] = new.get(field, 0) + delta
+        elif op == "del":
+            if old is None:
+                return
+            new = None
+        else:
+            app_logger.error("Unknown op %r in %s", op, self.path)
+            return
+        if new is None:
+            table.pop(key, None)
+        else:
+            table[key] = new
+        for apply, _ in self._listeners:
+            apply(ns, key, old, new)
+
+    def _read_tail(self, f):
+        f.seek(self._offset)
+        chunk = f.read()
+        end = chunk.rfind(b"\n")
+        if end < 0:
+            return
+        for line in chunk[:end].split(b"\n"):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                app_logger.error("Skipping corrupt line in %s", self.path)
+                continue
+            self._lines += 1
+            self._apply(entry)
+        self._offset += end + 1
+
+    def _reload(self, f, ino, gen):
+        self._data = {}
+        self._offset = 0
+        self._lines = 0
+        self._ino = ino
+        self._gen = gen
+        for _, reset in self._listeners:
+            if reset:
+                reset()
+        self._read_tail(f)
+
+    @staticmethod
+    def _read_gen(f):
+        """Generation id from the file's header line, or None for logs written before headers."""
+        f.seek(0)
+        line = f.readline(128)
+        if line.startswith(b'{"op":"gen"'):
+            try:
+                return json.loads(line).get("id")
+            except ValueError:
+                pass
+        return None
+
+    def _create(self):
+        with self._file_lock:
+            if os.path.exists(self.path):
+                return
+            ops = self._bootstrap() if self._bootstrap else []
+            self._write_snapshot(ops)
+            app_logger.info("Created %s with %d records", self.path, len(ops))
+
+    def _write_snapshot(self, ops):
+        gen = uuid.uuid4().hex
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            for op in [{"op": "gen", "id": gen}] + ops:
+                f.write(json.dumps(op, separators=(",", ":")).encode("utf-8") + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        return gen
+
+    def _sync(self):
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            self._create()
+            f = open(self.path, "rb")
+        with f:
+            st = os.fstat(f.fileno())
+            gen = self._read_gen(f)
+            replaced = gen != self._gen or (gen is None and st.st_ino != self._ino)
+            if replaced or st.st_size < self._offset:
+                self._reload(f, st.st_ino, gen)
+            elif st.st_size > self._offset:
+                self._read_tail(f)
+
+    # ---------------------------------------------------------------- reads
+    def get(self, ns, key):
+        with self._lock:
+            self._sync()
+            return self._data.get(ns, {}).get(key)
+
+    def values(self, ns):
+        with self._lock:
+            self._sync()
+            return list(self._data.get(ns, {}).values())
+
+    def items(self, ns):
+        with self._lock:
+            self._sync()
+            return list(self._data.get(ns, {}).items())
+
+    def count(self, ns):
+        with self._lock:
+            self._sync()
+            return len(self._data.get(ns, {}))
+
+    def read(self, fn):
+        """Run fn() on synced state under the store lock (for listener-maintained indexes)."""
+        with self._lock:
+            self._sync()
+            return fn()
+
+    def peek(self, ns, key):
+        """get() without replaying other workers' changes; for use inside read()."""
+        return self._data.get(ns, {}).get(key)
+
+    def sync(self):
+        """Replay changes from other workers so listener-maintained indexes are current."""
+        with self._lock:
+            self._sync()
+
+    # ---------------------------------------------------------------- writes
+    def commit(self, ops):
+        """Append ops as one atomic line and apply them locally."""
+        if not ops:
+            return
+        entry = ops[0] if len(ops) == 1 else {"op": "batch", "ops": ops}
+        data = json.dumps(entry, separators=(",", ":")).encode("utf-8") + b"\n"
+        with self._lock, self._file_lock:
+            self._sync()
+            with open(self.path, "ab") as f:
+                if f.tell() > self._offset:
+                    # a writer died mid-line; terminate it so ours parses
+                    f.write(b"\n")
+                f.write(data)
+                f.flush()
+                self._offset = f.tell()
+            self._lines += 1
+            self._apply(entry)
+            live = sum(len(t) for t in self._data.values())
+            if self._lines > self.compact_min and self._lines > self.compact_ratio * max(live, 1):
+                self.compact()
+
+    def atomic(self, fn):
+        """
+        Run fn() under the write lock on fully synced state. fn returns (ops, result);
+        the ops are committed before the lock is released. Use for check-then-write.
+        """
+        with self._lock, self._file_lock:
+            self._sync()
+            ops, result = fn()
+            self.commit(ops)
+            return result
+
+    def put(self, ns, key, record):
+        self.commit([op_put(ns, key, record)])
+        return record
+
+    def patch(self, ns, key, fields):
+        """Merge fields into an existing record; returns the new record or None if missing."""
+        def step():
+            if self._data.get(ns, {}).get(key) is None:
+                return [], None
+            return [op_patch(ns, key, fields)], True
+        if self.atomic(step) is None:
+            return None
+        return self._data.get(ns, {}).get(key)
+
+    def incr(self, ns, key, deltas):
+        self.commit([op_incr(ns, key, deltas)])
+
+    def delete(self, ns, key):
+        self.commit([op_del(ns, key)])
+
+    def compact(self):
+        """Rewrite the log as one put per live record; other workers reload on the new generation id."""
+        with self._lock, self._file_lock:
+            self._sync()
+            ops = [op_put(ns, key, record) for ns, table in self._data.items() for key, record in table.items()]
+            self._gen = self._write_snapshot(ops)
+            st = os.stat(self.path)
+            self._ino, self._offset, self._lines = st.st_ino, st.st_size, len(ops)
+            app_logger.info("Compacted %s to %d records", self.path, len(ops))
@@ -0,0 +1,324 @@
+import fcntl, json, os, resource, signal, subprocess, sys, threading, time, uuid
+from .config import (
+    RETRAIN_JOBS_FILE, RETRAIN_LOCK_FILE, RETRAIN_LOG_DIR, RETRAIN_MEMORY_LIMIT_MB, RETRAIN_CPUS,
+    RETRAIN_NICE, RETRAIN_TIMEOUT, RETRAIN_POLL_INTERVAL, RETRAIN_JOBS_KEEP,
+)
+from .logger import app_logger
+from .record_store import RecordStore, op_put, op_patch, op_del
+from .utils import now_iso
+
+# Retraining runs as a queue of jobs executed one at a time in a separate, resource-limited
+# process. Every web worker runs a dispatcher thread; the one holding RETRAIN_LOCK_FILE
+# (single flight) claims the oldest queued job, runs its prepare step (e.g. adding feedback
+# to the training set), starts train_model.py with its output going to a log file, and copies
+# "@progress" lines from that log into the job record, where the admin UI polls or streams it.
+JOBS = "job"
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+TRAINER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train_model.py")
+PROGRESS_PREFIX = "@progress "
+
+store = RecordStore(RETRAIN_JOBS_FILE)
+_hooks = {}
+_prepares = {}
+_wake = threading.Event()
+_stop = threading.Event()
+_runner = {"thread": None, "pid": None, "proc": None}
+
+def register_hook(name, fn):
+    """fn(job) runs in whichever worker ran the job, after the trainer exits successfully."""
+    _hooks[name] = fn
+
+def register_prepare(name, fn):
+    """
+    fn(job) runs in the runner before the trainer starts, so request handlers only queue;
+    its return value is stored as the job's "prepared" and an exception fails the job.
+    """
+    _prepares[name] = fn
+
+# ---------------------------------------------------------------- queue
+def enqueue(kind, args, requested_by=None, hook=None, ids=None, prepare=None):
+    """
+    Queue a trainer run and return the job. A job of the same kind that is still queued
+    absorbs the request (its ids are merged) rather than running the same training twice.
+    """
+    ids = list(ids or [])
+    def step():
+        for job in store.values(JOBS):
+            if job["status"] == QUEUED and job["kind"] == kind:
+                merged = list(dict.fromkeys(job.get("ids", []) + ids))
+                return [op_patch(JOBS, job["id"], {"ids": merged, "args": list(args)})], {**job, "ids": merged}
+        job = {
+            "id": uuid.uuid4().hex[:12],
+            "kind": kind,
+            "args": list(args),
+            "hook": hook,
+            "prepare": prepare,
+            "prepared": None,
+            "ids": ids,
+            "requested_by": requested_by,
+            "status": QUEUED,
+            "created": now_iso(),
+            "started": None,
+            "finished": None,
+            "exitcode": None,
+            "error": None,
+            "progress": {},
+            "cancel_requested": False,
+        }
+        return [op_put(JOBS, job["id"], job)], job
+    job = store.atomic(step)
+    app_logger.info("Retrain job %s queued (%s) by %s", job["id"], kind, requested_by)
+    _wake.set()
+    return job
+
+def cancel(job_id):
+    """Drop a queued job, or ask the runner to stop a running one. Returns the job or None."""
+    def step():
+        job = store.peek(JOBS, job_id)
+        if job is None or job["status"] in FINISHED:
+            return [], job
+        if job["status"] == QUEUED:
+            fields = {"status": CANCELLED, "finished": now_iso()}
+        else:
+            fields = {"cancel_requested": True}
+        return [op_patch(JOBS, job_id, fields)], {**job, **fields}
+    return store.atomic(step)
+
+def get_job(job_id):
+    return store.get(JOBS, job_id)
+
+def list_jobs(limit=20):
+    jobs = sorted(store.values(JOBS), key=lambda j: j["created"], reverse=True)
+    return jobs[:limit]
+
+def active_job():
+    for job in store.values(JOBS):
+        if job["status"] == RUNNING:
+            return job
+    return None
+
+def read_log(job_id, offset=0, limit=65536):
+    """Return (text, next_offset) from the job's log, starting at a byte offset."""
+    try:
+        with open(RETRAIN_LOG_DIR / f"{job_id}.log", "rb") as f:
+            f.seek(max(0, offset))
+            chunk = f.read(limit)
+    except FileNotFoundError:
+        return "", offset
+    return chunk.decode("utf-8", errors="replace"), offset + len(chunk)
+
+def stats():
+    counts = {}
+    for job in store.values(JOBS):
+        counts[job["status"]] = counts.get(job["status"], 0) + 1
+    active = active_job()
+    return {"jobs": counts, "active": active["id"] if active else None,
+            "runner_pid": _runner["pid"] if _runner["thread"] else None}
+
+# ---------------------------------------------------------------- runner
+def _limit(pid):
+    # Applied from the parent right after spawn: a preexec_fn is not safe in a process
+    # with threads. The trainer is still starting the interpreter at this point, before
+    # it allocates much or starts threads, and children and threads inherit the limits.
+    try:
+        os.setpriority(os.PRIO_PROCESS, pid, os.getpriority(os.PRIO_PROCESS, 0) + RETRAIN_NICE)
+        if RETRAIN_MEMORY_LIMIT_MB > 0 and hasattr(resource, "prlimit"):
+            limit = RETRAIN_MEMORY_LIMIT_MB << 20
+            resource.prlimit(pid, resource.RLIMIT_DATA, (limit, limit))
+        if RETRAIN_CPUS > 0 and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(pid, sorted(os.sched_getaffinity(0))[:RETRAIN_CPUS])
+    except OSError as e:
+        app_logger.warning("Could not limit trainer %s: %s", pid, e)
+
+def _trainer_env():
+    threads = str(RETRAIN_CPUS) if RETRAIN_CPUS > 0 else str(os.cpu_count() or 1)
+    return {**os.environ, "PYTHONUNBUFFERED": "1", "OMP_NUM_THREADS": threads,
+            "TF_NUM_INTRAOP_THREADS": threads, "TF_NUM_INTEROP_THREADS": "2", "TF_CPP_MIN_LOG_LEVEL": "2"}
+
+def _is_trainer(pid):
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return b"train_model.py" in f.read()
+    except OSError:
+        return False
+
+def _recover_orphans():
+    """We hold the lock, so a job still marked running lost its runner; stop its trainer and fail it."""
+    for job in store.values(JOBS):
+        if job["status"] != RUNNING:
+            continue
+        pid = job.get("trainer_pid")
+        if pid and _is_trainer(pid):
+            try:
+                os.killpg(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        store.patch(JOBS, job["id"], {"status": FAILED, "finished": now_iso(),
+                                      "error": "runner exited while the job was running"})
+        app_logger.warning("Retrain job %s was orphaned by a dead runner; marked failed", job["id"])
+
+def _claim_next():
+    def step():
+        queued = [j for j in store.values(JOBS) if j["status"] == QUEUED]
+        if not queued:
+            return [], None
+        job = min(queued, key=lambda j: j["created"])
+        fields = {"status": RUNNING, "started": now_iso(), "runner_pid": os.getpid()}
+        return [op_patch(JOBS, job["id"], fields)], {**job, **fields}
+    return store.atomic(step)
+
+def _scan_progress(text, progress):
+    for line in text.splitlines():
+        if line.startswith(PROGRESS_PREFIX):
+            try:
+                progress = {**progress, **json.loads(line[len(PROGRESS_PREFIX):])}
+            except ValueError:
+                pass
+    return progress
+
+def _prepare(job):
+    """Run the job's prepare step; returns an error string, or None to go on to the trainer."""
+    name = job.get("prepare")
+    if not name:
+        return None
+    if name not in _prepares:
+        return f"unknown prepare step {name!r}"
+    try:
+        prepared = _prepares[name](job)
+    except Exception as e:
+        app_logger.exception("Retrain job %s prepare step failed: %s", job["id"], e)
+        return f"prepare step failed: {e}"
+    store.patch(JOBS, job["id"], {"prepared": prepared})
+    return None
+
+def _run(job):
+    RETRAIN_LOG_DIR.mkdir(parents=True, exist_ok=True)
+    log_path = RETRAIN_LOG_DIR / f"{job['id']}.log"
+    error = _prepare(job)
+    if error is None and (store.get(JOBS, job["id"]) or {}).get("cancel_requested"):
+        error = "cancelled"
+    if error is not None:
+        status = CANCELLED if error == "cancelled" else FAILED
+        store.patch(JOBS, job["id"], {"status": status, "finished": now_iso(), "error": error})
+        app_logger.info("Retrain job %s %s before training: %s", job["id"], status, error)
+        _prune()
+        return
+    cmd = [sys.executable, TRAINER] + job["args"]
+    app_logger.info("Retrain job %s starting: %s", job["id"], " ".join(cmd))
+    with open(log_path, "ab") as log:
+        proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                                cwd=os.path.dirname(TRAINER), env=_trainer_env(),
+                                start_new_session=True)
+    _limit(proc.pid)
+    _runner["proc"] = proc
+    store.patch(JOBS, job["id"], {"trainer_pid": proc.pid})
+
+    offset, partial, progress, error = 0, "", {}, None
+    deadline = time.monotonic() + RETRAIN_TIMEOUT if RETRAIN_TIMEOUT > 0 else None
+    while True:
+        exitcode = proc.poll()
+        text, offset = read_log(job["id"], offset)
+        complete, _, partial = (partial + text).rpartition("\n")
+        scanned = _scan_progress(complete, progress)
+        if scanned != progress:
+            progress = scanned
+            store.patch(JOBS, job["id"], {"progress": progress})
+        if exitcode is not None:
+            if text:
+                continue  # drain the rest of the log first
+            break
+        current = store.get(JOBS, job["id"]) or {}
+        if current.get("cancel_requested") or _stop.is_set():
+            error = "cancelled" if current.get("cancel_requested") else "server shutting down"
+        elif deadline and time.monotonic() > deadline:
+            error = f"timed out after {RETRAIN_TIMEOUT}s"
+        if error:
+            _terminate(proc)
+            break
+        time.sleep(1)
+    _runner["proc"] = None
+
+    if error is None and proc.returncode == 0:
+        status = SUCCEEDED
+    elif error == "cancelled":
+        status = CANCELLED
+    else:
+        status = FAILED
+        if error is None:
+            error = f"trainer exited with code {proc.returncode}" + (" (killed: memory limit?)" if proc.returncode < 0 else "")
+    fields = {"status": status, "finished": now_iso(), "exitcode": proc.returncode, "error": error,
+              "progress": _scan_progress(partial, progress)}
+    if status == SUCCEEDED and job.get("hook") in _hooks:
+        try:
+            _hooks[job["hook"]]({**job, **fields})
+        except Exception as e:
+            app_logger.exception("Retrain job %s post-processing failed: %s", job["id"], e)
+            fields["error"] = f"post-processing failed: {e}"
+    store.patch(JOBS, job["id"], fields)
+    app_logger.info("Retrain job %s %s (exit code %s)", job["id"], status, proc.returncode)
+    _prune()
+
+def _terminate(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+    except OSError:
+        pass
+
+def _prune():
+    """Keep the last RETRAIN_JOBS_KEEP finished jobs and their logs."""
+    finished = sorted((j for j in store.values(JOBS) if j["status"] in FINISHED),
+                      key=lambda j: j["created"], reverse=True)
+    old = finished[RETRAIN_JOBS_KEEP:]
+    if not old:
+        return
+    store.commit([op_del(JOBS, j["id"]) for j in old])
+    for j in old:
+        try:
+            os.remove(RETRAIN_LOG_DIR / f"{j['id']}.log")
+        except OSError:
+            pass
+
+def _dispatch():
+    with open(RETRAIN_LOCK_FILE, "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return  # another worker is the runner
+        _recover_orphans()
+        while not _stop.is_set():
+            job = _claim_next()
+            if job is None:
+                return
+            _run(job)
+
+def _loop():
+    while not _stop.is_set():
+        try:
+            _dispatch()
+        except Exception as e:
+            app_logger.exception("Retrain dispatcher error: %s", e)
+        _wake.wait(RETRAIN_POLL_INTERVAL)
+        _wake.clear()
+
+def start_runner():
+    """Start this process's dispatcher thread (once per pid, so it survives a pre-fork)."""
+    if _runner["thread"] is not None and _runner["pid"] == os.getpid():
+        return
+    _stop.clear()
+    _runner["pid"] = os.getpid()
+    _runner["thread"] = threading.Thread(target=_loop, name="retrain-runner", daemon=True)
+    _runner["thread"].start()
+
+def stop_runner():
+    """Stop dispatching; a job running in this worker is terminated and marked failed."""
+    _stop.set()
+    _wake.set()
+    thread = _runner["thread"]
+    if thread is not None and _runner["pid"] == os.getpid():
+        thread.join(timeout=45)
+    _runner["thread"] = None
@@ -9,11 +9,10 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.triggers.cron import CronTrigger
 
-from .utils import cleanup_uploads, read_json, write_json, now_iso
+from .utils import cleanup_uploads, read_json, now_iso
 from .config import (
     UPLOAD_RETENTION_DAYS,
     API_USAGE_FILE,
-    RETRAINING_FILE,
     SECONDARY_ROTATION_DAYS,
     REPORTS_DIR,
     ADMIN_EMAIL,
@@ -24,7 +23,8 @@ from .config import (
     settings,
 )
 from .logger import app_logger
-from .feedback_system import trigger_retraining_if_ready
+from .feedback_system import trigger_retraining_if_ready, retraining_batches
+from .retrain_jobs import register_hook
 
 STOP = False
 scheduler = BackgroundScheduler()
@@ -59,8 +59,7 @@ def generate_weekly_summary():
         c.drawString(100, 700, f"Total API requests: {total_requests}")
 
         # Retraining info
-        retrain_data = read_json(RETRAINING_FILE, {})
-        feedback_count = len(retrain_data) if isinstance(retrain_data, dict) else 0
+        feedback_count = len(retraining_batches())
         c.drawString(100, 670, f"Feedback entries collected: {feedback_count}")
 
         # Add a separator line
@@ -152,53 +151,36 @@ def auto_retrain():
     Automatically retrain the model using auto-retrain flagged entries.
     """
     try:
-        from .feedback_system import get_recent_feedback
-        from .config import FEEDBACK_FILE
-        import subprocess
-
-        feedback_data = read_json(FEEDBACK_FILE, [])
-        auto_retrain_entries = [e for e in feedback_data if e.get("auto_retrain")]
+        from .feedback_system import feedback_in_state, AUTO_RETRAIN
+        from .dataset_builder import add_feedback, trainer_args
+        from . import retrain_jobs
+        auto_retrain_entries = feedback_in_state(AUTO_RETRAIN)
 
         if not auto_retrain_entries:
             app_logger.info("No auto-retrain entries found.")
             return
 
-        # Prepare retrain data
-        retrain_path = "data/auto_retrain_data.json"
-        write_json(retrain_path, auto_retrain_entries)
-        app_logger.info(f"Prepared {len(auto_retrain_entries)} entries for auto-retraining.")
-
-        # Run training script
-        trainer_script = os.path.join(os.path.dirname(__file__), "..", "train_model.py")
-        trainer_script = os.path.normpath(trainer_script)
-        if not os.path.exists(trainer_script):
-            trainer_script = os.path.join(os.getcwd(), "train_model.py")
-
-        if not os.path.exists(trainer_script):
-            app_logger.error("train_model.py not found; cannot start auto-retraining.")
-            return
+        # Add to the preprocessed training set; the trainer picks up whatever it has not seen
+        added = add_feedback(auto_retrain_entries)
+        app_logger.info(f"Prepared {len(auto_retrain_entries)} entries for auto-retraining ({added['added']} new images).")
 
-        cmd = ["python", trainer_script, "--data", retrain_path]
-        app_logger.info("Starting auto-retraining subprocess: %s", " ".join(cmd))
-        proc = subprocess.run(cmd, capture_output=True, text=True, check=False)
-        stdout = proc.stdout
-        stderr = proc.stderr
-        exitcode = proc.returncode
-        app_logger.info("Auto-retraining finished with exit code %s", exitcode)
-
-        if exitcode == 0:
-            app_logger.info("Auto-retraining successful.")
-            # Mark entries as retrained
-            for e in auto_retrain_entries:
-                e["auto_retrained"] = True
-            write_json(FEEDBACK_FILE, feedback_data)
-        else:
-            app_logger.error(f"Auto-retraining failed: {stderr}")
+        job = retrain_jobs.enqueue("auto_retrain", trainer_args(), requested_by="scheduler",
+                                   hook="auto_retrain", ids=[e["id"] for e in auto_retrain_entries])
+        app_logger.info("Auto-retraining queued as job %s", job["id"])
 
     except Exception as e:
         app_logger.exception(f"Auto-retraining failed: {e}")
 
 
+def _after_auto_retrain(job):
+    from .feedback_system import mark_feedback
+    from . import priority_queue
+    app_logger.info("Auto-retraining successful.")
+    # Mark entries as retrained
+    mark_feedback(job["ids"], auto_retrained=True)
+    priority_queue.ack(priority_queue.CONSUMER_RETRAIN, job["ids"])
+
+
 # =====================================================
 # 🔄 Weekly Retraining with Admin Approved Feedback
 # =====================================================
@@ -207,52 +189,41 @@ def weekly_retrain():
     Weekly retraining using all admin-approved feedback, then clear used data.
     """
     try:
-        from .config import FEEDBACK_FILE, RETRAINING_FILE
-        import subprocess
-
-        feedback_data = read_json(FEEDBACK_FILE, [])
-        approved_entries = [e for e in feedback_data if e.get("admin_approved")]
+        from .feedback_system import feedback_in_state, APPROVED
+        from .dataset_builder import add_feedback, trainer_args
+        from . import retrain_jobs
+        approved_entries = feedback_in_state(APPROVED)
 
         if not approved_entries:
             app_logger.info("No admin-approved feedback for weekly retraining.")
             return
 
-        # Prepare retrain data
-        retrain_path = "data/weekly_retrain_data.json"
-        write_json(retrain_path, approved_entries)
-        app_logger.info(f"Prepared {len(approved_entries)} approved entries for weekly retraining.")
+        # Add to the preprocessed training set; the trainer picks up whatever it has not seen
+        added = add_feedback(approved_entries)
+        app_logger.info(f"Prepared {len(approved_entries)} approved entries for weekly retraining ({added['added']} new images).")
 
-        # Run training script
-        trainer_script = os.path.join(os.path.dirname(__file__), "..", "train_model.py")
-        trainer_script = os.path.normpath(trainer_script)
-        if not os.path.exists(trainer_script):
-            trainer_script = os.path.join(os.getcwd(), "train_model.py")
-
-        if not os.path.exists(trainer_script):
-            app_logger.error("train_model.py not found; cannot start weekly retraining.")
-            return
-
-        cmd = ["python", trainer_script, "--data", retrain_path]
-        app_logger.info("Starting weekly retraining subprocess: %s", " ".join(cmd))
-        proc = subprocess.run(cmd, capture_output=True, text=True, check=False)
-        stdout = proc.stdout
-        stderr = proc.stderr
-        exitcode = proc.returncode
-        app_logger.info("Weekly retraining finished with exit code %s", exitcode)
-
-        if exitcode == 0:
-            app_logger.info("Weekly retraining successful.")
-            # Remove used feedback entries
-            remaining_feedback = [e for e in feedback_data if not e.get("admin_approved")]
-            write_json(FEEDBACK_FILE, remaining_feedback)
-            app_logger.info(f"Cleared {len(approved_entries)} approved feedback entries after retraining.")
-        else:
-            app_logger.error(f"Weekly retraining failed: {stderr}")
+        job = retrain_jobs.enqueue("weekly_retrain", trainer_args(), requested_by="scheduler",
+                                   hook="weekly_retrain", ids=[e["id"] for e in approved_entries])
+        app_logger.info("Weekly retraining queued as job %s", job["id"])
 
     except Exception as e:
         app_logger.exception(f"Weekly retraining failed: {e}")
 
 
+def _after_weekly_retrain(job):
+    from .feedback_system import remove_feedback
+    from . import priority_queue
+    app_logger.info("Weekly retraining successful.")
+    # Remove used feedback entries
+    remove_feedback(job["ids"])
+    priority_queue.ack(priority_queue.CONSUMER_RETRAIN, job["ids"])
+    app_logger.info(f"Cleared {len(job['ids'])} approved feedback entries after retraining.")
+
+
+register_hook("auto_retrain", _after_auto_retrain)
+register_hook("weekly_retrain", _after_weekly_retrain)
+
+
 # =====================================================
 # ⏰ APScheduler Jobs Setup
 # =====================================================
@@ -1,4 +1,5 @@
 import random, requests, os
+from .provider_scheduler import ProviderScheduler, PRIORITY_INTERACTIVE, PRIORITY_BULK
 
 # Example API keys for weekly rotation (loaded from environment variables)
 API_KEYS = {
@@ -9,6 +10,31 @@ API_KEYS = {
     "week5": "Fallback:local"
 }
 
+def _limits(prefix, rps, burst, monthly_cap=0):
+    """Per-provider rate limits; override with <PREFIX>_RPS, <PREFIX>_BURST and <PREFIX>_MONTHLY_CAP."""
+    return {
+        "rps": float(os.environ.get(f"{prefix}_RPS", rps)),
+        "burst": float(os.environ.get(f"{prefix}_BURST", burst)),
+        "monthly_cap": int(os.environ.get(f"{prefix}_MONTHLY_CAP", monthly_cap)),
+    }
+
+# Rate limits keyed like API_KEYS (rps=0 means unlimited)
+PROVIDER_LIMITS = {
+    "week1": _limits("DEEPAI", 1, 2),
+    "week2": _limits("PICPURIFY", 1, 2),
+    "week3": _limits("SIGHTENGINE", 1, 2),
+    "week4": _limits("HF", 2, 4),
+    "week5": _limits("FALLBACK", 0, 1),
+}
+
+# How long a request may wait for a provider token before degrading
+WAIT_SECONDS = {
+    PRIORITY_INTERACTIVE: float(os.environ.get("SECONDARY_INTERACTIVE_WAIT", 2.0)),
+    PRIORITY_BULK: float(os.environ.get("SECONDARY_BULK_WAIT", 10.0)),
+}
+
+scheduler = ProviderScheduler(PROVIDER_LIMITS, max_waiters=int(os.environ.get("SECONDARY_QUEUE_SIZE", 64)))
+
 def get_current_week():
     """Return week1..week5 based on rotation"""
     import datetime
@@ -19,13 +45,26 @@ def list_secondary_models():
     """List available secondary models"""
     return list(API_KEYS.keys())
 
-def predict_secondary_bytes(content_bytes):
+def _degraded(week, reason):
+    """Explicit 'no secondary opinion' result; callers must not treat it as a disagreement."""
+    return {"label": None, "confidence": 0.0, "model_used": week, "degraded": True, "reason": reason}
+
+def _retry_after(response, default=1.0):
+    try:
+        return float(response.headers.get("Retry-After", default))
+    except (TypeError, ValueError):
+        return default
+
+def predict_secondary_bytes(content_bytes, priority=PRIORITY_INTERACTIVE):
     week = get_current_week()
     key = API_KEYS[week]
+    api_key = key.split(":", 1)[1]
 
     # Example: DeepAI API call
-    if key.startswith("DeepAI:"):
-        api_key = key.split(":")[1]
+    if key.startswith("DeepAI:") and api_key:
+        ok, reason = scheduler.acquire(week, priority, WAIT_SECONDS.get(priority, WAIT_SECONDS[PRIORITY_BULK]))
+        if not ok:
+            return _degraded(week, reason)
         try:
             r = requests.post(
                 "https://api.deepai.org/api/nsfw-detector",
@@ -41,6 +80,9 @@ def predict_secondary_bytes(content_bytes):
                     return {"label": label, "confidence": confidence, "model_used": week}
                 except Exception:
                     pass
+            elif r.status_code == 429:
+                scheduler.report_throttled(week, _retry_after(r))
+                return _degraded(week, "provider_throttled")
             else:
                 # API error, fallback
                 pass
@@ -0,0 +1,224 @@
+import fcntl, os, queue, random, threading, time
+import numpy as np
+from .config import (
+    SHADOW_DIR, SHADOW_SAMPLE_RATE, SHADOW_QUEUE_SIZE, SHADOW_FLUSH_ROWS, SHADOW_MIN_SAMPLES,
+    SHADOW_AGREEMENT_TOLERANCE, SHADOW_MIN_AGREEMENT, SHADOW_MIN_SECONDARY, SHADOW_MAX_LATENCY_RATIO,
+    SHADOW_MAX_P95_MS, SHADOW_AUTO_PROMOTE,
+)
+from .logger import app_logger
+from .model_utils import model_registry, load_version, infer
+
+# A retrained version registered as the candidate (train_model.py --no_promote) sees a random
+# SHADOW_SAMPLE_RATE of live /api/predict images. The request only enqueues the bytes; a
+# worker thread runs the candidate and appends one row per input to a columnar log, one
+# fixed-width file per column under SHADOW_DIR/<version>/, so a report is a few np.fromfile
+# calls. Rows are appended in batches under a file lock so the columns stay aligned across
+# workers. evaluate() turns the log into agreement and latency figures and a gate verdict.
+LABEL_CODES = {"safe": 0, "moderate": 1, "high": 2}
+NO_LABEL = 255
+COLUMNS = {
+    "ts": np.float64,
+    "label": np.uint8,            # candidate
+    "confidence": np.float32,
+    "latency_ms": np.float32,
+    "current_label": np.uint8,
+    "current_ms": np.float32,     # the serving model's inference time on the same input
+    "secondary_label": np.uint8,  # NO_LABEL when the provider was degraded
+}
+
+_queue = queue.Queue(maxsize=SHADOW_QUEUE_SIZE)
+_stop = threading.Event()
+_runner = {"thread": None, "pid": None, "model": None, "dropped": 0, "processed": 0}
+
+def _code(label):
+    return LABEL_CODES.get(str(label).lower(), NO_LABEL) if label is not None else NO_LABEL
+
+def submit(content, primary, secondary):
+    """Called on the request path: maybe queue this input for the candidate. Never blocks."""
+    if SHADOW_SAMPLE_RATE <= 0 or random.random() >= SHADOW_SAMPLE_RATE or model_registry.candidate() is None:
+        return False
+    secondary_label = None if secondary.get("degraded") else secondary.get("label")
+    try:
+        _queue.put_nowait((time.time(), content, primary.get("label"), primary.get("inference_ms", 0.0), secondary_label))
+    except queue.Full:
+        _runner["dropped"] += 1
+        return False
+    return True
+
+# ---------------------------------------------------------------- log
+def _log_dir(version):
+    return SHADOW_DIR / version
+
+def _append(version, rows):
+    d = _log_dir(version)
+    d.mkdir(parents=True, exist_ok=True)
+    with open(d / ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        # A writer that died mid-append leaves some columns longer. Every column is cut
+        # back to the last complete row before any is written, so a crash during the
+        # writes below leaves at worst a partial last batch, which the next append cuts
+        paths = {name: d / f"{name}.col" for name in COLUMNS}
+        n = min((p.stat().st_size // np.dtype(COLUMNS[name]).itemsize if p.exists() else 0)
+                for name, p in paths.items())
+        for name, dtype in COLUMNS.items():
+            with open(paths[name], "ab") as f:
+                f.truncate(n * np.dtype(dtype).itemsize)
+        for name, dtype in COLUMNS.items():
+            with open(paths[name], "ab") as f:
+                f.write(np.array([r[name] for r in rows], dtype=dtype).tobytes())
+
+def read_log(version):
+    """{column: array} for a candidate's shadow log, truncated to complete rows."""
+    d = _log_dir(version)
+    cols = {}
+    for name, dtype in COLUMNS.items():
+        path = d / f"{name}.col"
+        cols[name] = np.fromfile(path, dtype=dtype) if path.exists() else np.zeros(0, dtype=dtype)
+    n = min(len(c) for c in cols.values())
+    return {name: c[:n] for name, c in cols.items()}
+
+def evaluate(version=None):
+    """Agreement and latency of a candidate against the serving model, with the gate verdict."""
+    version = version or model_registry.candidate()
+    if version is None:
+        return None
+    log = read_log(version)
+    n = len(log["ts"])
+    report = {"candidate": version, "current": model_registry.current(), "samples": n,
+              "min_samples": SHADOW_MIN_SAMPLES, "min_secondary": SHADOW_MIN_SECONDARY,
+              "min_agreement": SHADOW_MIN_AGREEMENT, "passed": False, "reasons": []}
+    if n == 0:
+        report["reasons"].append("no shadow samples yet")
+        return report
+
+    with_secondary = log["secondary_label"] != NO_LABEL
+    sec = log["secondary_label"][with_secondary]
+    report.update({
+        "agreement_current": round(float(np.mean(log["label"] == log["current_label"])), 4),
+        "agreement_secondary": round(float(np.mean(log["label"][with_secondary] == sec)), 4) if sec.size else None,
+        "current_agreement_secondary": round(float(np.mean(log["current_label"][with_secondary] == sec)), 4) if sec.size else None,
+        "latency_ms": {"p50": round(float(np.percentile(log["latency_ms"], 50)), 2),
+                       "p95": round(float(np.percentile(log["latency_ms"], 95)), 2)},
+        "current_latency_ms": {"p50": round(float(np.percentile(log["current_ms"], 50)), 2),
+                               "p95": round(float(np.percentile(log["current_ms"], 95)), 2)},
+        "first_sample": float(log["ts"][0]),
+        "last_sample": float(log["ts"][-1]),
+    })
+
+    reasons = report["reasons"]
+    if n < SHADOW_MIN_SAMPLES:
+        reasons.append(f"{n} of {SHADOW_MIN_SAMPLES} samples")
+    if report["agreement_current"] < SHADOW_MIN_AGREEMENT:
+        reasons.append(f"agrees with the current model on {report['agreement_current']:.1%}, "
+                       f"below the {SHADOW_MIN_AGREEMENT:.0%} floor")
+    # without enough secondary labels there is no reference for accuracy, only for change
+    if sec.size < SHADOW_MIN_SECONDARY:
+        reasons.append(f"{sec.size} of {SHADOW_MIN_SECONDARY} samples with a secondary label")
+    if sec.size and report["agreement_secondary"] < report["current_agreement_secondary"] - SHADOW_AGREEMENT_TOLERANCE:
+        reasons.append(f"agrees with the secondary provider on {report['agreement_secondary']:.1%}, "
+                       f"current model {report['current_agreement_secondary']:.1%}")
+    p95, current_p95 = report["latency_ms"]["p95"], report["current_latency_ms"]["p95"]
+    if current_p95 > 0 and p95 > current_p95 * SHADOW_MAX_LATENCY_RATIO:
+        reasons.append(f"p95 latency {p95} ms is over {SHADOW_MAX_LATENCY_RATIO}x the current {current_p95} ms")
+    if SHADOW_MAX_P95_MS > 0 and p95 > SHADOW_MAX_P95_MS:
+        reasons.append(f"p95 latency {p95} ms is over the {SHADOW_MAX_P95_MS} ms budget")
+    report["passed"] = not reasons
+    return report
+
+def promote_candidate(by=None, force=False):
+    """Promote the candidate if it passes the gate (or force). Returns (promoted, report)."""
+    report = evaluate()
+    if report is None:
+        raise KeyError("no candidate under shadow evaluation")
+    if not report["passed"] and not force:
+        return False, report
+    reason = "shadow evaluation passed" if report["passed"] else "forced past shadow gate: " + "; ".join(report["reasons"])
+    model_registry.promote(report["candidate"], by=by, reason=reason)
+    app_logger.info("Candidate %s promoted by %s (%s)", report["candidate"], by, reason)
+    return True, report
+
+def reject_candidate(by=None):
+    return model_registry.clear_candidate(by=by, reason="rejected after shadow evaluation")
+
+# ---------------------------------------------------------------- runner
+def _candidate_model():
+    """The loaded candidate, reloaded when the candidate link moves; None when there is none."""
+    version = model_registry.candidate()
+    loaded = _runner["model"]
+    if version is None:
+        _runner["model"] = None
+    elif loaded is None or loaded.version != version:
+        _runner["model"] = load_version(version)
+        app_logger.info("Shadow evaluating %s (loaded in %.0f ms)", version, _runner["model"].load_ms)
+    return _runner["model"]
+
+def _flush(rows):
+    if not rows:
+        return
+    version = rows[0]["version"]
+    try:
+        _append(version, rows)
+        if SHADOW_AUTO_PROMOTE and model_registry.candidate() == version:
+            promoted, report = promote_candidate(by="shadow_eval")
+            if not promoted and report["samples"] >= SHADOW_MIN_SAMPLES:
+                app_logger.info("Candidate %s held back: %s", version, "; ".join(report["reasons"]))
+    except KeyError:
+        pass  # another worker promoted or rejected it meanwhile
+    except Exception as e:
+        app_logger.exception("Shadow log flush for %s failed: %s", version, e)
+
+def _loop():
+    rows = []
+    while not _stop.is_set():
+        try:
+            ts, content, current_label, current_ms, secondary_label = _queue.get(timeout=1)
+        except queue.Empty:
+            _flush(rows)  # quiet period: make what we have visible to evaluate()
+            rows = []
+            continue
+        try:
+            candidate = _candidate_model()
+            if candidate is None:
+                continue
+            if rows and rows[0]["version"] != candidate.version:
+                _flush(rows)
+                rows = []
+            start = time.perf_counter()
+            result = infer(candidate.model, content)
+            elapsed = (time.perf_counter() - start) * 1000
+            rows.append({"version": candidate.version, "ts": ts, "label": _code(result.get("label")),
+                         "confidence": result.get("confidence", 0.0), "latency_ms": elapsed,
+                         "current_label": _code(current_label), "current_ms": current_ms,
+                         "secondary_label": _code(secondary_label)})
+            _runner["processed"] += 1
+            if len(rows) >= SHADOW_FLUSH_ROWS:
+                _flush(rows)
+                rows = []
+        except Exception as e:
+            app_logger.exception("Shadow evaluation error: %s", e)
+            rows = []
+    _flush(rows)
+
+def start_shadow_runner():
+    """Start this process's shadow thread (once per pid, so it survives a pre-fork)."""
+    if SHADOW_SAMPLE_RATE <= 0:
+        return
+    if _runner["thread"] is not None and _runner["pid"] == os.getpid():
+        return
+    _stop.clear()
+    _runner["pid"] = os.getpid()
+    _runner["thread"] = threading.Thread(target=_loop, name="shadow-eval", daemon=True)
+    _runner["thread"].start()
+
+def stop_shadow_runner():
+    _stop.set()
+    thread = _runner["thread"]
+    if thread is not None and _runner["pid"] == os.getpid():
+        thread.join(timeout=5)
+    _runner["thread"] = None
+
+def stats():
+    model = _runner["model"]
+    return {"sample_rate": SHADOW_SAMPLE_RATE, "candidate": model_registry.candidate(),
+            "loaded": model.version if model else None, "queued": _queue.qsize(),
+            "processed": _runner["processed"], "dropped": _runner["dropped"]}
@@ -0,0 +1,286 @@
+"""
+shard_dataset.py
+
+Preprocessed training set: images decoded once, resized to a fixed size and stored as
+uint8 rows in fixed-capacity .npy shards, deduplicated by SHA-256 of the original file.
+Written by the app (dataset_builder.py) and read by train_model.py, which runs as a
+script, so this module has no app imports.
+"""
+
+import fcntl
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+
+LABELS = {"safe": 0, "nsfw": 1}
+CHUNK = 32        # files per worker task
+INDEX_FLUSH = 1024  # index lines buffered before they are made durable
+MAX_ERRORS = 20   # unreadable files listed in the add() summary
+
+
+def entry_label(e):
+    """Training label ("nsfw"/"safe") for a feedback record, or None if it has none."""
+    # Prioritize secondary labels for auto-retrain entries
+    if e.get("auto_retrain") and e.get("correct_label"):
+        chosen = e.get("correct_label")
+    else:
+        # Use feedback_type if available, otherwise fallback to chosen or other fields
+        chosen = e.get("feedback_type") or e.get("chosen") or e.get("chosen_label") or e.get("label") or e.get("suggested")
+    if chosen is None:
+        return None
+    chosen = str(chosen).lower()
+    return "nsfw" if "nsfw" in chosen or "high" in chosen else "safe"
+
+
+def preprocess(data, img_size):
+    """Decode image bytes to an RGB uint8 array of img_size (height, width), as tf.image.resize takes it."""
+    with Image.open(io.BytesIO(data)) as img:
+        # JPEGs are decoded at the smallest DCT scale still >= the target size
+        img.draft("RGB", (img_size[1], img_size[0]))
+        img = img.convert("RGB").resize((img_size[1], img_size[0]), Image.BILINEAR)
+        return np.asarray(img, dtype=np.uint8)
+
+
+def load_image(path, img_size, known=()):
+    """(sha, pixels) for one file; pixels is None when sha is in known, which skips the decode."""
+    with open(path, "rb") as f:
+        data = f.read()
+    sha = hashlib.sha256(data).hexdigest()
+    if sha in known:
+        return sha, None
+    return sha, preprocess(data, img_size)
+
+
+def _describe(e):
+    if isinstance(e, UnidentifiedImageError):
+        return "not a readable image"
+    return f"{type(e).__name__}: {e}"
+
+
+# Pool workers decode straight into a shared-memory block of image slots, so only hashes
+# and error strings are pickled back to the parent.
+_worker = {}
+
+def _init_worker(shm_name, slots, img_size, known):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker.update(shm=shm, img_size=img_size, known=known,
+                   view=np.ndarray((slots, img_size[0], img_size[1], 3), dtype=np.uint8, buffer=shm.buf))
+
+def _decode_chunk(slot, paths):
+    out = []
+    for i, path in enumerate(paths):
+        try:
+            sha, pixels = load_image(path, _worker["img_size"], _worker["known"])
+        except Exception as e:
+            out.append((None, False, _describe(e)))
+            continue
+        if pixels is not None:
+            _worker["view"][slot + i] = pixels
+        out.append((sha, pixels is not None, None))
+    return out
+
+
+class ShardDataset:
+    """
+    One directory per image size holding:
+      shard-NNNNN.npy  (shard_size, H, W, 3) uint8, preallocated and filled row by row
+      index.jsonl      {"sha", "shard", "row", "label"} per line, written after the pixels
+      layout.json      {"shard_size"} the shards were created with
+
+    Adding an image that is already present only costs a hash; if its label changed an
+    index line with the new label is appended (the last line per sha wins). A crash
+    between the two writes leaves an unreferenced row that the next append reuses.
+
+    shard_size only applies to a new directory; an existing one keeps the size recorded
+    in layout.json, since every (shard, row) in the index depends on it.
+    """
+
+    def __init__(self, root, img_size=(224, 224), shard_size=1024):
+        self.img_size = tuple(img_size)
+        self.dir = Path(root) / f"{self.img_size[0]}x{self.img_size[1]}"
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.dir / "index.jsonl"
+        self.shard_size = self._layout(shard_size)
+        self.entries = {}
+        self._next = 0
+        self._maps = {}
+        self._writers = {}
+        self._load_index()
+
+    def _load_index(self):
+        self.entries = {}
+        self._next = 0
+        if not self.index_path.exists():
+            return
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    e = json.loads(line)
+                except ValueError:
+                    continue
+                self.entries[e["sha"]] = (e["shard"], e["row"], e["label"])
+                self._next = max(self._next, e["shard"] * self.shard_size + e["row"] + 1)
+
+    def _layout(self, shard_size):
+        """The directory's recorded shard size, recording `shard_size` if there is none yet."""
+        path = self.dir / "layout.json"
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return int(json.load(f)["shard_size"])
+        except FileNotFoundError:
+            pass
+        # directories written before layout.json: the first shard's row count is the size
+        first = self._shard_path(0)
+        if first.exists():
+            shard_size = int(np.load(first, mmap_mode="r").shape[0])
+        tmp = path.with_suffix(f".tmp{os.getpid()}")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"shard_size": shard_size}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return shard_size
+
+    def _shard_path(self, shard):
+        return self.dir / f"shard-{shard:05d}.npy"
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, sha):
+        return sha in self.entries
+
+    def samples(self):
+        """[(sha, label)] for every image in the dataset."""
+        return [(sha, label) for sha, (_, _, label) in self.entries.items()]
+
+    def image(self, sha):
+        """uint8 (H, W, 3) pixels for sha, read through a memory map."""
+        shard, row, _ = self.entries[sha]
+        if shard not in self._maps:
+            self._maps[shard] = np.load(self._shard_path(shard), mmap_mode="r")
+        return self._maps[shard][row]
+
+    def _decode(self, paths, workers):
+        """
+        Yield (i, sha, pixels, error) for each path, in order. pixels is None for images
+        already in the dataset; sha is None for unreadable files. With workers > 1 the
+        list is decoded by a process pool in double-buffered waves through shared memory.
+        """
+        known = frozenset(self.entries)
+        if workers <= 1 or len(paths) < 2 * CHUNK:
+            for i, path in enumerate(paths):
+                try:
+                    sha, pixels = load_image(path, self.img_size, known)
+                except Exception as e:
+                    yield i, None, None, _describe(e)
+                    continue
+                yield i, sha, pixels, None
+            return
+
+        half = workers * CHUNK
+        slots = 2 * half
+        shm = shared_memory.SharedMemory(create=True, size=slots * self.img_size[0] * self.img_size[1] * 3)
+        view = None
+        try:
+            view = np.ndarray((slots, self.img_size[0], self.img_size[1], 3), dtype=np.uint8, buffer=shm.buf)
+            ctx = multiprocessing.get_context("spawn")  # the app is threaded; never fork it
+            with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker,
+                                     initargs=(shm.name, slots, self.img_size, known)) as pool:
+
+                def submit(start, offset):
+                    wave = paths[start:start + half]
+                    return [(offset + j, start + j, pool.submit(_decode_chunk, offset + j, wave[j:j + CHUNK]))
+                            for j in range(0, len(wave), CHUNK)]
+
+                pending, start, offset = submit(0, 0), half, half
+                while pending:
+                    # workers fill one half while the caller drains the other
+                    following = submit(start, offset) if start < len(paths) else []
+                    for slot, first, future in pending:
+                        for j, (sha, decoded, error) in enumerate(future.result()):
+                            # copy out of the slot: the shared block is reused and unmapped after the last wave
+                            yield first + j, sha, view[slot + j].copy() if decoded else None, error
+                    pending, start, offset = following, start + half, half - offset
+        finally:
+            view = None
+            shm.close()
+            shm.unlink()
+
+    def add(self, items, workers=1):
+        """
+        Add (path, label) pairs; label is "nsfw"/"safe". Returns "shas" ({sha: label id}
+        for every readable item, new or already present), counts of what changed, and the
+        first MAX_ERRORS unreadable files as (path, error).
+        """
+        items = list(items)
+        shas, errors = {}, []
+        added = relabeled = failed = 0
+        with open(self.dir / ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._load_index()  # another process may have appended meanwhile
+            lines = []
+            for i, sha, pixels, error in self._decode([path for path, _ in items], workers):
+                if sha is None:
+                    failed += 1
+                    if len(errors) < MAX_ERRORS:
+                        errors.append((str(items[i][0]), error))
+                    continue
+                label = LABELS[items[i][1]]
+                shas[sha] = label
+                if sha in self.entries:
+                    shard, row, old = self.entries[sha]
+                    if old == label:
+                        continue
+                    relabeled += 1
+                else:
+                    shard, row = divmod(self._next, self.shard_size)
+                    self._write_row(shard, row, pixels)
+                    self._next += 1
+                    added += 1
+                self.entries[sha] = (shard, row, label)
+                lines.append(json.dumps({"sha": sha, "shard": shard, "row": row, "label": label}))
+                if len(lines) >= INDEX_FLUSH:
+                    self._commit(lines)
+                    lines = []
+            self._commit(lines)
+            self._writers = {}
+        return {"shas": shas, "added": added, "relabeled": relabeled, "failed": failed, "errors": errors}
+
+    def _commit(self, lines):
+        """Make written rows durable, then publish their index lines."""
+        for m in self._writers.values():
+            m.flush()
+        if lines:
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _write_row(self, shard, row, pixels):
+        if shard not in self._writers:
+            path = self._shard_path(shard)
+            if path.exists():
+                self._writers[shard] = np.load(path, mmap_mode="r+")
+            else:
+                shape = (self.shard_size, self.img_size[0], self.img_size[1], 3)
+                self._writers[shard] = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=shape)
+        self._writers[shard][row] = pixels
+
+    def stats(self):
+        labels = [label for _, _, label in self.entries.values()]
+        return {
+            "images": len(labels),
+            "nsfw": sum(labels),
+            "safe": len(labels) - sum(labels),
+            "shards": (self._next + self.shard_size - 1) // self.shard_size,
+            "bytes": sum(p.stat().st_size for p in self.dir.glob("shard-*.npy")),
+        }
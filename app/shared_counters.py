@@ -0,0 +1,205 @@
+import fcntl, hashlib, mmap, os, struct, threading
+from contextlib import contextmanager
+
+_MAGIC = b"SVHSLOT1"
+_HEADER = struct.Struct("<8sII")  # magic, slot count, field count
+_KEY_SIZE = 16
+_EMPTY = b"\0" * _KEY_SIZE
+_STRIPES = 64
+MAX_PROBE = 32  # slots examined per key before giving up
+
+
+class TableFull(RuntimeError):
+    pass
+
+
+class SharedSlotTable:
+    """
+    Fixed-size open-addressing hash table of numeric fields in an mmap'd file.
+
+    Every worker process on the host maps the same file, so counters are shared
+    without a server. Each slot is guarded by a POSIX byte-range lock (between
+    processes) and a striped thread lock (POSIX locks don't exclude threads of
+    the same process). A key lives within MAX_PROBE slots of its hash position.
+
+    Slots never become empty again, so a lookup can stop at the first empty slot.
+    With `expired(values)` given, a slot whose values it accepts is stale and may
+    be taken over by a new key. Inserts (into an empty or a stale slot) are
+    serialised by a lock on the header, so one key never gets two slots.
+    update_many() applies one function to several keys under all their slot locks.
+    """
+
+    def __init__(self, path, fields, fmt="q", slots=65536, expired=None, max_probe=MAX_PROBE):
+        self.path = str(path)
+        self.fields = tuple(fields)
+        self.expired = expired
+        self._values = struct.Struct("<" + fmt * len(self.fields))
+        self._slot_size = _KEY_SIZE + self._values.size
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(self._fd, _HEADER.size, 0)
+            if len(header) == _HEADER.size:
+                magic, n, nfields = _HEADER.unpack(header)
+                if magic != _MAGIC or nfields != len(self.fields):
+                    raise ValueError(f"{self.path} is not a slot table with fields {self.fields}")
+                slots = n
+            else:
+                os.ftruncate(self._fd, _HEADER.size + slots * self._slot_size)
+                os.pwrite(self._fd, _HEADER.pack(_MAGIC, slots, len(self.fields)), 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self.slots = slots
+        self.max_probe = min(max_probe, slots)
+        self._mm = mmap.mmap(self._fd, _HEADER.size + slots * self._slot_size)
+        self._stripes = [threading.Lock() for _ in range(_STRIPES)]
+        self._insert_thread_lock = threading.Lock()
+
+    @staticmethod
+    def _digest(key):
+        d = hashlib.blake2b(str(key).encode("utf-8"), digest_size=_KEY_SIZE).digest()
+        return d if d != _EMPTY else b"\1" + d[1:]
+
+    @contextmanager
+    def _locked(self, i):
+        off = _HEADER.size + i * self._slot_size
+        with self._stripes[i % _STRIPES]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self._slot_size, off)
+            try:
+                yield off
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self._slot_size, off)
+
+    @contextmanager
+    def _locked_many(self, slots):
+        # Stripes and slots in ascending order, so concurrent callers can't deadlock
+        order = sorted(set(slots))
+        stripes = [self._stripes[s] for s in sorted({i % _STRIPES for i in order})]
+        offsets = {i: _HEADER.size + i * self._slot_size for i in order}
+        for stripe in stripes:
+            stripe.acquire()
+        locked = []
+        try:
+            for i in order:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, self._slot_size, offsets[i])
+                locked.append(i)
+            yield [offsets[i] for i in slots]
+        finally:
+            for i in reversed(locked):
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self._slot_size, offsets[i])
+            for stripe in reversed(stripes):
+                stripe.release()
+
+    @contextmanager
+    def _insert_lock(self):
+        with self._insert_thread_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, _HEADER.size, 0)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, _HEADER.size, 0)
+
+    def _apply(self, off, digest, fn, insert):
+        # caller holds the slot lock
+        current = self._mm[off:off + _KEY_SIZE]
+        values = list(self._values.unpack_from(self._mm, off + _KEY_SIZE)) if current == digest else None
+        new_values, result = fn(values)
+        if new_values is not None:
+            if insert:
+                self._mm[off:off + _KEY_SIZE] = digest
+            self._values.pack_into(self._mm, off + _KEY_SIZE, *new_values)
+        return result
+
+    def _stale(self, off):
+        return self.expired is not None and self.expired(list(self._values.unpack_from(self._mm, off + _KEY_SIZE)))
+
+    def _probes(self, digest):
+        start = int.from_bytes(digest[:8], "little") % self.slots
+        return [(start + step) % self.slots for step in range(self.max_probe)]
+
+    def _find(self, digest):
+        # Unlocked read of the key bytes; the caller re-checks them under the slot lock
+        for i in self._probes(digest):
+            off = _HEADER.size + i * self._slot_size
+            current = self._mm[off:off + _KEY_SIZE]
+            if current == digest:
+                return i
+            if current == _EMPTY:
+                return None
+        return None
+
+    def update(self, key, fn):
+        """
+        Atomically apply fn to key's slot. fn receives the current values as a list
+        (None if the key has no slot yet) and returns (new_values, result); new_values
+        of None leaves the slot untouched. Returns result.
+        """
+        return self._update(self._digest(key), fn)
+
+    def update_many(self, keys, fn):
+        """
+        Atomically apply fn to several keys at once. fn receives a list with each key's
+        values (zeros for a key that had no slot) and returns (new_values_list, result);
+        None leaves every slot untouched. Existing keys cost one slot lock each.
+        """
+        digests = [self._digest(key) for key in keys]
+        zeros = [0] * len(self.fields)
+        while True:
+            slots = []
+            for digest in digests:
+                i = self._find(digest)
+                if i is None:
+                    self._update(digest, lambda v: (zeros if v is None else None, None))
+                    i = self._find(digest)
+                slots.append(i)
+            if None in slots:
+                continue  # claimed slot was taken over again before we found it
+            with self._locked_many(slots) as offsets:
+                if any(self._mm[off:off + _KEY_SIZE] != d for off, d in zip(offsets, digests)):
+                    continue  # a slot was reused between lookup and lock
+                values = [list(self._values.unpack_from(self._mm, off + _KEY_SIZE)) for off in offsets]
+                new_values, result = fn(values)
+                if new_values is not None:
+                    for off, v in zip(offsets, new_values):
+                        self._values.pack_into(self._mm, off + _KEY_SIZE, *v)
+                return result
+
+    def _update(self, digest, fn):
+        probes = self._probes(digest)
+        # Existing key: slot locks only
+        for i in probes:
+            with self._locked(i) as off:
+                current = self._mm[off:off + _KEY_SIZE]
+                if current == digest:
+                    return self._apply(off, digest, fn, insert=False)
+                if current == _EMPTY:
+                    break
+        # New key: look again under the insert lock, then take the first empty or stale slot
+        with self._insert_lock():
+            while True:
+                free = None
+                for i in probes:
+                    with self._locked(i) as off:
+                        current = self._mm[off:off + _KEY_SIZE]
+                        if current == digest:
+                            return self._apply(off, digest, fn, insert=False)
+                        if current == _EMPTY:
+                            free = i if free is None else free
+                            break
+                        if free is None and self._stale(off):
+                            free = i
+                if free is None:
+                    raise TableFull(self.path)
+                with self._locked(free) as off:
+                    # the stale key may have been updated since the scan
+                    if self._mm[off:off + _KEY_SIZE] == _EMPTY or self._stale(off):
+                        return self._apply(off, digest, fn, insert=True)
+
+    def get(self, key):
+        """Current values for key as a dict, or None if the key was never written."""
+        values = self.update(key, lambda v: (None, v))
+        return dict(zip(self.fields, values)) if values is not None else None
+
+    def close(self):
+        self._mm.close()
+        os.close(self._fd)
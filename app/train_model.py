@@ -3,12 +3,14 @@
 train_model.py
 
 Train (fine-tune) a TensorFlow Keras classifier using disputed feedback.
-Saves final model to models/final_model/model.h5
+Registers the model as a new version in the model registry (models/versions/<id>) and
+promotes it to models/final_model unless --no_promote is given.
 """
 
 import os
 import json
 import argparse
+import shutil
 from pathlib import Path
 import sys
 import time
@@ -17,7 +19,10 @@ import numpy as np
 # TensorFlow / Keras
 import tensorflow as tf
 from tensorflow.keras import layers, models, optimizers
-from tensorflow.keras.preprocessing.image import ImageDataGenerator, load_img, img_to_array
+
+from embedding_cache import EmbeddingCache, content_hash
+from model_registry import ModelRegistry
+from shard_dataset import ShardDataset, entry_label
 
 # =====================================================
 # 📂 CONFIG & PATHS
@@ -25,9 +30,16 @@ from tensorflow.keras.preprocessing.image import ImageDataGenerator, load_img, i
 PROJECT_ROOT = Path(__file__).resolve().parent
 RETRAIN_JSON_DEFAULT = PROJECT_ROOT / "data" / "retrain_data.json"
 UPLOADS_DIR = PROJECT_ROOT / "data" / "uploads"
-MODEL_DIR = PROJECT_ROOT / "models" / "final_model"
-MODEL_DIR.mkdir(parents=True, exist_ok=True)
-MODEL_PATH = MODEL_DIR / "model.h5"
+MODELS_ROOT = PROJECT_ROOT / "models"
+# Files of one model version (see model_registry.py)
+MODEL_FILE = "model.h5"
+META_FILE = "metadata.json"
+REPLAY_FILE = "replay.json"
+TRAINED_INDEX = "trained_hashes.txt"
+EMBEDDINGS_DIR = "embeddings"  # feature cache, under --models_dir unless --embeddings_dir is given
+# Bump when the backbone or its preprocessing changes so cached features are recomputed
+BACKBONE_VERSION = "mobilenetv2-imagenet-avg-v1"
+FEATURE_DIM = 1280
 
 # =====================================================
 # ⚙️ HYPERPARAMETERS
@@ -36,16 +48,34 @@ IMG_SIZE = (224, 224)
 BATCH_SIZE = 8
 EPOCHS = 3
 LEARNING_RATE = 1e-4
+SHUFFLE_BUFFER = 2048  # file paths held for shuffling; memory stays constant in dataset size
+IMAGE_EXTS = (".png", ".jpg", ".jpeg")
+REPLAY_CAPACITY = 5000  # past samples kept (reservoir) for rehearsal
+REPLAY_SAMPLES = 1000   # past samples mixed into each warm-start run
+LINEAGE_DEPTH = 20
+KEEP_VERSIONS = 5
+PROGRESS_PREFIX = "@progress "  # parsed by app/retrain_jobs.py
+PROGRESS_EVERY = 2.0  # seconds between in-epoch progress lines
 
 
 def parse_args():
     p = argparse.ArgumentParser(description="Train NSFW AI TensorFlow Model")
     p.add_argument("--data", type=str, default=str(RETRAIN_JSON_DEFAULT))
     p.add_argument("--dataset", type=str, help="Path to dataset directory with nsfw/ and safe/ subdirs")
+    p.add_argument("--shards", type=str, help="Preprocessed shard dataset root (see dataset_builder.py)")
     p.add_argument("--epochs", type=int, default=EPOCHS)
     p.add_argument("--batch", type=int, default=BATCH_SIZE)
     p.add_argument("--lr", type=float, default=LEARNING_RATE)
     p.add_argument("--img_size", type=int, nargs=2, default=list(IMG_SIZE))
+    p.add_argument("--shuffle_buffer", type=int, default=SHUFFLE_BUFFER)
+    p.add_argument("--augment", action="store_true", help="Augment images (trains end to end, bypasses the embedding cache)")
+    p.add_argument("--no_cache", action="store_true", help="Run the backbone on every image every epoch")
+    p.add_argument("--from_scratch", action="store_true", help="Ignore the current final_model and start from ImageNet weights")
+    p.add_argument("--replay", type=int, default=REPLAY_SAMPLES, help="Past samples to rehearse on a warm start")
+    p.add_argument("--models_dir", type=str, default=str(MODELS_ROOT), help="Model registry root")
+    p.add_argument("--embeddings_dir", type=str, help="Backbone feature cache (default: <models_dir>/embeddings)")
+    p.add_argument("--keep_versions", type=int, default=KEEP_VERSIONS, help="Model versions to retain (0 keeps all)")
+    p.add_argument("--no_promote", action="store_true", help="Register the new version as the shadow candidate instead of making it current")
     return p.parse_args()
 
 
@@ -68,23 +98,10 @@ def load_retrain_entries(path):
         if not file:
             continue
 
-        # Prioritize secondary labels for auto-retrain entries
-        chosen = None
-        if e.get("auto_retrain") and e.get("correct_label"):
-            chosen = e.get("correct_label")
-        else:
-            # Use feedback_type if available, otherwise fallback to chosen or other fields
-            chosen = e.get("feedback_type") or e.get("chosen") or e.get("chosen_label") or e.get("label") or e.get("suggested")
-
-        if chosen is None:
+        lbl = entry_label(e)
+        if lbl is None:
             continue
 
-        chosen = str(chosen).lower()
-        if "nsfw" in chosen or "high" in chosen:
-            lbl = "nsfw"
-        else:
-            lbl = "safe"
-
         normalized.append({"file": file, "label": lbl})
     return normalized
 
@@ -92,161 +109,479 @@ def load_retrain_entries(path):
 # =====================================================
 # 🧠 DATASET BUILDER
 # =====================================================
-def build_dataset(entries, img_size=(224, 224), batch_size=8, augment=False):
-    images, labels = [], []
+# Images are streamed: only (ref, label) pairs are kept in memory, and each batch is
+# loaded and normalised in parallel just before it is needed. A ref is a file path, or a
+# content hash when reading the preprocessed shards.
+def _augmenter():
+    return tf.keras.Sequential([
+        layers.RandomFlip("horizontal"),
+        layers.RandomTranslation(0.05, 0.05),
+        layers.RandomRotation(8 / 360),
+    ])
+
+
+def file_loader(img_size):
+    """ref -> normalised image, decoding and resizing the original file."""
+    def load(path):
+        img = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+        img = tf.image.resize(img, img_size)
+        return tf.cast(img, tf.float32) / 255.0
+    return load
+
+
+def shard_loader(shards):
+    """ref -> normalised image, read from the already resized uint8 shards."""
+    shape = [shards.img_size[0], shards.img_size[1], 3]
+
+    def load(sha):
+        img = tf.numpy_function(lambda s: np.asarray(shards.image(s.decode())), [sha], tf.uint8)
+        img.set_shape(shape)
+        return tf.cast(img, tf.float32) / 255.0
+    return load
+
+
+def stream_dataset(refs, labels, load, batch_size=8, augment=False, shuffle_buffer=SHUFFLE_BUFFER):
+    """tf.data pipeline: shuffle refs -> parallel load -> batch -> prefetch."""
+    autotune = tf.data.AUTOTUNE
+    ds = tf.data.Dataset.from_tensor_slices((list(refs), list(labels)))
+    ds = ds.shuffle(max(1, min(len(refs), shuffle_buffer)), reshuffle_each_iteration=True)
+    ds = ds.map(lambda ref, label: (load(ref), tf.one_hot(label, 2)), num_parallel_calls=autotune, deterministic=False)
+    ds = ds.ignore_errors(log_warning=True)  # skip corrupt or unsupported files
+    ds = ds.batch(batch_size)
+    if augment:
+        aug = _augmenter()
+        ds = ds.map(lambda x, y: (aug(x, training=True), y), num_parallel_calls=autotune)
+    return ds.prefetch(autotune)
+
+
+def entry_paths(entries):
+    paths, labels = [], []
     for e in entries:
         p = os.path.join(UPLOADS_DIR, e["file"])
         if not os.path.exists(p):
             continue
-        try:
-            img = load_img(p, target_size=img_size)
-            arr = img_to_array(img)
-            images.append(arr)
-            labels.append(1 if e["label"] == "nsfw" else 0)
-        except Exception as ex:
-            print("❌ Failed to load", p, ":", ex)
-
-    if not images:
+        paths.append(p)
+        labels.append(1 if e["label"] == "nsfw" else 0)
+    return paths, labels
+
+
+def dir_paths(dataset_path):
+    dataset_path = Path(dataset_path)
+    paths, labels = [], []
+    for label_dir in ["nsfw", "safe"]:
+        dir_path = dataset_path / label_dir
+        if not dir_path.exists():
+            continue
+        label = 1 if label_dir == "nsfw" else 0
+        for img_file in dir_path.glob("*"):
+            if not img_file.is_file() or img_file.suffix.lower() not in IMAGE_EXTS:
+                continue
+            paths.append(str(img_file))
+            labels.append(label)
+    return paths, labels
+
+
+def build_dataset(entries, img_size=(224, 224), batch_size=8, augment=False, shuffle_buffer=SHUFFLE_BUFFER):
+    paths, labels = entry_paths(entries)
+    if not paths:
         return None
+    return stream_dataset(paths, labels, file_loader(img_size), batch_size, augment, shuffle_buffer), len(paths)
 
-    X = np.array(images, dtype="float32") / 255.0
-    y = tf.keras.utils.to_categorical(labels, num_classes=2)
 
-    if augment:
-        datagen = ImageDataGenerator(
-            rotation_range=8,
-            width_shift_range=0.05,
-            height_shift_range=0.05,
-            horizontal_flip=True,
-        )
-        generator = datagen.flow(X, y, batch_size=batch_size)
-        return generator, len(X)
-    else:
-        dataset = tf.data.Dataset.from_tensor_slices((X, y)).shuffle(len(X)).batch(batch_size)
-        return dataset, len(X)
+def build_dataset_from_dir(dataset_path, img_size=(224, 224), batch_size=8, augment=False, shuffle_buffer=SHUFFLE_BUFFER):
+    paths, labels = dir_paths(dataset_path)
+    if not paths:
+        return None
+    return stream_dataset(paths, labels, file_loader(img_size), batch_size, augment, shuffle_buffer), len(paths)
+
+
+# =====================================================
+# 🗃️ EMBEDDING CACHE
+# =====================================================
+# The backbone is frozen, so its pooled output for an image never changes. Features are
+# computed once per (content hash, backbone version, img_size) and the head trains on them.
+def cache_features(backbone, cache, refs, hashes, load, batch_size=64):
+    """Make sure every readable image is cached; returns the hash per ref (None if unreadable)."""
+    first_ref = {}
+    for r, h in zip(refs, hashes):
+        first_ref.setdefault(h, r)
+    todo = cache.missing(hashes)
+    if todo:
+        print(f"🧮 Computing features for {len(todo)} new images ({len(cache)} cached)...")
+        progress(stage="features", images=len(todo))
+        start = time.perf_counter()
+        ds = tf.data.Dataset.from_tensor_slices(([first_ref[h] for h in todo], list(range(len(todo)))))
+        ds = ds.map(lambda ref, i: (load(ref), i), num_parallel_calls=tf.data.AUTOTUNE).ignore_errors().batch(batch_size).prefetch(tf.data.AUTOTUNE)
+        for imgs, idx in ds:
+            feats = backbone(imgs, training=False).numpy()
+            cache.append([todo[i] for i in idx.numpy()], feats)
+        elapsed = time.perf_counter() - start
+        print(f"⚡ Backbone: {len(todo) / elapsed if elapsed > 0 else 0:.1f} images/sec")
+    return [h if h in cache.rows else None for h in hashes]
+
+
+def feature_dataset(cache, hashes, labels, batch_size=8, shuffle_buffer=SHUFFLE_BUFFER):
+    """Batches of (cached features, one-hot label), gathered from the memory-mapped table."""
+    rows = np.array([cache.rows[h] for h in hashes], dtype=np.int64)
+    table = cache.table()
+    ds = tf.data.Dataset.from_tensor_slices((rows, np.array(labels, dtype=np.int32)))
+    ds = ds.shuffle(max(1, min(len(rows), shuffle_buffer)), reshuffle_each_iteration=True).batch(batch_size)
+
+    def gather(r, y):
+        x = tf.numpy_function(lambda r: np.asarray(table[r], dtype=np.float32), [r], tf.float32)
+        x.set_shape([None, cache.dim])
+        return x, tf.one_hot(y, 2)
+
+    return ds.map(gather, num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
+
+
+def progress(**fields):
+    print(PROGRESS_PREFIX + json.dumps(fields), flush=True)
+
+
+class Throughput(tf.keras.callbacks.Callback):
+    """
+    Prints images/sec per epoch and keeps the overall rate for the metadata. Also emits
+    machine-readable "@progress {json}" lines (every epoch, and every few seconds within
+    one) that the retrain job runner turns into live progress.
+    """
+
+    def __init__(self, batch_size, n_samples, progress_every=PROGRESS_EVERY):
+        super().__init__()
+        self.batch_size = batch_size
+        self.n_samples = n_samples
+        self.progress_every = progress_every
+        self.images = 0
+        self.seconds = 0.0
+
+    def _progress(self, **fields):
+        progress(**fields)
+
+    def on_train_begin(self, logs=None):
+        self._progress(stage="training", epoch=0, epochs=self.params.get("epochs"), samples=self.n_samples)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch = epoch
+        self._epoch_images = 0
+        self._epoch_start = self._last_report = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._epoch_images += self.batch_size
+        now = time.perf_counter()
+        if now - self._last_report >= self.progress_every:
+            self._last_report = now
+            elapsed = now - self._epoch_start
+            self._progress(epoch=self._epoch + 1, step=batch + 1, steps=self.params.get("steps"),
+                           loss=round(float((logs or {}).get("loss", 0)), 4),
+                           images_per_sec=round(min(self._epoch_images, self.n_samples) / elapsed, 1))
+
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = time.perf_counter() - self._epoch_start
+        self._epoch_images = min(self._epoch_images, self.n_samples)  # last batch may be partial
+        self.images += self._epoch_images
+        self.seconds += elapsed
+        rate = self._epoch_images / elapsed if elapsed > 0 else 0.0
+        logs = logs or {}
+        print(f"⚡ Epoch {epoch + 1}: {rate:.1f} images/sec (loss={logs.get('loss', 0):.4f})", flush=True)
+        self._progress(epoch=epoch + 1, step=None, loss=round(float(logs.get("loss", 0)), 4),
+                       accuracy=round(float(logs.get("accuracy", 0)), 4), images_per_sec=round(rate, 1))
+
+    @property
+    def images_per_sec(self):
+        return self.images / self.seconds if self.seconds > 0 else 0.0
 
 
 # =====================================================
 # 🏗️ MODEL CREATION (MobileNetV2-based)
 # =====================================================
-def create_model(input_shape=(224, 224, 3), lr=1e-4):
+def create_backbone(input_shape=(224, 224, 3)):
     base = tf.keras.applications.MobileNetV2(
         include_top=False, input_shape=input_shape, weights="imagenet", pooling="avg"
     )
     base.trainable = False  # Freeze the base layers
-    x = base.output
-    x = layers.Dense(128, activation="relu")(x)
+    return base
+
+
+def create_head(dim=FEATURE_DIM, lr=1e-4):
+    inp = layers.Input(shape=(dim,))
+    x = layers.Dense(128, activation="relu")(inp)
     x = layers.Dropout(0.3)(x)
     out = layers.Dense(2, activation="softmax")(x)
-    model = models.Model(inputs=base.input, outputs=out)
+    head = models.Model(inputs=inp, outputs=out, name="head")
+    head.compile(optimizer=optimizers.Adam(lr), loss="categorical_crossentropy", metrics=["accuracy"])
+    return head
+
+
+def assemble(backbone, head, lr=1e-4):
+    model = models.Model(inputs=backbone.input, outputs=head(backbone.output))
     model.compile(optimizer=optimizers.Adam(lr), loss="categorical_crossentropy", metrics=["accuracy"])
     return model
 
 
+def create_model(input_shape=(224, 224, 3), lr=1e-4):
+    backbone = create_backbone(input_shape)
+    return assemble(backbone, create_head(backbone.output_shape[-1], lr), lr)
+
+
 # =====================================================
-# 🚀 MAIN ENTRY POINT
+# 🔁 WARM START, REPLAY & LINEAGE
 # =====================================================
-def build_dataset_from_dir(dataset_path, img_size=(224, 224), batch_size=8, augment=False):
-    dataset_path = Path(dataset_path)
-    images, labels = [], []
-    for label_dir in ["nsfw", "safe"]:
-        dir_path = dataset_path / label_dir
-        if not dir_path.exists():
-            continue
-        label = 1 if label_dir == "nsfw" else 0
-        for img_file in dir_path.glob("*"):
-            if not img_file.is_file() or img_file.suffix.lower() not in ['.png', '.jpg', '.jpeg']:
-                continue
-            try:
-                img = load_img(str(img_file), target_size=img_size)
-                arr = img_to_array(img)
-                images.append(arr)
-                labels.append(label)
-            except Exception as ex:
-                print("❌ Failed to load", img_file, ":", ex)
-
-    if not images:
-        return None
+# A warm start copies the head of the current final_model and trains it on the samples it has
+# not seen yet (by content hash), plus a bounded rehearsal sample of older data so it does
+# not forget. Run time follows the size of the delta, not the size of the history.
+def read_json_file(path, default):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json_file(path, data):
+    tmp = Path(str(path) + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def trained_key(sample):
+    """A sample is new if the model has not seen this image with this label."""
+    h, _, label = sample
+    return f"{h} {label}"
+
+
+def load_trained(model_dir):
+    path = model_dir / TRAINED_INDEX
+    if not path.exists():
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        return {line.strip() for line in f if line.strip()}
 
-    X = np.array(images, dtype="float32") / 255.0
-    y = tf.keras.utils.to_categorical(labels, num_classes=2)
 
-    if augment:
-        datagen = ImageDataGenerator(
-            rotation_range=8,
-            width_shift_range=0.05,
-            height_shift_range=0.05,
-            horizontal_flip=True,
-        )
-        generator = datagen.flow(X, y, batch_size=batch_size)
-        return generator, len(X)
-    else:
-        dataset = tf.data.Dataset.from_tensor_slices((X, y)).shuffle(len(X)).batch(batch_size)
-        return dataset, len(X)
+def load_previous_head(head, img_size, model_dir):
+    """Copy the head weights of the model in model_dir into head; returns its metadata or None."""
+    if model_dir is None or not (model_dir / MODEL_FILE).exists():
+        return None
+    model_path = model_dir / MODEL_FILE
+    meta = read_json_file(model_dir / META_FILE, {})
+    if tuple(meta.get("img_size") or IMG_SIZE) != tuple(img_size):
+        print(f"⚠️ Current model was trained at {meta.get('img_size')}; starting from scratch.")
+        return None
+    if meta.get("backbone_version", BACKBONE_VERSION) != BACKBONE_VERSION:
+        print(f"⚠️ Current model uses backbone {meta['backbone_version']}; starting from scratch.")
+        return None
+    try:
+        prev = tf.keras.models.load_model(str(model_path), compile=False)
+        try:
+            src = prev.get_layer("head")
+        except ValueError:
+            src = prev  # models saved before the head was a named sub-model
+        theirs = [l for l in src.layers if isinstance(l, layers.Dense)]
+        ours = [l for l in head.layers if isinstance(l, layers.Dense)]
+        if len(theirs) < len(ours):
+            raise ValueError("head layers do not match")
+        for mine, old in zip(ours, theirs[-len(ours):]):
+            mine.set_weights(old.get_weights())
+    except Exception as e:
+        print(f"⚠️ Could not load {model_path} for a warm start ({e}); starting from scratch.")
+        return None
+    meta["sha256"] = content_hash(model_path)
+    return meta
+
+
+def update_replay(buffer, samples, capacity=REPLAY_CAPACITY, rng=None):
+    """Reservoir-sample (hash, path, label) samples into buffer so every sample seen has equal odds of staying."""
+    rng = rng or np.random.default_rng()
+    items = buffer.setdefault("items", [])
+    seen = buffer.get("seen", 0)
+    for h, path, label in samples:
+        seen += 1
+        item = {"hash": h, "path": path, "label": label}
+        if len(items) < capacity:
+            items.append(item)
+        else:
+            j = int(rng.integers(0, seen))
+            if j < capacity:
+                items[j] = item
+    buffer["seen"] = seen
+    return buffer
+
+
+def save_training_state(model_dir, parent_dir, samples, warm, buffer):
+    """Record what the new model has learned from: the parent's history plus samples."""
+    with open(model_dir / TRAINED_INDEX, "w", encoding="utf-8") as f:
+        if warm and (parent_dir / TRAINED_INDEX).exists():
+            with open(parent_dir / TRAINED_INDEX, "r", encoding="utf-8") as prev:
+                shutil.copyfileobj(prev, f)
+        for sample in samples:
+            f.write(trained_key(sample) + "\n")
+    write_json_file(model_dir / REPLAY_FILE, update_replay(buffer if warm else {}, samples))
+
+
+def lineage_entry(parent, warm, n_delta, n_replay, n_trained):
+    ancestors = []
+    if warm and parent:
+        prev = parent.get("lineage") or {}
+        ancestors = [{"sha256": parent["sha256"], "saved_at": parent.get("saved_at")}] + prev.get("ancestors", [])
+    return {
+        "warm_start": warm,
+        "parent_sha256": parent["sha256"] if warm and parent else None,
+        "generation": ((parent.get("lineage") or {}).get("generation", 0) + 1) if warm and parent else 0,
+        "delta_samples": n_delta,
+        "replay_samples": n_replay,
+        "total_trained": n_trained,
+        "ancestors": ancestors[:LINEAGE_DEPTH],
+    }
 
 
+# =====================================================
+# 🚀 MAIN ENTRY POINT
+# =====================================================
 def main():
     args = parse_args()
-
-    if args.dataset:
-        print("📘 Starting training using dataset directory:", args.dataset)
-        dataset_info = build_dataset_from_dir(args.dataset, img_size=tuple(args.img_size), batch_size=args.batch, augment=False)
-        if dataset_info is None:
-            print("❌ No valid images found in dataset directory. Exiting.")
-            sys.exit(1)
-        dataset, n_samples = dataset_info
-        print(f"📊 Prepared dataset with {n_samples} samples.")
-    else:
-        print("📘 Starting training using data:", args.data)
-        entries = load_retrain_entries(args.data)
-        print(f"✅ Found {len(entries)} labeled entries.")
-        if not entries:
+    img_size = tuple(args.img_size)
+
+    shards = None
+    if args.shards:
+        print("📘 Starting training using preprocessed shards:", args.shards)
+        shards = ShardDataset(args.shards, img_size)
+        samples = shards.samples()
+        print(f"✅ Found {len(samples)} images ({shards.stats()['shards']} shards).")
+        if not samples:
             print("⚠️ No data available for retraining. Exiting.")
             sys.exit(0)
-
-        dataset_info = build_dataset(entries, img_size=tuple(args.img_size), batch_size=args.batch, augment=False)
-        if dataset_info is None:
+        hashes = [h for h, _ in samples]
+        refs, labels = hashes, [l for _, l in samples]
+        load = shard_loader(shards)
+    else:
+        if args.dataset:
+            print("📘 Starting training using dataset directory:", args.dataset)
+            refs, labels = dir_paths(args.dataset)
+            if not refs:
+                print("❌ No valid images found in dataset directory. Exiting.")
+                sys.exit(1)
+        else:
+            print("📘 Starting training using data:", args.data)
+            entries = load_retrain_entries(args.data)
+            print(f"✅ Found {len(entries)} labeled entries.")
+            if not entries:
+                print("⚠️ No data available for retraining. Exiting.")
+                sys.exit(0)
+            refs, labels = entry_paths(entries)
+            if not refs:
+                print("❌ No valid images found. Exiting.")
+                sys.exit(1)
+        hashes = [content_hash(p) for p in refs]
+        load = file_loader(img_size)
+
+    registry = ModelRegistry(args.models_dir)
+    registry.migrate()
+    current = registry.current()
+    current_dir = registry.path(current) if current else None
+
+    use_cache = not args.no_cache and not args.augment
+    backbone = create_backbone((img_size[0], img_size[1], 3))
+    head = create_head(backbone.output_shape[-1], args.lr)
+
+    parent = None if args.from_scratch else load_previous_head(head, img_size, current_dir)
+    warm = parent is not None
+    delta = list({h: (h, r, l) for h, r, l in zip(hashes, refs, labels)}.values())
+    replay = []
+    if warm:
+        trained = load_trained(current_dir)
+        delta = [s for s in delta if trained_key(s) not in trained]
+        if not delta:
+            print("✅ Current model has already trained on every sample given. Nothing to do.")
+            sys.exit(0)
+        buffer = read_json_file(current_dir / REPLAY_FILE, {})
+        items = buffer.get("items", [])
+        picked = np.random.default_rng().permutation(len(items))[:max(0, args.replay)]
+        replay = [(items[i]["hash"], items[i]["path"], items[i]["label"]) for i in picked]
+        if shards is not None:
+            # shard refs are hashes; images no longer in the shards can still come from the cache
+            replay = [(h, h, l) for h, _, l in replay if h in shards or use_cache]
+        elif not use_cache:
+            replay = [s for s in replay if os.path.exists(s[1])]
+        print(f"🔁 Warm start from {current} ({parent.get('saved_at')}): "
+              f"{len(delta)} new samples + {len(replay)} replayed.")
+    else:
+        trained, buffer = set(), {}
+        print("🆕 Training from ImageNet weights.")
+
+    samples = delta + replay
+    if use_cache:
+        embeddings_dir = Path(args.embeddings_dir) if args.embeddings_dir else Path(args.models_dir) / EMBEDDINGS_DIR
+        cache = EmbeddingCache(embeddings_dir, BACKBONE_VERSION, img_size, dim=backbone.output_shape[-1])
+        ok = cache_features(backbone, cache, [s[1] for s in samples], [s[0] for s in samples], load)
+        samples = [s for s, h in zip(samples, ok) if h is not None]
+        if not samples:
             print("❌ No valid images found. Exiting.")
             sys.exit(1)
-
-        dataset, n_samples = dataset_info
+        n_samples = len(samples)
+        dataset = feature_dataset(cache, [s[0] for s in samples], [s[2] for s in samples], args.batch, args.shuffle_buffer)
+        trainable = head
+        print(f"📊 Prepared {n_samples} cached feature vectors; training the head only.")
+    else:
+        n_samples = len(samples)
+        dataset = stream_dataset([s[1] for s in samples], [s[2] for s in samples], load,
+                                 args.batch, args.augment, args.shuffle_buffer)
+        trainable = assemble(backbone, head, args.lr)
         print(f"📊 Prepared dataset with {n_samples} samples.")
+    learned = [s for s in samples if trained_key(s) not in trained]  # replayed samples are already in trained
 
-    # Build model
-    model = create_model(input_shape=(args.img_size[0], args.img_size[1], 3), lr=args.lr)
     print("🧩 Model Summary:")
-    model.summary()
+    trainable.summary()
 
     # Train
     print(f"🏁 Starting training for {args.epochs} epochs...")
     start = time.time()
 
-    if isinstance(dataset, tf.data.Dataset):
-        model.fit(dataset, epochs=args.epochs, verbose=1)
-    else:
-        steps = max(1, n_samples // args.batch)
-        model.fit(dataset, steps_per_epoch=steps, epochs=args.epochs, verbose=1)
+    throughput = Throughput(args.batch, n_samples)
+    # Per-batch progress bars only on a terminal; job logs get one line per epoch
+    trainable.fit(dataset, epochs=args.epochs, verbose=1 if sys.stdout.isatty() else 2, callbacks=[throughput])
 
     duration = time.time() - start
-    print(f"✅ Training completed in {duration:.1f}s.")
+    print(f"✅ Training completed in {duration:.1f}s ({throughput.images_per_sec:.1f} images/sec).")
 
-    # Save model and metadata
-    print(f"💾 Saving model to {MODEL_PATH}")
-    model.save(str(MODEL_PATH))
+    # The saved model always takes images, whichever way the head was trained
+    model = assemble(backbone, head, args.lr)
 
+    # Save model and metadata into a staging directory, then register it as a version
+    staging = registry.stage()
+    print(f"💾 Saving model to {staging / MODEL_FILE}")
+    progress(stage="saving")
+    model.save(str(staging / MODEL_FILE))
+
+    n_replay = n_samples - len(learned)
     meta = {
         "saved_at": time.strftime("%Y-%m-%d %H:%M:%S"),
         "samples": n_samples,
         "epochs": args.epochs,
         "img_size": args.img_size,
         "base_model": "MobileNetV2",
+        "backbone_version": BACKBONE_VERSION,
+        "head_only": use_cache,
+        "images_per_sec": round(throughput.images_per_sec, 2),
+        "lineage": lineage_entry(parent, warm, len(learned), n_replay, len(trained) + len(learned)),
+        "parent_version": current if warm else None,
     }
 
-    with open(MODEL_DIR / "metadata.json", "w", encoding="utf-8") as f:
-        json.dump(meta, f, indent=2)
-
+    write_json_file(staging / META_FILE, meta)
+    save_training_state(staging, current_dir, learned, warm, buffer)
     print("📄 Metadata written.")
-    print("🎯 Model successfully updated as 'final_model' for live use.")
+
+    version = registry.commit(staging)
+    promoted = not args.no_promote or current is None  # nothing to compare against yet
+    if promoted:
+        registry.promote(version, by="train_model", reason=f"trained on {n_samples} samples")
+        print(f"🎯 Model {version} registered and promoted to 'final_model' for live use.")
+    else:
+        registry.set_candidate(version, by="train_model", reason=f"trained on {n_samples} samples")
+        print(f"📦 Model {version} registered as the shadow candidate; 'final_model' still points at {current}.")
+    removed = registry.prune(args.keep_versions)
+    if removed:
+        print(f"🧹 Removed {len(removed)} old model versions.")
+    progress(stage="registered", version=version, promoted=promoted)
     sys.exit(0)
 
 
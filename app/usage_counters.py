@@ -0,0 +1,215 @@
+import atexit, os, threading, time
+from .shared_counters import SharedSlotTable, TableFull
+from .logger import app_logger
+
+
+class WriteBehind:
+    """
+    Base for counters that are updated in memory and persisted in batches.
+
+    A flusher thread (one per worker, started on first use because threads don't
+    survive fork) calls flush() every `flush_interval` seconds, or sooner once
+    `max_batch` updates are pending. Subclasses implement _take() and _write().
+    """
+
+    def __init__(self, name, flush_interval=5.0, max_batch=500):
+        self.name = name
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._flusher_pid = None
+        self._pending_updates = 0
+        self.stats = {"updates": 0, "flushes": 0, "flushed": 0, "dropped": 0, "failed_flushes": 0,
+                      "last_flush_ms": 0.0, "max_flush_ms": 0.0}
+        atexit.register(self.flush)
+
+    def _ensure_flusher(self):
+        if self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid != os.getpid():
+                self._flusher_pid = os.getpid()
+                threading.Thread(target=self._flush_loop, name=f"{self.name}-flush", daemon=True).start()
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def _touched(self):
+        # Call with self._lock held after recording an update
+        self.stats["updates"] += 1
+        self._pending_updates += 1
+        if self._pending_updates >= self.max_batch:
+            self._wake.set()
+
+    def flush(self):
+        """Persist everything pending in this worker; returns the number of entries written."""
+        with self._flush_lock:
+            with self._lock:
+                batch = self._take()
+                self._pending_updates = 0
+            if not batch:
+                return 0
+            started = time.perf_counter()
+            try:
+                self._write(batch)
+            except Exception as e:
+                app_logger.exception("%s flush failed: %s", self.name, e)
+                with self._lock:
+                    self.stats["failed_flushes"] += 1
+                    self._restore(batch)
+                return 0
+            elapsed = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self.stats["flushes"] += 1
+                self.stats["flushed"] += len(batch)
+                self.stats["last_flush_ms"] = round(elapsed, 3)
+                self.stats["max_flush_ms"] = round(max(self.stats["max_flush_ms"], elapsed), 3)
+            return len(batch)
+
+    def snapshot(self):
+        with self._lock:
+            return {**self.stats, "pending": self._pending_size()}
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self.flush()
+
+
+class DeltaAggregator(WriteBehind):
+    """
+    Coalesces additive increments per bucket (e.g. (day, api_key)) in this worker.
+    `merge(deltas)` receives {bucket: {field: delta}} and applies it to the durable
+    record in one read-modify-write. Increments are additive, so every worker can
+    flush its own deltas independently. Once `max_pending` buckets are waiting (the
+    store is failing), new buckets are dropped and counted.
+    """
+
+    def __init__(self, name, merge, flush_interval=5.0, max_batch=500, max_pending=100000):
+        super().__init__(name, flush_interval, max_batch)
+        self.merge = merge
+        self.max_pending = max_pending
+        self._deltas = {}
+
+    def add(self, bucket, counts):
+        with self._lock:
+            d = self._deltas.get(bucket)
+            if d is None:
+                if len(self._deltas) >= self.max_pending:
+                    self.stats["dropped"] += 1
+                    return False
+                d = self._deltas[bucket] = {}
+            for field, n in counts.items():
+                d[field] = d.get(field, 0) + n
+            self._touched()
+        self._ensure_flusher()
+        return True
+
+    def _take(self):
+        deltas, self._deltas = self._deltas, {}
+        return deltas
+
+    def _restore(self, deltas):
+        for bucket, counts in deltas.items():
+            d = self._deltas.setdefault(bucket, {})
+            for field, n in counts.items():
+                d[field] = d.get(field, 0) + n
+
+    def _write(self, deltas):
+        self.merge(deltas)
+
+    def _pending_size(self):
+        return len(self._deltas)
+
+
+class SharedTableWriteBehind(WriteBehind):
+    """
+    Per-key values kept in a host-wide SharedSlotTable with `fields`. Keys this worker
+    updates are marked dirty, and flush() passes {key: {field: value}} for them to
+    `persist(snapshot)` in one batch. A table file from an older field layout is
+    recreated (the values reseed from the durable store).
+    """
+
+    def __init__(self, name, path, fields, persist, flush_interval=5.0, max_batch=500, slots=65536):
+        super().__init__(name, flush_interval, max_batch)
+        self.path = path
+        self.fields = tuple(fields)
+        self.persist = persist
+        self.slots = slots
+        self._table = None
+        self._dirty = set()
+
+    def _shared(self):
+        if self._table is None:
+            with self._lock:
+                if self._table is None:
+                    try:
+                        self._table = SharedSlotTable(self.path, self.fields, slots=self.slots)
+                    except ValueError:
+                        app_logger.warning("%s: recreating %s with fields %s", self.name, self.path, self.fields)
+                        os.remove(self.path)
+                        self._table = SharedSlotTable(self.path, self.fields, slots=self.slots)
+        return self._table
+
+    def _mark(self, key):
+        with self._lock:
+            self._dirty.add(key)
+            self._touched()
+        self._ensure_flusher()
+
+    def _take(self):
+        dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def _restore(self, dirty):
+        self._dirty |= dirty
+
+    def _write(self, dirty):
+        snapshot = {}
+        for key in dirty:
+            values = self._shared().get(key)
+            if values is not None:
+                snapshot[key] = values
+        self.persist(snapshot)
+
+    def _pending_size(self):
+        return len(self._dirty)
+
+
+class SharedCounter(SharedTableWriteBehind):
+    """
+    Per-key running totals kept in a host-wide SharedSlotTable, so every worker sees
+    the same sequence of values (e.g. for "every 4th upload" decisions). `seed(key)`
+    supplies the durable value the first time the host sees a key; `persist(snapshot)`
+    writes {key: total} for the keys this worker touched.
+    """
+
+    def __init__(self, name, path, seed, persist, flush_interval=5.0, max_batch=500, slots=65536):
+        super().__init__(name, path, ("count",), lambda snapshot: persist({k: v["count"] for k, v in snapshot.items()}),
+                         flush_interval, max_batch, slots)
+        self.seed = seed
+
+    def incr(self, key, n=1):
+        """Add n to key and return the new total, or None if the table is full."""
+        def step(values):
+            total = (values[0] if values is not None else int(self.seed(key) or 0)) + n
+            return [total], total
+        try:
+            total = self._shared().update(key, step)
+        except TableFull:
+            with self._lock:
+                self.stats["dropped"] += 1
+            app_logger.error("%s: shared table full, update for %s dropped", self.name, key)
+            return None
+        self._mark(key)
+        return total
+
+    def get(self, key):
+        values = self._shared().get(key)
+        return values["count"] if values is not None else int(self.seed(key) or 0)
@@ -0,0 +1,134 @@
+import bisect, hashlib, threading
+from .config import USERS_FILE, USERS_STORE_FILE
+from .record_store import RecordStore, op_put, op_patch, op_del
+from .utils import read_json, now_iso, page_range
+
+# Namespaces: "users" (email -> record) and "refresh" (sha256(token) -> {"user", "created"}).
+# Refresh tokens are kept out of the user record so membership and revocation are O(1)
+# and a login doesn't rewrite the account.
+USERS = "users"
+REFRESH = "refresh"
+
+def token_digest(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def _bootstrap():
+    """Import the legacy users.json array on first start."""
+    ops = []
+    for u in read_json(USERS_FILE, []):
+        if not isinstance(u, dict) or not u.get("user"):
+            continue
+        record = dict(u)
+        for token in record.pop("refresh_tokens", None) or []:
+            ops.append(op_put(REFRESH, token_digest(token), {"user": record["user"], "created": None}))
+        ops.append(op_put(USERS, record["user"], record))
+    return ops
+
+store = RecordStore(USERS_STORE_FILE, bootstrap=_bootstrap)
+
+# Secondary indexes maintained from the log: per-user refresh tokens, blocked users and
+# the sorted (email, email) list used for paginated admin listings
+_refresh_by_user = {}
+_blocked = set()
+_sorted_users = []
+_index_lock = threading.Lock()
+
+# Never returned by admin listings
+PRIVATE_FIELDS = ("password", "refresh_tokens")
+
+def _reset():
+    with _index_lock:
+        _refresh_by_user.clear()
+        _blocked.clear()
+        _sorted_users.clear()
+
+def _apply(ns, key, old, new):
+    with _index_lock:
+        if ns == REFRESH:
+            if old is not None:
+                _refresh_by_user.get(old.get("user"), set()).discard(key)
+            if new is not None:
+                _refresh_by_user.setdefault(new.get("user"), set()).add(key)
+        elif ns == USERS:
+            if new is not None and new.get("status") == "blocked":
+                _blocked.add(key)
+            else:
+                _blocked.discard(key)
+            i = bisect.bisect_left(_sorted_users, (key, key))
+            present = i < len(_sorted_users) and _sorted_users[i] == (key, key)
+            if new is None and present:
+                del _sorted_users[i]
+            elif new is not None and not present:
+                _sorted_users.insert(i, (key, key))
+
+store.add_listener(_apply, _reset)
+
+# -----------------------------
+# Users
+# -----------------------------
+def get_user(email):
+    return store.get(USERS, email)
+
+def list_users():
+    return store.values(USERS)
+
+def users_page(cursor=None, limit=50, status=None, role=None):
+    """Users ordered by email without private fields; returns (users, next_cursor)."""
+    def match(email):
+        u = store.peek(USERS, email) or {}
+        return (status is None or u.get("status", "active") == status) and (role is None or u.get("role") == role)
+    def read():
+        with _index_lock:
+            keys, next_cursor = page_range(_sorted_users, cursor, limit,
+                                           match=match if status is not None or role is not None else None)
+        users = (store.peek(USERS, email) for _, email in keys)
+        return [{k: v for k, v in u.items() if k not in PRIVATE_FIELDS} for u in users if u is not None], next_cursor
+    return store.read(read)
+
+def user_counts():
+    store.sync()
+    return {"total": store.count(USERS), "blocked": len(_blocked)}
+
+def create_user(record):
+    """Insert a new user; returns None if the email is already registered."""
+    email = record["user"]
+    def step():
+        if store.get(USERS, email) is not None:
+            return [], None
+        return [op_put(USERS, email, record)], record
+    return store.atomic(step)
+
+def update_user(email, **fields):
+    """Patch one user record; returns the updated record or None if unknown."""
+    return store.patch(USERS, email, fields)
+
+# -----------------------------
+# Refresh tokens
+# -----------------------------
+def record_login(email, refresh_token):
+    """Store the new refresh token and last_login in one write."""
+    store.commit([
+        op_put(REFRESH, token_digest(refresh_token), {"user": email, "created": now_iso()}),
+        op_patch(USERS, email, {"last_login": now_iso()}),
+    ])
+
+def refresh_token_owner(token):
+    entry = store.get(REFRESH, token_digest(token))
+    return entry.get("user") if entry else None
+
+def revoke_refresh_token(token):
+    """Remove one refresh token; returns its owner or None if it was not active."""
+    digest = token_digest(token)
+    def step():
+        entry = store.get(REFRESH, digest)
+        if entry is None:
+            return [], None
+        return [op_del(REFRESH, digest)], entry.get("user")
+    return store.atomic(step)
+
+def revoke_all_refresh_tokens(email):
+    store.sync()
+    with _index_lock:
+        digests = list(_refresh_by_user.get(email, ()))
+    store.commit([op_del(REFRESH, d) for d in digests])
+    return len(digests)
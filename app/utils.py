@@ -1,10 +1,15 @@
-import os, json, time, hashlib
+import os, json, time, hashlib, base64, bisect, math
 from pathlib import Path
 from filelock import FileLock
-from .config import DATA_DIR, UPLOADS_DIR, API_USAGE_FILE, CACHE_FILE, UPLOAD_RETENTION_DAYS
+from .config import (
+    DATA_DIR, UPLOADS_DIR, API_USAGE_FILE, API_USAGE_DAYS_DIR, CACHE_FILE, UPLOAD_RETENTION_DAYS,
+    RATE_LIMIT_USER_PER_MIN, RATE_LIMIT_KEY_PER_MIN, RATE_LIMIT_IP_PER_MIN, RATE_LIMIT_SHM_FILE, SHARED_TABLE_SLOTS,
+    UPLOAD_COUNT_FILE, UPLOAD_COUNT_SHM_FILE, USAGE_FLUSH_INTERVAL, USAGE_FLUSH_BATCH, USAGE_MAX_PENDING
+)
 from .logger import app_logger
+from .shared_counters import SharedSlotTable, TableFull
+from .usage_counters import DeltaAggregator, SharedCounter
 from datetime import datetime, timedelta
-from cachetools import TTLCache
 
 def _atomic_read(path, default):
     path = str(path)
@@ -26,7 +31,18 @@ def _atomic_write(path, data):
         tmp = path + '.tmp'
         with open(tmp, 'w', encoding='utf-8') as f:
             json.dump(data, f, indent=2)
+        # rename keeps the inode and mtime, so this identifies exactly the file we wrote
+        stamp = file_stamp(tmp)
         os.replace(tmp, path)
+        return stamp
+
+def file_stamp(path):
+    """Cheap change-detection token for a file: (inode, mtime_ns, size), or None if missing."""
+    try:
+        st = os.stat(str(path))
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
 
 def read_json(path, default=None):
     if default is None:
@@ -34,7 +50,7 @@ def read_json(path, default=None):
     return _atomic_read(path, default)
 
 def write_json(path, data):
-    _atomic_write(path, data)
+    return _atomic_write(path, data)
 
 def append_json(path, entry):
     arr = read_json(path, [])
@@ -59,24 +75,157 @@ def file_sha256_bytes(content_bytes):
     h.update(content_bytes)
     return h.hexdigest()
 
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode("utf-8")).decode("ascii")
+
+class InvalidCursor(ValueError):
+    pass
+
+def _kind(value):
+    return float if isinstance(value, (int, float)) and not isinstance(value, bool) else type(value)
+
+def decode_cursor(cursor, like=None):
+    """
+    The key a cursor points after, or None when it is malformed. With `like` (a key
+    from the index being paged), the cursor must have the same length and element types.
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        return None
+    if not isinstance(key, list) or not all(isinstance(k, (str, int, float)) for k in key):
+        return None
+    if like is not None and (len(key) != len(like) or any(_kind(a) is not _kind(b) for a, b in zip(key, like))):
+        return None
+    return tuple(key)
+
+def page_range(sorted_keys, cursor=None, limit=50, lo=None, hi=None, match=None):
+    """
+    One page of an ascending list of (sort_key, id) tuples, starting after `cursor`,
+    limited to lo <= sort_key <= hi and to ids for which match(id) is true.
+    Returns (keys, next_cursor); next_cursor is None on the last page. The cursor is
+    the last key examined, so ids skipped by `match` are not scanned again.
+    Raises InvalidCursor for a cursor that does not fit sorted_keys.
+    """
+    start = bisect.bisect_left(sorted_keys, (lo,)) if lo is not None else 0
+    if cursor:
+        after = decode_cursor(cursor, sorted_keys[0] if sorted_keys else None)
+        if after is None:
+            raise InvalidCursor(cursor)
+        start = max(start, bisect.bisect_right(sorted_keys, after))
+    page, i = [], start
+    while i < len(sorted_keys) and len(page) < limit:
+        key = sorted_keys[i]
+        if hi is not None and key[0] > hi:
+            return page, None
+        if match is None or match(key[1]):
+            page.append(key)
+        i += 1
+    more = i < len(sorted_keys) and (hi is None or sorted_keys[i][0] <= hi)
+    return page, (encode_cursor(sorted_keys[i - 1]) if more and i > start else None)
+
+def count_range(sorted_keys, lo=None, hi=None):
+    """Number of (sort_key, id) tuples in an ascending list with lo <= sort_key <= hi."""
+    start = bisect.bisect_left(sorted_keys, (lo,)) if lo is not None else 0
+    end = bisect.bisect_right(sorted_keys, hi, key=lambda k: k[0]) if hi is not None else len(sorted_keys)
+    return max(0, end - start)
+
+def page_after(sorted_keys, cursor=None, limit=50):
+    """page_range() without bounds or filter."""
+    return page_range(sorted_keys, cursor, limit)
+
+def project(record, fields):
+    """Copy of record restricted to `fields` (all fields when fields is empty)."""
+    if not fields:
+        return record
+    return {k: record[k] for k in fields if k in record}
+
 def now_iso():
     return datetime.utcnow().isoformat() + "Z"
 
-def log_api_usage(api_calls=0, disagreements=0, api_key=None):
-    today = datetime.utcnow().date().isoformat()
+def _merge_api_usage(deltas):
+    """Apply {(day, api_key): {"api_calls", "disagreements"}} to api_usage.json in one write."""
     d = read_json(API_USAGE_FILE, {})
     if not isinstance(d, dict):
         d = {}
-    if today not in d:
-        d[today] = {"api_calls": 0, "disagreements": 0, "keys": {}}
-    d[today]["api_calls"] += int(api_calls)
-    d[today]["disagreements"] += int(disagreements)
-    if api_key:
-        if api_key not in d[today]["keys"]:
-            d[today]["keys"][api_key] = {"api_calls": 0, "disagreements": 0}
-        d[today]["keys"][api_key]["api_calls"] += int(api_calls)
-        d[today]["keys"][api_key]["disagreements"] += int(disagreements)
+    for (day, api_key), counts in deltas.items():
+        if day not in d:
+            d[day] = {"api_calls": 0, "disagreements": 0, "keys": {}}
+        targets = [d[day]]
+        if api_key:
+            if api_key not in d[day]["keys"]:
+                d[day]["keys"][api_key] = {"api_calls": 0, "disagreements": 0}
+            targets.append(d[day]["keys"][api_key])
+        for t in targets:
+            for field, n in counts.items():
+                t[field] = t.get(field, 0) + int(n)
     write_json(API_USAGE_FILE, d)
+    if not _split_usage_days(d):
+        for day in {day for day, _ in deltas}:
+            write_json(API_USAGE_DAYS_DIR / f"{day}.json", d[day])
+
+def _split_usage_days(usage):
+    """
+    Create API_USAGE_DAYS_DIR with one file per day of `usage` if it doesn't exist yet
+    (first flush after upgrading). Returns True if it was created.
+    """
+    if API_USAGE_DAYS_DIR.exists():
+        return False
+    tmp = Path(f"{API_USAGE_DAYS_DIR}.tmp{os.getpid()}")
+    tmp.mkdir(parents=True, exist_ok=True)
+    for day, record in usage.items():
+        write_json(tmp / f"{day}.json", record)
+    try:
+        os.rename(tmp, API_USAGE_DAYS_DIR)
+    except OSError:
+        # another worker created it first; its copy came from the same file
+        for f in tmp.iterdir():
+            f.unlink()
+        tmp.rmdir()
+        return False
+    return True
+
+def usage_days(cursor=None, limit=50, since=None, until=None):
+    """
+    One page of daily API usage, oldest first, as {"day", "api_calls", "disagreements", "keys"}.
+    since/until are ISO dates, both inclusive. Only the page's day files are read.
+    Raises InvalidCursor like page_range().
+    """
+    if not API_USAGE_DAYS_DIR.exists():
+        _split_usage_days(read_json(API_USAGE_FILE, {}))
+    days = sorted((name[:-5], name[:-5]) for name in os.listdir(API_USAGE_DAYS_DIR) if name.endswith(".json"))
+    keys, next_cursor = page_range(days, cursor, limit, lo=since or None, hi=until or None)
+    return [{"day": day, **read_json(API_USAGE_DAYS_DIR / f"{day}.json", {})} for day, _ in keys], next_cursor
+
+# api_usage.json and upload_count.json are written behind: requests only touch memory
+# (or the shared table) and a per-worker flusher persists them in batches.
+api_usage = DeltaAggregator("api_usage", _merge_api_usage, USAGE_FLUSH_INTERVAL, USAGE_FLUSH_BATCH, USAGE_MAX_PENDING)
+
+def _persist_upload_counts(snapshot):
+    # Totals only grow; max() keeps a worker flushing an older reading from going backwards
+    counts = read_json(UPLOAD_COUNT_FILE, {})
+    for user, total in snapshot.items():
+        counts[user] = max(int(counts.get(user, 0)), total)
+    write_json(UPLOAD_COUNT_FILE, counts)
+
+upload_counter = SharedCounter("upload_count", UPLOAD_COUNT_SHM_FILE,
+                               lambda user: read_json(UPLOAD_COUNT_FILE, {}).get(user, 0),
+                               _persist_upload_counts, USAGE_FLUSH_INTERVAL, USAGE_FLUSH_BATCH, SHARED_TABLE_SLOTS)
+
+def log_api_usage(api_calls=0, disagreements=0, api_key=None):
+    today = datetime.utcnow().date().isoformat()
+    api_usage.add((today, api_key), {"api_calls": int(api_calls), "disagreements": int(disagreements)})
+
+def count_upload(user):
+    """Count one upload for user; returns the host-wide total (None if it couldn't be counted)."""
+    return upload_counter.incr(user)
+
+def usage_stats():
+    return {"api_usage": api_usage.snapshot(), "upload_count": upload_counter.snapshot()}
+
+def flush_usage():
+    api_usage.stop()
+    upload_counter.stop()
 
 def cleanup_uploads(retention_days=UPLOAD_RETENTION_DAYS):
     cutoff = datetime.utcnow() - timedelta(days=retention_days)
@@ -92,16 +241,78 @@ def cleanup_uploads(retention_days=UPLOAD_RETENTION_DAYS):
             app_logger.exception("cleanup_uploads error: %s", e)
     return removed
 
-# Simple in-memory rate limiter per key/ip with TTL
-_rate_cache = TTLCache(maxsize=10000, ttl=60)  # 1 minute TTL
+# Rate limiter shared by every worker on the host (GCRA over an mmap'd slot table).
+# Each key stores its theoretical arrival time; a client may burst up to `limit`
+# requests and is then paced at one request per period/limit seconds.
+RATE_LIMITS = {"user": RATE_LIMIT_USER_PER_MIN, "key": RATE_LIMIT_KEY_PER_MIN, "ip": RATE_LIMIT_IP_PER_MIN}
+_rate_table = None
 
-def rate_allow(key, limit=None):
+def _rate_state():
+    global _rate_table
+    if _rate_table is None:
+        # A TAT in the past is the same state as a key never seen, so its slot can be reused
+        _rate_table = SharedSlotTable(RATE_LIMIT_SHM_FILE, ("tat",), fmt="d", slots=SHARED_TABLE_SLOTS,
+                                      expired=lambda v: v[0] < time.time())
+    return _rate_table
+
+def rate_check(key, scope="key", limit=None, period=60.0, charge=True):
+    """
+    Returns (allowed, retry_after_seconds) for one request by `key` in `scope`
+    ("user", "key" or "ip"). With charge=False the request is only checked, not counted.
+    """
     if limit is None:
-        from .config import RATE_LIMIT_REQUESTS_PER_MIN
-        limit = RATE_LIMIT_REQUESTS_PER_MIN
-    # key can be api_key or ip or user
-    count = _rate_cache.get(key, 0)
-    if count + 1 > limit:
-        return False
-    _rate_cache[key] = count + 1
-    return True
+        limit = RATE_LIMITS.get(scope, RATE_LIMIT_KEY_PER_MIN)
+    if limit <= 0:
+        return True, 0.0
+    interval = period / limit
+
+    def step(values):
+        now = time.time()
+        tat = max(values[0] if values else 0.0, now)
+        allow_at = tat + interval - period
+        if now < allow_at:
+            return None, allow_at - now
+        return ([tat + interval] if charge else None), 0.0
+
+    try:
+        retry_after = _rate_state().update(f"{scope}:{key}", step)
+    except TableFull:
+        app_logger.error("Rate limit table full; allowing %s:%s", scope, key)
+        return True, 0.0
+    return retry_after == 0.0, retry_after
+
+def rate_check_scopes(**scopes):
+    """
+    rate_check over several scopes (user=, key=, ip=) as one request: all their slots
+    are locked together, every scope is checked and then either all are charged or,
+    when one is exhausted, none is. Returns (allowed, retry_after_seconds).
+    """
+    checks = []
+    for scope, key in scopes.items():
+        limit = RATE_LIMITS.get(scope, RATE_LIMIT_KEY_PER_MIN)
+        if key and limit > 0:
+            checks.append((f"{scope}:{key}", 60.0 / limit, 60.0))
+    if not checks:
+        return True, 0.0
+
+    def step(values):
+        now = time.time()
+        tats = [max(v[0], now) for v in values]
+        retry_after = max(tat + interval - period - now for tat, (_, interval, period) in zip(tats, checks))
+        if retry_after > 0:
+            return None, retry_after
+        return [[tat + interval] for tat, (_, interval, _) in zip(tats, checks)], 0.0
+
+    try:
+        retry_after = _rate_state().update_many([name for name, _, _ in checks], step)
+    except TableFull:
+        app_logger.error("Rate limit table full; allowing %s", ", ".join(name for name, _, _ in checks))
+        return True, 0.0
+    return retry_after == 0.0, retry_after
+
+def retry_after_header(retry_after):
+    """Retry-After value for a 429: whole seconds, rounded up, at least 1."""
+    return str(max(1, math.ceil(retry_after)))
+
+def rate_allow(key, limit=None, scope="key"):
+    return rate_check(key, scope=scope, limit=limit)[0]
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+bench_login.py
+
+Measure login throughput and its effect on concurrent prediction latency.
+
+Runs a burst of bcrypt password checks at the configured cost while a steady
+stream of simulated /api/predict requests is served from the same event loop,
+once with bcrypt inline (the old behaviour) and once through app.passwords.
+
+    python benchmarks/bench_login.py --logins 32 --rounds 12
+
+--logins defaults to PASSWORD_QUEUE_LIMIT: a larger burst is partly rejected with
+503 by design, and rejected logins are reported separately from completed ones.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# app.config refuses to import without these; the benchmark never uses them
+for k, v in {"JWT_SECRET": "bench", "ADMIN_EMAIL": "admin@bench", "GMAIL_USER": "bench", "GMAIL_APP_PASS": "bench"}.items():
+    os.environ.setdefault(k, v)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Login throughput benchmark")
+    p.add_argument("--logins", type=int, default=int(os.environ.get("PASSWORD_QUEUE_LIMIT", 32)),
+                   help="logins in the burst (default: the password queue limit)")
+    p.add_argument("--rounds", type=int, default=int(os.environ.get("BCRYPT_ROUNDS", 12)), help="bcrypt cost")
+    p.add_argument("--predict-interval", type=float, default=0.01, help="seconds between simulated predictions")
+    p.add_argument("--predict-work", type=int, default=2_000_000, help="bytes hashed per simulated prediction")
+    return p.parse_args()
+
+
+async def predict_stream(stop, interval, payload, latencies):
+    """Stand-in for /api/predict: a short CPU step on the loop, timed from arrival to completion."""
+    while not stop.is_set():
+        arrived = time.perf_counter()
+        await asyncio.sleep(0)
+        hashlib.sha256(payload).digest()
+        latencies.append((time.perf_counter() - arrived) * 1000)
+        await asyncio.sleep(interval)
+
+
+async def run(mode, args, hashed):
+    from app import passwords
+
+    stop = asyncio.Event()
+    latencies = []
+    predictor = asyncio.create_task(predict_stream(stop, args.predict_interval, b"\0" * args.predict_work, latencies))
+
+    async def login():
+        started = time.perf_counter()
+        if mode == "inline":
+            passwords.check_password("correct horse", hashed)
+            await asyncio.sleep(0)
+        else:
+            await passwords.offload(passwords.check_password, "correct horse", hashed)
+        return (time.perf_counter() - started) * 1000
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(login() for _ in range(args.logins)), return_exceptions=True)
+    stop.set()
+    await predictor
+
+    completed = sorted(r for r in results if not isinstance(r, Exception))
+    rejected = len(results) - len(completed)
+    # throughput over the completed logins only; rejections return immediately
+    elapsed = max(completed) / 1000 if completed else time.perf_counter() - start
+    latencies.sort()
+    return {
+        "mode": mode,
+        "logins_per_sec": len(completed) / elapsed if completed else 0.0,
+        "login_p50_ms": statistics.median(completed) if completed else 0.0,
+        "rejected": rejected,
+        "predict_p50_ms": statistics.median(latencies) if latencies else 0.0,
+        "predict_p95_ms": latencies[int(len(latencies) * 0.95) - 1] if latencies else 0.0,
+        "predictions": len(latencies),
+    }
+
+
+def main():
+    args = parse_args()
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    from app import passwords
+
+    hashed = passwords.hash_password("correct horse")
+    print(f"bcrypt cost={args.rounds} pool_workers={passwords.PASSWORD_POOL_WORKERS} queue_limit={passwords.PASSWORD_QUEUE_LIMIT}")
+    for mode in ("inline", "offloaded"):
+        r = asyncio.run(run(mode, args, hashed))
+        print(f"{r['mode']:>10}: {r['logins_per_sec']:7.1f} logins/s  login p50={r['login_p50_ms']:.0f}ms  rejected={r['rejected']:<3} "
+              f"predict p50={r['predict_p50_ms']:.1f}ms p95={r['predict_p95_ms']:.1f}ms (n={r['predictions']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,3 +6,8 @@ app = FastAPI(title="NSFW AI Hub - Wrapper")
 
 # include the inner app routers by mounting
 app.mount("/", inner_app)
+
+# Mounted apps don't get lifespan events, so run the inner app's startup/shutdown
+# handlers (counter flushes, job runner, model watcher, shadow runner) from here
+app.router.on_startup.extend(inner_app.router.on_startup)
+app.router.on_shutdown.extend(inner_app.router.on_shutdown)
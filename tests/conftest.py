@@ -0,0 +1,13 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.config refuses to load without these; tests never send mail or issue real tokens
+os.environ.setdefault("JWT_SECRET", "test-secret")
+os.environ.setdefault("ADMIN_EMAIL", "admin@example.com")
+os.environ.setdefault("GMAIL_USER", "test@example.com")
+os.environ.setdefault("GMAIL_APP_PASS", "test")
+
+import app.config  # noqa: E402,F401  (must load before app.utils: they import each other)
@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+from app.model_registry import ModelRegistry
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return ModelRegistry(tmp_path / "models")
+
+
+def _register(registry, tag, content=b"weights"):
+    staging = registry.stage()
+    (staging / "model.h5").write_bytes(content + tag.encode())
+    (staging / "metadata.json").write_text('{"tag": "%s"}' % tag)
+    return registry.commit(staging, tag=tag)
+
+
+def test_promote_swaps_current_and_logs(registry):
+    v1, v2 = _register(registry, "a"), _register(registry, "b")
+    assert registry.current() is None
+    assert registry.promote(v1, by="admin") is None
+    assert registry.promote(v2, by="admin") == v1
+    assert registry.current() == v2
+    assert os.path.realpath(registry.current_link) == str((registry.versions_dir / v2).resolve())
+    assert [(h["action"], h["version"], h["previous"]) for h in registry.history()] == \
+        [("promote", v2, v1), ("promote", v1, None)]
+
+
+def test_promote_clears_candidate(registry):
+    v1, v2 = _register(registry, "a"), _register(registry, "b")
+    registry.promote(v1)
+    registry.set_candidate(v2)
+    assert registry.candidate() == v2
+    registry.promote(v2)
+    assert registry.candidate() is None
+
+
+def test_promote_unknown_version(registry):
+    with pytest.raises(KeyError):
+        registry.promote("v20240101-000000-missing")
+
+
+def test_rollback_undoes_last_switch(registry):
+    v1, v2 = _register(registry, "a"), _register(registry, "b")
+    registry.promote(v1)
+    registry.promote(v2)
+    assert registry.rollback(by="admin") == v1
+    assert registry.current() == v1
+    assert registry.history()[0]["action"] == "rollback"
+    # rolling back again undoes the rollback
+    assert registry.rollback() == v2
+
+
+def test_rollback_without_history(registry):
+    _register(registry, "a")
+    with pytest.raises(KeyError):
+        registry.rollback()
+
+
+@pytest.mark.parametrize("version", ["../models", "..", "../../etc", "a/b", ".staging-x", "", None])
+def test_valid_id_rejects_paths(registry, version):
+    assert not ModelRegistry.valid_id(version)
+    with pytest.raises(KeyError):
+        registry.rollback(version)
+    assert registry.manifest(version) is None
+
+
+def test_valid_id_accepts_registered_ids(registry):
+    assert ModelRegistry.valid_id(_register(registry, "a"))
+
+
+def test_prune_keeps_current_and_candidate(registry):
+    versions = [_register(registry, tag) for tag in "abcde"]
+    registry.promote(versions[0])
+    registry.set_candidate(versions[1])
+    removed = registry.prune(keep=2)
+    assert sorted(removed) == sorted(versions[2:3])
+    assert {m["version"] for m in registry.versions()} == {versions[0], versions[1], versions[3], versions[4]}
+    assert registry.prune(keep=0) == []
+
+
+def test_verify_detects_checksum_mismatch(registry):
+    version = _register(registry, "a")
+    assert registry.verify(version) == []
+    model = registry.path(version) / "model.h5"
+    os.chmod(model, 0o644)
+    model.write_bytes(b"tampered")
+    assert registry.verify(version) == ["model.h5"]
+    (registry.path(version) / "metadata.json").unlink()
+    assert sorted(registry.verify(version)) == ["metadata.json", "model.h5"]
+
+
+def test_verify_without_manifest(registry):
+    version = _register(registry, "a")
+    (registry.path(version) / "manifest.json").unlink()
+    assert registry.verify(version) == ["manifest.json"]
+
+
+def test_migrate_adopts_plain_final_model(tmp_path):
+    root = tmp_path / "models"
+    (root / "final_model").mkdir(parents=True)
+    (root / "final_model" / "model.h5").write_bytes(b"legacy")
+    registry = ModelRegistry(root)
+    registry.migrate()
+    assert registry.current_link.is_symlink()
+    assert (registry.path(registry.current()) / "model.h5").read_bytes() == b"legacy"
+    assert registry.verify(registry.current()) == []
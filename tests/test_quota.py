@@ -0,0 +1,92 @@
+import pytest
+
+from app import api_keys
+from app.quota import QuotaEngine, FIELDS
+from app.shared_counters import SharedSlotTable, TableFull
+
+LIMITS = {"image_limit": 3, "video_limit": 1}
+
+
+@pytest.fixture
+def keys(tmp_path, monkeypatch):
+    """api_keys with its JSON file and quota table under tmp_path."""
+    monkeypatch.setattr(api_keys, "API_KEYS_FILE", tmp_path / "api_keys.json")
+    monkeypatch.setitem(api_keys._index, "stamp", None)
+    engine = QuotaEngine(tmp_path / "quota.shm", api_keys._persist_quota, api_keys._consume_durable,
+                         flush_interval=3600)
+    monkeypatch.setattr(api_keys, "quota_engine", engine)
+    yield api_keys
+    engine.stop()  # flush while the patched paths are still in place
+
+
+def _client(keys, email="client@example.com"):
+    client = keys.create_api_key_for_user(email)
+    client["quota"].update(image_limit=3, video_limit=1)
+    with keys._index_lock:
+        keys._save()
+    return client
+
+
+def _record(keys, client):
+    return keys.find_client_by_key(client["api_key"])
+
+
+def test_consume_counts_against_limit(tmp_path):
+    engine = QuotaEngine(tmp_path / "q.shm", lambda s: None, lambda k, s: None, flush_interval=3600)
+    assert [engine.consume("k", {}, "image", LIMITS) for _ in range(4)] == [True, True, True, False]
+    assert engine.current("k")["image_used"] == 3
+
+
+def test_table_full_falls_back_to_durable_record(keys, monkeypatch):
+    client = _client(keys)
+    monkeypatch.setattr(keys.quota_engine, "slots", 2)
+    # fill both slots (nothing in them expires) so the client's key finds no slot
+    keys.quota_engine.consume("other-1", {}, "image", LIMITS)
+    keys.quota_engine.consume("other-2", {}, "image", LIMITS)
+    with pytest.raises(TableFull):
+        keys.quota_engine._shared().update(client["api_key"], lambda v: (None, None))
+
+    assert [keys.consume_quota(_record(keys, client), "video") for _ in range(2)] == [True, False]
+    assert _record(keys, client)["quota"]["video_used"] == 1
+    assert keys.quota_engine.current(client["api_key"]) is None
+
+
+def test_admin_write_reseeds_shared_counters(keys):
+    client = _client(keys)
+    for _ in range(3):
+        assert keys.consume_quota(_record(keys, client), "image")
+    assert not keys.consume_quota(_record(keys, client), "image")
+    keys.quota_engine.flush()
+    assert _record(keys, client)["quota"]["image_used"] == 3
+
+    keys.set_client_quota(client["kid"], reset=True)
+    assert _record(keys, client)["quota"]["epoch"] == 1
+    # the slot still says 3 used at epoch 0; the record's newer epoch wins
+    assert keys.consume_quota(_record(keys, client), "image")
+    assert keys.quota_engine.current(client["api_key"])["image_used"] == 1
+    assert keys.live_quota(_record(keys, client))["image_used"] == 1
+
+
+def test_flush_from_before_admin_write_is_discarded(keys):
+    client = _client(keys)
+    keys.consume_quota(_record(keys, client), "image")
+    keys.consume_quota(_record(keys, client), "image")
+    keys.set_client_quota(client["kid"], image_limit=10, reset=True)
+
+    # the pending flush carries epoch 0 counters; the record is at epoch 1
+    keys.quota_engine.flush()
+    quota = _record(keys, client)["quota"]
+    assert (quota["image_used"], quota["image_limit"], quota["epoch"]) == (0, 10, 1)
+
+
+def test_table_with_old_layout_is_recreated(tmp_path):
+    path = tmp_path / "quota.shm"
+    old = SharedSlotTable(path, ("image_used", "video_used", "reset_ts"), slots=16)
+    old.update("k", lambda v: ([5, 0, 0], None))
+    old.close()
+
+    engine = QuotaEngine(path, lambda s: None, lambda k, s: None, flush_interval=3600, slots=16)
+    assert engine.consume("k", {"image_used": 1}, "image", LIMITS)
+    assert engine.current("k") == dict(zip(FIELDS, [2, 0, engine.current("k")["reset_ts"], 0]))
+    # the file now has the new layout
+    assert SharedSlotTable(path, FIELDS).get("k")["image_used"] == 2
@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+
+from app import utils
+from app.shared_counters import SharedSlotTable, TableFull
+
+
+@pytest.fixture
+def table(tmp_path, monkeypatch):
+    t = SharedSlotTable(tmp_path / "rate.shm", ("tat",), fmt="d", slots=64,
+                        expired=lambda v: v[0] < time.time())
+    monkeypatch.setattr(utils, "_rate_table", t)
+    monkeypatch.setitem(utils.RATE_LIMITS, "user", 6)   # 6/min: burst of 6, then one per 10 s
+    monkeypatch.setitem(utils.RATE_LIMITS, "ip", 12)
+    return t
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(utils.time, "time", lambda: now[0])
+    return now
+
+
+def test_gcra_burst_then_pacing(table, clock):
+    assert all(utils.rate_check_scopes(user="u")[0] for _ in range(6))
+    allowed, retry_after = utils.rate_check_scopes(user="u")
+    assert not allowed and retry_after == pytest.approx(10.0)
+    clock[0] += 9.5
+    assert utils.rate_check_scopes(user="u") == (False, pytest.approx(0.5))
+    clock[0] += 0.5
+    assert utils.rate_check_scopes(user="u") == (True, 0.0)
+    assert not utils.rate_check_scopes(user="u")[0]
+
+
+def test_idle_key_regains_full_burst(table, clock):
+    for _ in range(6):
+        utils.rate_check_scopes(user="u")
+    clock[0] += 60
+    assert all(utils.rate_check_scopes(user="u")[0] for _ in range(6))
+    assert not utils.rate_check_scopes(user="u")[0]
+
+
+def test_rejected_request_charges_no_scope(table, clock):
+    for _ in range(6):
+        assert utils.rate_check_scopes(user="u", ip="1.2.3.4")[0]
+    # the user scope is exhausted; the ip scope must not pay for the rejected requests
+    for _ in range(5):
+        assert not utils.rate_check_scopes(user="u", ip="1.2.3.4")[0]
+    assert all(utils.rate_check_scopes(user=f"other{i}", ip="1.2.3.4")[0] for i in range(6))
+    assert not utils.rate_check_scopes(user="fresh", ip="1.2.3.4")[0]
+
+
+def test_retry_after_is_the_longest_wait(table, clock):
+    for _ in range(6):
+        utils.rate_check_scopes(user="u", ip="ip")
+    for _ in range(6):
+        utils.rate_check_scopes(user="v", ip="ip")
+    # ip (12/min, 5 s interval) is exhausted too; the user's 10 s wait is the longer one
+    assert utils.rate_check_scopes(user="u", ip="ip") == (False, pytest.approx(10.0))
+
+
+@pytest.mark.parametrize("seconds, header", [(0.01, "1"), (1.0, "1"), (1.2, "2"), (9.99, "10")])
+def test_retry_after_header_rounds_up(seconds, header):
+    assert utils.retry_after_header(seconds) == header
+
+
+def test_expired_slots_are_reused(tmp_path, clock):
+    t = SharedSlotTable(tmp_path / "small.shm", ("tat",), fmt="d", slots=4,
+                        expired=lambda v: v[0] < utils.time.time())
+    for i in range(4):
+        t.update(f"k{i}", lambda v: ([clock[0] + 10], None))
+    with pytest.raises(TableFull):
+        t.update("new", lambda v: ([clock[0] + 10], None))
+    clock[0] += 11  # every TAT is now in the past
+    t.update("new", lambda v: ([clock[0] + 10], v))
+    assert t.get("new") == {"tat": clock[0] + 10}
+    assert sum(t.get(f"k{i}") is None for i in range(4)) == 1
+
+
+def test_update_many_is_all_or_nothing(tmp_path):
+    t = SharedSlotTable(tmp_path / "many.shm", ("n",), slots=64)
+    t.update_many(["a", "b"], lambda vs: ([[v[0] + 1] for v in vs], None))
+    assert t.update_many(["a", "b", "c"], lambda vs: (None, vs)) == [[1], [1], [0]]
+    assert t.get("c") == {"n": 0}  # claimed with zeros, so the key now has a slot
+    t.update_many(["a", "c"], lambda vs: ([[5], [7]], None))
+    assert (t.get("a"), t.get("b"), t.get("c")) == ({"n": 5}, {"n": 1}, {"n": 7})
+
+
+def test_update_many_from_threads(tmp_path):
+    t = SharedSlotTable(tmp_path / "threads.shm", ("n",), slots=64)
+    keys = ["a", "b", "c"]
+
+    def work(order):
+        for _ in range(200):
+            t.update_many(order, lambda vs: ([[v[0] + 1] for v in vs], None))
+
+    threads = [threading.Thread(target=work, args=(keys if i % 2 else keys[::-1],)) for i in range(6)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    assert [t.get(k)["n"] for k in keys] == [1200] * 3
+
+
+def test_full_table_allows_request(tmp_path, monkeypatch, clock):
+    t = SharedSlotTable(tmp_path / "full.shm", ("tat",), fmt="d", slots=2)
+    t.update("x", lambda v: ([1.0], None))
+    t.update("y", lambda v: ([1.0], None))
+    monkeypatch.setattr(utils, "_rate_table", t)
+    assert utils.rate_check_scopes(user="u") == (True, 0.0)
@@ -0,0 +1,162 @@
+import json
+import multiprocessing
+
+import pytest
+
+from app.record_store import RecordStore, op_put, op_incr, op_del
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "store.jsonl"
+
+
+def _append_raw(path, data):
+    with open(path, "ab") as f:
+        f.write(data)
+
+
+def _writer(path, worker, n):
+    store = RecordStore(path)
+    for i in range(n):
+        store.put("item", f"{worker}-{i}", {"worker": worker, "i": i})
+        store.incr("stats", "total", {"n": 1})
+
+
+def test_two_instances_converge(path):
+    a, b = RecordStore(path), RecordStore(path)
+    a.put("item", "x", {"v": 1})
+    assert b.get("item", "x") == {"v": 1}
+    b.patch("item", "x", {"w": 2})
+    b.incr("stats", "total", {"n": 3})
+    assert a.get("item", "x") == {"v": 1, "w": 2}
+    assert a.get("stats", "total") == {"n": 3}
+    a.delete("item", "x")
+    assert b.get("item", "x") is None
+
+
+def test_processes_converge(path):
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=_writer, args=(str(path), w, 50)) for w in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+        assert p.exitcode == 0
+    store = RecordStore(path)
+    assert store.count("item") == 200
+    assert store.get("stats", "total") == {"n": 200}
+
+
+def test_compaction_while_reader_mid_tail(path):
+    reader, writer = RecordStore(path), RecordStore(path)
+    writer.put("item", "a", {"v": 1})
+    assert reader.get("item", "a") == {"v": 1}
+    writer.put("item", "b", {"v": 2})
+    # the reader is behind and the last line is still being written
+    _append_raw(path, b'{"op":"put","ns":"item","k":"c","v":{')
+    assert reader.get("item", "b") == {"v": 2}
+    assert reader.get("item", "c") is None
+    writer.delete("item", "a")
+    writer.compact()
+    writer.put("item", "d", {"v": 4})
+    assert reader.get("item", "a") is None
+    assert {k for k, _ in reader.items("item")} == {"b", "d"}
+
+
+def test_truncated_trailing_line_is_repaired_by_next_commit(path):
+    a, b = RecordStore(path), RecordStore(path)
+    a.put("item", "x", {"v": 1})
+    _append_raw(path, b'{"op":"put","ns":"item","k":"torn"')
+    assert b.get("item", "torn") is None
+    b.put("item", "y", {"v": 2})
+    lines = path.read_bytes().split(b"\n")
+    assert lines[-3] == b'{"op":"put","ns":"item","k":"torn"'
+    assert json.loads(lines[-2])["k"] == "y"
+    assert a.get("item", "y") == {"v": 2}
+    assert a.get("item", "torn") is None
+    assert RecordStore(path).count("item") == 2
+
+
+def test_batch_is_all_or_nothing(path):
+    a, b = RecordStore(path), RecordStore(path)
+    a.commit([op_put("item", "x", {"v": 1}), op_incr("stats", "total", {"n": 1})])
+    assert b.get("item", "x") == {"v": 1} and b.get("stats", "total") == {"n": 1}
+    batch = {"op": "batch", "ops": [op_del("item", "x"), op_incr("stats", "total", {"n": 1})]}
+    line = json.dumps(batch, separators=(",", ":")).encode("utf-8")
+    _append_raw(path, line[:len(line) // 2])
+    assert b.get("item", "x") == {"v": 1} and b.get("stats", "total") == {"n": 1}
+    _append_raw(path, line[len(line) // 2:] + b"\n")
+    assert b.get("item", "x") is None and b.get("stats", "total") == {"n": 2}
+
+
+def test_new_generation_reloads_even_when_file_grew(path):
+    a, b = RecordStore(path), RecordStore(path)
+    a.put("item", "x", {"v": 1})
+    assert b.get("item", "x") == {"v": 1}
+    a.delete("item", "x")
+    a.compact()
+    # more data than before, so size and offset alone would not show the rewrite
+    for i in range(20):
+        a.put("item", f"n{i}", {"v": i})
+    assert b.get("item", "x") is None
+    assert b.count("item") == 20
+
+
+def test_headerless_log_reloads_on_new_inode(path):
+    path.write_bytes(b'{"op":"put","ns":"item","k":"x","v":{"v":1}}\n')
+    store = RecordStore(path)
+    assert store.get("item", "x") == {"v": 1}
+    tmp = path.with_suffix(".new")
+    tmp.write_bytes(b'{"op":"put","ns":"item","k":"y","v":{"v":2}}\n')
+    tmp.replace(path)
+    assert store.get("item", "x") is None
+    assert store.get("item", "y") == {"v": 2}
+
+
+def test_listener_reset_and_replay(path):
+    a, b = RecordStore(path), RecordStore(path)
+    a.put("item", "x", {"v": 1})
+    seen, resets = {}, []
+
+    def apply(ns, key, old, new):
+        if new is None:
+            seen.pop(key, None)
+        else:
+            seen[key] = new
+
+    def reset():
+        resets.append(1)
+        seen.clear()
+
+    b.sync()
+    b.add_listener(apply, reset)
+    assert seen == {"x": {"v": 1}}
+    a.put("item", "y", {"v": 2})
+    b.sync()
+    assert seen == {"x": {"v": 1}, "y": {"v": 2}}
+    a.delete("item", "x")
+    a.compact()
+    b.sync()
+    assert resets == [1]
+    assert seen == {"y": {"v": 2}}
+
+
+def test_bootstrap_runs_once(path):
+    calls = []
+
+    def bootstrap():
+        calls.append(1)
+        return [op_put("item", "seed", {"v": 0})]
+
+    assert RecordStore(path, bootstrap=bootstrap).get("item", "seed") == {"v": 0}
+    assert RecordStore(path, bootstrap=bootstrap).get("item", "seed") == {"v": 0}
+    assert calls == [1]
+
+
+def test_commit_compacts_past_threshold(path):
+    store = RecordStore(path, compact_min=10, compact_ratio=2)
+    for i in range(30):
+        store.put("item", "x", {"v": i})
+    assert len(path.read_bytes().splitlines()) < 12
+    assert RecordStore(path).get("item", "x") == {"v": 29}
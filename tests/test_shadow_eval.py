@@ -0,0 +1,119 @@
+import importlib
+import sys
+import types
+
+import numpy as np
+import pytest
+
+VERSION = "v20260101-000000-cand"
+
+
+@pytest.fixture
+def shadow(tmp_path, monkeypatch):
+    """app.shadow_eval with its log under tmp_path; the model layer (TensorFlow) is not loaded."""
+    registry = types.SimpleNamespace(candidate=lambda: VERSION, current=lambda: "v20250101-000000-cur")
+    model_utils = types.ModuleType("app.model_utils")
+    model_utils.model_registry = registry
+    model_utils.load_version = model_utils.infer = None
+    monkeypatch.setitem(sys.modules, "app.model_utils", model_utils)
+    monkeypatch.delitem(sys.modules, "app.shadow_eval", raising=False)
+    module = importlib.import_module("app.shadow_eval")
+    monkeypatch.setattr(module, "SHADOW_DIR", tmp_path / "shadow")
+    for name, value in {"SHADOW_MIN_SAMPLES": 10, "SHADOW_MIN_AGREEMENT": 0.8, "SHADOW_MIN_SECONDARY": 5,
+                        "SHADOW_AGREEMENT_TOLERANCE": 0.02, "SHADOW_MAX_LATENCY_RATIO": 1.5,
+                        "SHADOW_MAX_P95_MS": 0}.items():
+        monkeypatch.setattr(module, name, value)
+    yield module
+    sys.modules.pop("app.shadow_eval", None)
+
+
+def _rows(n, label=0, current_label=0, secondary_label=0, latency=10.0, current_ms=10.0, start=0):
+    return [{"version": VERSION, "ts": float(start + i), "label": label, "confidence": 0.9,
+             "latency_ms": latency, "current_label": current_label, "current_ms": current_ms,
+             "secondary_label": secondary_label} for i in range(n)]
+
+
+def test_gate_passes(shadow):
+    shadow._append(VERSION, _rows(10))
+    report = shadow.evaluate()
+    assert report["passed"], report["reasons"]
+    assert report["samples"] == 10
+    assert report["agreement_current"] == 1.0 and report["agreement_secondary"] == 1.0
+
+
+def test_gate_without_samples(shadow):
+    report = shadow.evaluate()
+    assert not report["passed"] and report["reasons"] == ["no shadow samples yet"]
+
+
+def test_gate_needs_min_samples(shadow):
+    shadow._append(VERSION, _rows(9))
+    report = shadow.evaluate()
+    assert not report["passed"] and report["reasons"] == ["9 of 10 samples"]
+
+
+def test_gate_needs_agreement_with_current(shadow):
+    # 7 of 10 agree with the current model; the secondary provider agrees with the candidate
+    shadow._append(VERSION, _rows(7) + _rows(3, label=2, current_label=0, secondary_label=2, start=7))
+    report = shadow.evaluate()
+    assert report["agreement_current"] == 0.7
+    assert not report["passed"] and len(report["reasons"]) == 1
+    assert "below the 80% floor" in report["reasons"][0]
+
+
+def test_gate_needs_secondary_labels(shadow):
+    shadow._append(VERSION, _rows(6, secondary_label=shadow.NO_LABEL) + _rows(4, start=6))
+    report = shadow.evaluate()
+    assert not report["passed"] and report["reasons"] == ["4 of 5 samples with a secondary label"]
+
+
+def test_gate_rejects_worse_secondary_agreement(shadow):
+    # candidate and current differ on 1 of 10; the secondary provider sides with current
+    shadow._append(VERSION, _rows(9) + _rows(1, label=2, current_label=0, secondary_label=0, start=9))
+    report = shadow.evaluate()
+    assert report["agreement_secondary"] == 0.9 and report["current_agreement_secondary"] == 1.0
+    assert not report["passed"] and "secondary provider" in report["reasons"][0]
+
+
+def test_gate_latency(shadow, monkeypatch):
+    shadow._append(VERSION, _rows(10, latency=16.0, current_ms=10.0))
+    assert any("1.5x" in r for r in shadow.evaluate()["reasons"])
+    monkeypatch.setattr(shadow, "SHADOW_MAX_LATENCY_RATIO", 2.0)
+    monkeypatch.setattr(shadow, "SHADOW_MAX_P95_MS", 15)
+    assert shadow.evaluate()["reasons"] == ["p95 latency 16.0 ms is over the 15 ms budget"]
+
+
+def test_append_repairs_ragged_columns(shadow):
+    shadow._append(VERSION, _rows(3))
+    d = shadow._log_dir(VERSION)
+    # a writer died after writing two columns of its batch
+    for name in ("ts", "label"):
+        with open(d / f"{name}.col", "ab") as f:
+            f.write(np.zeros(2, dtype=shadow.COLUMNS[name]).tobytes())
+    assert len(shadow.read_log(VERSION)["ts"]) == 3
+    shadow._append(VERSION, _rows(2, label=1, start=3))
+    for name, dtype in shadow.COLUMNS.items():
+        assert (d / f"{name}.col").stat().st_size == 5 * np.dtype(dtype).itemsize
+    log = shadow.read_log(VERSION)
+    assert log["ts"].tolist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert log["label"].tolist() == [0, 0, 0, 1, 1]
+
+
+def test_append_truncates_every_column_before_writing(shadow, monkeypatch):
+    shadow._append(VERSION, _rows(3))
+    d = shadow._log_dir(VERSION)
+    with open(d / "ts.col", "ab") as f:
+        f.write(np.zeros(1, dtype=np.float64).tobytes())
+    sizes = {}
+    real_array = np.array
+
+    def watch(values, dtype=None):
+        # called once per column write; by then every column must already be cut back
+        if not sizes:
+            sizes.update({name: (d / f"{name}.col").stat().st_size // np.dtype(t).itemsize
+                          for name, t in shadow.COLUMNS.items()})
+        return real_array(values, dtype=dtype)
+
+    monkeypatch.setattr(shadow.np, "array", watch)
+    shadow._append(VERSION, _rows(1, start=3))
+    assert set(sizes.values()) == {3}